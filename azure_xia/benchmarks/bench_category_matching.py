@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Category Matching Microbenchmark
+Compares the compiled KeywordIndex with the original per-keyword loop
+used by FieldNormalizer._match_mappings (substring semantics).
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from prepare.normalize_labels import FieldNormalizer
+
+
+def match_categories_loop(text, mapping):
+    """Original nested-loop matcher, kept here as the baseline."""
+    matches = []
+    for category, keywords in mapping.items():
+        for keyword in keywords:
+            if keyword in text:
+                matches.append(category)
+                break
+    return matches
+
+
+def match_mappings_loop(text, mappings):
+    """Baseline equivalent of FieldNormalizer._match_mappings: one loop scan per mapping."""
+    return {name: match_categories_loop(text, mapping) for name, mapping in mappings.items()}
+
+
+def best_time(func, repeats):
+    """Return the best wall-clock time of func over repeats."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def grow_mapping(mapping, multiplier):
+    """Simulate a larger synonym table with extra keywords that never match."""
+    return {
+        category: keywords + [f"{keyword} synonym {i}" for i in range(multiplier - 1) for keyword in keywords]
+        for category, keywords in mapping.items()
+    }
+
+
+def main():
+    """Run the benchmark on the population/treatment/outcome columns of a processed CSV."""
+    if len(sys.argv) < 2:
+        print("Usage: python bench_category_matching.py <processed_csv> [synonym_multiplier] [repeats]")
+        sys.exit(1)
+    
+    input_path = sys.argv[1]
+    multiplier = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    
+    df = pd.read_csv(input_path)
+    # Substring matching, the semantics of the original loop
+    normalizer = FieldNormalizer(keyword_boundaries='none')
+    
+    # Same grouping as normalize_population / normalize_treatments / normalize_outcomes
+    workloads = [
+        ('population', {
+            'age_group': normalizer.age_group_mapping,
+            'sex': normalizer.sex_mapping,
+            'clinical_cohort': normalizer.clinical_cohort_mapping,
+            'setting': normalizer.setting_mapping
+        }),
+        ('treatments', {'categories': normalizer.treatment_category_mapping}),
+        ('outcomes', {'categories': normalizer.outcome_direction_mapping})
+    ]
+    
+    cases = []
+    keyword_count = 0
+    for column, mappings in workloads:
+        mappings = {name: grow_mapping(mapping, multiplier) for name, mapping in mappings.items()}
+        keyword_count += sum(len(keywords) for mapping in mappings.values() for keywords in mapping.values())
+        texts = [str(text).lower() for text in df[column].dropna()] if column in df.columns else []
+        cases.append((texts, mappings))
+    
+    for texts, mappings in cases:
+        for text in texts:
+            assert normalizer._match_mappings(text, mappings) == match_mappings_loop(text, mappings)
+    
+    def run_loop():
+        for texts, mappings in cases:
+            for text in texts:
+                match_mappings_loop(text, mappings)
+    
+    def run_compiled():
+        for texts, mappings in cases:
+            for text in texts:
+                normalizer._match_mappings(text, mappings)
+    
+    loop_time = best_time(run_loop, repeats)
+    compiled_time = best_time(run_compiled, repeats)
+    
+    print(f"Texts: {sum(len(texts) for texts, _ in cases)}, keywords: {keyword_count}")
+    print(f"  keyword loop:     {loop_time * 1000:.1f} ms")
+    print(f"  KeywordIndex:     {compiled_time * 1000:.1f} ms")
+    print(f"  speedup:          {loop_time / compiled_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
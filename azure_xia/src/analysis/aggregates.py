@@ -5,271 +5,265 @@ Performs population-stratum aggregation analysis for mental health literature.
 
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Any
-from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
 import logging
 
+from analysis.aggregation_engine import AggregationEngine
+from analysis.hyperloglog import precision_for_error
+from analysis.item_matrix import StratumItemMatrix
+from analysis.stratum_state import StratumState
+from loaders.table_io import result_table_path, write_table, write_tables_manifest
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Pools for analyze_by_strata(parallel=...)
+PARALLEL_POOLS = {'threads': ThreadPoolExecutor, 'processes': ProcessPoolExecutor}
+
 
 class StratumAggregator:
     """Performs aggregation analysis by population strata."""
     
-    def __init__(self, min_stratum_size: int = 3):
+    def __init__(self, min_stratum_size: int = 3, approximate_error: Optional[float] = None):
         """Initialize the aggregator.
         
         Args:
             min_stratum_size: Minimum number of studies required for a stratum to be included
+            approximate_error: Relative standard error of HyperLogLog study counts
+                (default: exact counts)
         """
         self.min_stratum_size = min_stratum_size
+        self.approximate_error = approximate_error
+        self.precision = precision_for_error(approximate_error) if approximate_error is not None else None
+        # Sparse risk factor and symptom matrices behind the most recently emitted tables
+        self.item_matrices: Dict[str, StratumItemMatrix] = {}
     
-    def analyze_by_strata(self, df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
-        """Perform comprehensive stratum analysis."""
+    def analyze_by_strata(self, df: pd.DataFrame, engine: Optional[AggregationEngine] = None,
+                          parallel: Optional[str] = None, workers: Optional[int] = None) -> Dict[str, pd.DataFrame]:
+        """Perform comprehensive stratum analysis.
+        
+        Args:
+            df: Long-format table
+            engine: Aggregation engine over df, to share its work with other aggregators
+            parallel: 'threads' or 'processes' to count the tables and build the results
+                concurrently (default: serial)
+            workers: Pool size (default: one worker per result table)
+        """
         logger.info(f"Analyzing {len(df)} records across strata")
+        engine = engine or AggregationEngine(df, self.approximate_error)
+        if parallel is None:
+            return self.tables_from_state(engine.stratum_state())
+        
+        if parallel not in PARALLEL_POOLS:
+            raise ValueError(f"Unknown parallel mode '{parallel}', expected one of {list(PARALLEL_POOLS)}")
+        workers = workers or 6  # one per result table
+        logger.info(f"Running the stratum analyses in {workers} {parallel}")
+        with PARALLEL_POOLS[parallel](max_workers=workers) as executor:
+            return self.tables_from_state(engine.stratum_state(executor), executor)
+    
+    def analyze_incremental(self, df: pd.DataFrame, state_dir: str, batch_id: str = None) -> Dict[str, pd.DataFrame]:
+        """Fold a batch of new records into the persisted stratum state and re-emit all tables.
+        
+        Args:
+            df: Only the long-format rows added since the last run
+            state_dir: Directory holding the stratum state (created on first use)
+            batch_id: Identifier of the batch; batches already folded in are skipped
+        """
+        state = StratumState.load(state_dir, self.precision)
+        if state.precision != self.precision:
+            raise ValueError(f"Stratum state in {state_dir} uses sketch precision {state.precision}, "
+                             f"not {self.precision}; use the same --approximate setting or rebuild it")
+        state = state.fold(df, batch_id)
+        state.save(state_dir)
+        return self.tables_from_state(state)
+    
+    def tables_from_state(self, state: StratumState, executor: Optional[Executor] = None) -> Dict[str, pd.DataFrame]:
+        """Build all result tables from (possibly merged) stratum aggregates.
         
-        # Filter to strata with sufficient data
-        stratum_counts = df['stratum_id'].value_counts()
-        valid_strata = stratum_counts[stratum_counts >= self.min_stratum_size].index
-        df_filtered = df[df['stratum_id'].isin(valid_strata)]
+        With an executor, each result table is built as a separate task; the tasks only
+        read the state's count tables, so they run independently.
+        """
+        # Filter to strata with sufficient data, in order of first appearance
+        strata = state.strata[state.strata['total_records'] >= self.min_stratum_size]
+        strata = strata.sort_values('first', kind='stable').reset_index(drop=True)
+        strata['rank'] = np.arange(len(strata))
+        strata['unique_studies'] = strata['stratum_id'].map(state.study_counts()).fillna(0).astype(int)
+        strata['journals_count'] = strata['stratum_id'].map(state.journals.groupby('stratum_id').size()).fillna(0).astype(int)
+        
+        logger.info(f"Analyzing {len(strata)} strata with >= {self.min_stratum_size} studies")
+        
+        counts = state.counts.merge(strata[['stratum_id', 'rank', 'unique_studies']], on='stratum_id')
+        tables = {table: table_counts for table, table_counts in counts.groupby('table', sort=False)}
         
-        logger.info(f"Analyzing {len(valid_strata)} strata with >= {self.min_stratum_size} studies")
+        # Free-text items stay sparse; their long tables are derived from the matrices
+        matrices = {
+            'risk_factors': self._item_matrix(strata, tables, 'risk_factor'),
+            'symptoms': self._item_matrix(strata, tables, 'symptom')
+        }
         
-        results = {
-            'risk_factors': self._analyze_risk_factors(df_filtered),
-            'symptoms': self._analyze_symptoms(df_filtered),
-            'treatments': self._analyze_treatments(df_filtered),
-            'outcomes': self._analyze_outcomes(df_filtered),
-            'treatment_outcomes': self._analyze_treatment_outcomes(df_filtered),
-            'stratum_summary': self._create_stratum_summary(df_filtered)
+        analyses = {
+            'risk_factors': (self._analyze_risk_factors, matrices['risk_factors']),
+            'symptoms': (self._analyze_symptoms, matrices['symptoms']),
+            'treatments': (self._analyze_treatments, tables),
+            'outcomes': (self._analyze_outcomes, tables),
+            'treatment_outcomes': (self._analyze_treatment_outcomes, tables),
+            'stratum_summary': (self._create_stratum_summary, strata, tables, matrices['risk_factors'])
         }
+        if executor is None:
+            results = {name: analysis(*args) for name, (analysis, *args) in analyses.items()}
+        else:
+            tasks = {name: executor.submit(analysis, *args) for name, (analysis, *args) in analyses.items()}
+            results = {name: task.result() for name, task in tasks.items()}
         
+        self.item_matrices = matrices
         return results
     
-    def _analyze_risk_factors(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _sorted_counts(self, tables: Dict[str, pd.DataFrame], table: str, by_count: bool = True) -> pd.DataFrame:
+        """Counts of one table in stratum order, then by count like value_counts().
+        
+        Ties (or all rows if by_count is False) keep the order of first appearance.
+        """
+        counts = tables.get(table)
+        if counts is None:
+            return pd.DataFrame(columns=['stratum_id', 'value', 'value2', 'count', 'first', 'rank', 'unique_studies'])
+        if by_count:
+            return counts.sort_values(['rank', 'count', 'first'], ascending=[True, False, True])
+        return counts.sort_values(['rank', 'first'])
+    
+    def _frequency_table(self, counts: pd.DataFrame, value_column: str) -> pd.DataFrame:
+        """Attach study totals and percentages to a count table."""
+        count = counts['count'].to_numpy()
+        total_studies = counts['unique_studies'].to_numpy()
+        return pd.DataFrame({
+            'stratum_id': counts['stratum_id'].to_numpy(),
+            value_column: counts['value'].to_numpy(),
+            'count': count,
+            'total_studies': total_studies,
+            'percentage': (count / total_studies) * 100
+        })
+    
+    def _item_matrix(self, strata: pd.DataFrame, tables: Dict[str, pd.DataFrame], table: str) -> StratumItemMatrix:
+        """Stratum x item count matrix of one multi-value table over the kept strata."""
+        counts = tables.get(table)
+        if counts is None:
+            counts = pd.DataFrame(columns=['stratum_id', 'value', 'count', 'first'])
+        return StratumItemMatrix.from_counts(counts, strata['stratum_id'], strata['unique_studies'].to_numpy())
+    
+    def _analyze_risk_factors(self, matrix: StratumItemMatrix) -> pd.DataFrame:
         """Analyze risk factors by stratum."""
         logger.info("Analyzing risk factors by stratum")
         
-        # Explode risk factors
-        risk_data = []
-        for _, row in df.iterrows():
-            if pd.notna(row['risk_factors']) and row['risk_factors']:
-                factors = [f.strip() for f in str(row['risk_factors']).split(';') if f.strip()]
-                for factor in factors:
-                    risk_data.append({
-                        'stratum_id': row['stratum_id'],
-                        'pmid': row['pmid'],
-                        'risk_factor': factor
-                    })
-        
-        if not risk_data:
+        if matrix.nnz == 0:
             return pd.DataFrame()
-        
-        risk_df = pd.DataFrame(risk_data)
-        
-        # Calculate frequencies
-        result = []
-        for stratum in df['stratum_id'].unique():
-            stratum_pmids = df[df['stratum_id'] == stratum]['pmid'].nunique()
-            stratum_risks = risk_df[risk_df['stratum_id'] == stratum]
-            
-            factor_counts = stratum_risks['risk_factor'].value_counts()
-            
-            for factor, count in factor_counts.items():
-                result.append({
-                    'stratum_id': stratum,
-                    'risk_factor': factor,
-                    'count': count,
-                    'total_studies': stratum_pmids,
-                    'percentage': (count / stratum_pmids) * 100
-                })
-        
-        return pd.DataFrame(result)
+        return matrix.to_frame('risk_factor')
     
-    def _analyze_symptoms(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _analyze_symptoms(self, matrix: StratumItemMatrix) -> pd.DataFrame:
         """Analyze symptoms by stratum."""
         logger.info("Analyzing symptoms by stratum")
         
-        # Filter out rows without symptoms
-        df_with_symptoms = df[df['symptoms'].notna() & (df['symptoms'] != '')]
-        
-        if df_with_symptoms.empty:
-            return pd.DataFrame()
-        
-        # Explode symptoms
-        symptom_data = []
-        for _, row in df_with_symptoms.iterrows():
-            symptoms = [s.strip() for s in str(row['symptoms']).split(';') if s.strip()]
-            for symptom in symptoms:
-                symptom_data.append({
-                    'stratum_id': row['stratum_id'],
-                    'pmid': row['pmid'],
-                    'symptom': symptom
-                })
-        
-        if not symptom_data:
+        if matrix.nnz == 0:
             return pd.DataFrame()
-        
-        symptom_df = pd.DataFrame(symptom_data)
-        
-        # Calculate frequencies
-        result = []
-        for stratum in df['stratum_id'].unique():
-            stratum_pmids = df[df['stratum_id'] == stratum]['pmid'].nunique()
-            stratum_symptoms = symptom_df[symptom_df['stratum_id'] == stratum]
-            
-            symptom_counts = stratum_symptoms['symptom'].value_counts()
-            
-            for symptom, count in symptom_counts.items():
-                result.append({
-                    'stratum_id': stratum,
-                    'symptom': symptom,
-                    'count': count,
-                    'total_studies': stratum_pmids,
-                    'percentage': (count / stratum_pmids) * 100
-                })
-        
-        return pd.DataFrame(result)
+        return matrix.to_frame('symptom')
     
-    def _analyze_treatments(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _analyze_treatments(self, tables: Dict[str, pd.DataFrame]) -> pd.DataFrame:
         """Analyze treatments by stratum."""
         logger.info("Analyzing treatments by stratum")
         
-        result = []
-        for stratum in df['stratum_id'].unique():
-            stratum_data = df[df['stratum_id'] == stratum]
-            stratum_pmids = stratum_data['pmid'].nunique()
-            
-            # Treatment categories
-            treatment_cats = stratum_data['treatment_category'].value_counts()
-            
-            for category, count in treatment_cats.items():
-                result.append({
-                    'stratum_id': stratum,
-                    'treatment_type': 'category',
-                    'treatment': category,
-                    'count': count,
-                    'total_studies': stratum_pmids,
-                    'percentage': (count / stratum_pmids) * 100
-                })
-            
-            # Treatment names (if available)
-            treatment_names_data = []
-            for _, row in stratum_data.iterrows():
-                if pd.notna(row['treatment_names']) and row['treatment_names']:
-                    names = [n.strip() for n in str(row['treatment_names']).split(';') if n.strip()]
-                    treatment_names_data.extend(names)
-            
-            if treatment_names_data:
-                name_counts = Counter(treatment_names_data)
-                for name, count in name_counts.items():
-                    result.append({
-                        'stratum_id': stratum,
-                        'treatment_type': 'name',
-                        'treatment': name,
-                        'count': count,
-                        'total_studies': stratum_pmids,
-                        'percentage': (count / stratum_pmids) * 100
-                    })
+        # Treatment categories most frequent first, then names in order of first mention
+        category_counts = self._sorted_counts(tables, 'treatment_category').assign(treatment_type='category')
+        name_counts = self._sorted_counts(tables, 'treatment_name', by_count=False).assign(treatment_type='name')
+        
+        counts = pd.concat([category_counts, name_counts], ignore_index=True)
+        if counts.empty:
+            return pd.DataFrame()
+        counts = counts.sort_values('rank', kind='stable')
         
-        return pd.DataFrame(result)
+        table = self._frequency_table(counts, 'treatment')
+        table.insert(1, 'treatment_type', counts['treatment_type'].to_numpy())
+        return table
     
-    def _analyze_outcomes(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _analyze_outcomes(self, tables: Dict[str, pd.DataFrame]) -> pd.DataFrame:
         """Analyze outcomes by stratum."""
         logger.info("Analyzing outcomes by stratum")
         
-        result = []
-        for stratum in df['stratum_id'].unique():
-            stratum_data = df[df['stratum_id'] == stratum]
-            stratum_pmids = stratum_data['pmid'].nunique()
-            
-            outcome_counts = stratum_data['outcome_direction'].value_counts()
-            
-            for direction, count in outcome_counts.items():
-                result.append({
-                    'stratum_id': stratum,
-                    'outcome_direction': direction,
-                    'count': count,
-                    'total_studies': stratum_pmids,
-                    'percentage': (count / stratum_pmids) * 100
-                })
-        
-        return pd.DataFrame(result)
+        counts = self._sorted_counts(tables, 'outcome_direction')
+        if counts.empty:
+            return pd.DataFrame()
+        return self._frequency_table(counts, 'outcome_direction')
     
-    def _analyze_treatment_outcomes(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _analyze_treatment_outcomes(self, tables: Dict[str, pd.DataFrame]) -> pd.DataFrame:
         """Analyze treatment-outcome combinations by stratum."""
         logger.info("Analyzing treatment-outcome combinations")
         
-        result = []
-        for stratum in df['stratum_id'].unique():
-            stratum_data = df[df['stratum_id'] == stratum]
-            
-            # Group by treatment category and outcome direction
-            combinations = stratum_data.groupby(['treatment_category', 'outcome_direction']).size().reset_index(name='count')
-            
-            for _, row in combinations.iterrows():
-                stratum_pmids = stratum_data['pmid'].nunique()
-                result.append({
-                    'stratum_id': stratum,
-                    'treatment_category': row['treatment_category'],
-                    'outcome_direction': row['outcome_direction'],
-                    'count': row['count'],
-                    'total_studies': stratum_pmids,
-                    'percentage': (row['count'] / stratum_pmids) * 100
-                })
+        counts = tables.get('treatment_outcome')
+        if counts is None or counts.empty:
+            return pd.DataFrame()
         
-        return pd.DataFrame(result)
+        # Combinations sorted by treatment category and outcome direction within each stratum
+        counts = counts.sort_values(['rank', 'value', 'value2'])
+        table = self._frequency_table(counts, 'treatment_category')
+        table.insert(2, 'outcome_direction', counts['value2'].to_numpy())
+        return table
     
-    def _create_stratum_summary(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _create_stratum_summary(self, strata: pd.DataFrame, tables: Dict[str, pd.DataFrame],
+                                risk_factors: StratumItemMatrix) -> pd.DataFrame:
         """Create summary statistics for each stratum."""
         logger.info("Creating stratum summary")
         
-        result = []
-        for stratum in df['stratum_id'].unique():
-            stratum_data = df[df['stratum_id'] == stratum]
-            
-            # Parse stratum components
-            components = stratum.split('|') if stratum != 'general' else ['general']
-            
-            summary = {
-                'stratum_id': stratum,
-                'total_records': len(stratum_data),
-                'unique_studies': stratum_data['pmid'].nunique(),
-                'year_range': f"{stratum_data['year'].min():.0f}-{stratum_data['year'].max():.0f}",
-                'journals_count': stratum_data['journal'].nunique(),
-                'components': '; '.join(components)
-            }
-            
-            # Most common elements
-            summary['top_risk_factor'] = self._get_top_item(stratum_data, 'risk_factors')
-            summary['top_treatment'] = stratum_data['treatment_category'].mode().iloc[0] if not stratum_data['treatment_category'].empty else 'unknown'
-            summary['top_outcome'] = stratum_data['outcome_direction'].mode().iloc[0] if not stratum_data['outcome_direction'].empty else 'unknown'
-            
-            result.append(summary)
+        if strata.empty:
+            return pd.DataFrame()
         
-        return pd.DataFrame(result)
-    
-    def _get_top_item(self, stratum_data: pd.DataFrame, field: str) -> str:
-        """Get the most common item from a multi-valued field."""
-        items = []
-        for _, row in stratum_data.iterrows():
-            if pd.notna(row[field]) and row[field]:
-                field_items = [item.strip() for item in str(row[field]).split(';') if item.strip()]
-                items.extend(field_items)
+        # Parse stratum components
+        components = ['general' if stratum == 'general' else '; '.join(stratum.split('|'))
+                      for stratum in strata['stratum_id']]
         
-        if items:
-            return Counter(items).most_common(1)[0][0]
-        return 'unknown'
+        summary = pd.DataFrame({
+            'stratum_id': strata['stratum_id'].to_numpy(),
+            'total_records': strata['total_records'].to_numpy(),
+            'unique_studies': strata['unique_studies'].to_numpy(),
+            'year_range': [f"{year_min:.0f}-{year_max:.0f}"
+                           for year_min, year_max in zip(strata['year_min'], strata['year_max'])],
+            'journals_count': strata['journals_count'].to_numpy(),
+            'components': components
+        })
+        
+        # Most common elements
+        summary['top_risk_factor'] = risk_factors.top_labels()
+        summary['top_treatment'] = self._top_labels(strata, tables, 'treatment_category')
+        summary['top_outcome'] = self._top_labels(strata, tables, 'outcome_direction')
+        
+        return summary
+    
+    def _top_labels(self, strata: pd.DataFrame, tables: Dict[str, pd.DataFrame], table: str) -> np.ndarray:
+        """Most frequent label per stratum; ties go to the smallest label, like mode()."""
+        counts = self._sorted_counts(tables, table)
+        counts = counts.sort_values(['rank', 'count', 'value'], ascending=[True, False, True])
+        return self._get_top_item(strata, counts)
     
-    def save_analysis_results(self, results: Dict[str, pd.DataFrame], output_dir: str):
-        """Save all analysis results to CSV files."""
+    def _get_top_item(self, strata: pd.DataFrame, sorted_counts: pd.DataFrame) -> np.ndarray:
+        """First value per stratum of a sorted count table, 'unknown' if the stratum has none."""
+        top = sorted_counts.drop_duplicates('stratum_id').set_index('stratum_id')['value']
+        return strata['stratum_id'].map(top).fillna('unknown').to_numpy()
+    
+    def save_analysis_results(self, results: Dict[str, pd.DataFrame], output_dir: str,
+                              matrices: Optional[Dict[str, StratumItemMatrix]] = None,
+                              table_format: str = 'csv'):
+        """Save all analysis results as csv, parquet or feather tables, and item matrices to .npz files."""
         logger.info(f"Saving analysis results to {output_dir}")
         
         for name, df in results.items():
             if not df.empty:
-                output_path = f"{output_dir}/{name}_by_stratum.csv"
-                df.to_csv(output_path, index=False)
+                output_path = result_table_path(output_dir, name, table_format)
+                write_table(df, output_path, table_format)
                 logger.info(f"Saved {name} analysis to {output_path}")
+        write_tables_manifest(output_dir, table_format)
+        
+        for name, matrix in (matrices or {}).items():
+            if matrix.nnz > 0:
+                output_path = f"{output_dir}/{name}_matrix.npz"
+                matrix.save(output_path)
+                logger.info(f"Saved {name} matrix ({matrix.counts.shape[0]} x {matrix.counts.shape[1]}) to {output_path}")
 
 
 def main():
@@ -277,7 +271,7 @@ def main():
     import sys
     
     if len(sys.argv) != 3:
-        print("Usage: python aggregates.py <input_csv> <output_dir>")
+        print("Usage (from src): python -m analysis.aggregates <input_csv> <output_dir>")
         sys.exit(1)
     
     input_path = sys.argv[1]
@@ -292,7 +286,7 @@ def main():
     results = aggregator.analyze_by_strata(df)
     
     # Save results
-    aggregator.save_analysis_results(results, output_dir)
+    aggregator.save_analysis_results(results, output_dir, aggregator.item_matrices)
     
     print("\nAnalysis Summary:")
     for name, df_result in results.items():
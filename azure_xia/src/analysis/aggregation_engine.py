@@ -0,0 +1,276 @@
+"""
+Aggregation Engine Module
+Vectorized per-stratum frequency tables driven by declarative specs, shared by the aggregator variants.
+"""
+
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+
+import pandas as pd
+import numpy as np
+
+from analysis.hyperloglog import StudySketches, precision_for_error
+from analysis.stratum_state import StratumState
+from prepare.long_format import codes_and_labels
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class FrequencySpec:
+    """Declarative description of one per-stratum frequency table.
+    
+    Attributes:
+        name: Result table name
+        columns: Source columns; several columns count combinations
+        labels: Output names of the value columns
+        output_columns: Column order of the result table
+        exclude: Vectorized test over the distinct source labels (see label_mask());
+            rows matching it in any column are dropped
+        categorizers: Per-column label -> category functions (None keeps the label)
+        exclude_categories: Categories whose rows are dropped after categorizing
+        count: 'studies' counts distinct PMIDs, 'records' counts rows
+        count_label: Output name of the count column
+        denominator: 'stratum' divides by all PMIDs of the stratum, 'kept' only by
+            the PMIDs of the rows left after the exclusions
+        min_percentage: Rows below this share of the denominator are dropped
+        keep_empty: Return the table even if no row reaches min_percentage
+        order: 'sorted' lists strata by label, 'appearance' by first kept row
+    """
+    name: str
+    columns: Tuple[str, ...]
+    labels: Tuple[str, ...]
+    output_columns: Tuple[str, ...]
+    exclude: Optional[Callable[[pd.Series], np.ndarray]] = None
+    categorizers: Tuple[Optional[Callable[[Any], Any]], ...] = ()
+    exclude_categories: Tuple[Any, ...] = ()
+    count: str = 'studies'
+    count_label: str = 'study_count'
+    denominator: str = 'stratum'
+    min_percentage: float = 0.0
+    keep_empty: bool = True
+    order: str = 'sorted'
+
+
+class AggregationEngine:
+    """Computes stratum summaries and frequency tables for one long-format table.
+    
+    Strata, PMIDs and value columns are factorized once; exclusion predicates and
+    categorizers run once per distinct label and are cached, so several specs (or
+    several aggregator variants) over the same table share that work.
+    
+    With approximate_error set, distinct studies are estimated from HyperLogLog
+    sketches (see analysis.hyperloglog) instead of exact distinct sets.
+    """
+    
+    def __init__(self, df: pd.DataFrame, approximate_error: Optional[float] = None):
+        """Factorize the stratum and PMID columns of a long-format table.
+        
+        Args:
+            df: Long-format table with stratum_id, pmid and year columns
+            approximate_error: Relative standard error of approximate distinct-study
+                counts (default: exact counts)
+        """
+        self.df = df
+        self.approximate_error = approximate_error
+        self.precision = precision_for_error(approximate_error) if approximate_error is not None else None
+        self.stratum_codes, self.stratum_labels = codes_and_labels(df['stratum_id'])
+        self.pmid_codes, pmid_labels = pd.factorize(df['pmid'])
+        self.pmid_count = len(pmid_labels)
+        self._codes = {}
+        self._masks = {}
+        self._state = None
+    
+    def all_rows(self) -> np.ndarray:
+        """Row mask selecting every row."""
+        return np.ones(len(self.df), dtype=bool)
+    
+    def column_codes(self, column: str, categorizer: Optional[Callable[[Any], Any]] = None):
+        """Integer codes (-1 for missing) and sorted labels of a column, optionally categorized.
+        
+        A categorizer is applied once per distinct label, including missing values.
+        """
+        key = (column, categorizer)
+        if key not in self._codes:
+            codes, labels = codes_and_labels(self.df[column])
+            if categorizer is not None:
+                categories = np.array([categorizer(label) for label in labels] + [categorizer(np.nan)], dtype=object)
+                labels, category_codes = np.unique(categories, return_inverse=True)
+                codes = category_codes.reshape(-1)[codes]
+                labels = pd.Index(labels)
+            self._codes[key] = (codes, labels)
+        return self._codes[key]
+    
+    def label_mask(self, column: str, test: Callable[[pd.Series], np.ndarray]) -> np.ndarray:
+        """Rows whose label passes a vectorized test, cached per (column, test).
+        
+        The test runs once over an object Series of the distinct labels followed by a
+        missing value, and returns one boolean per entry.
+        """
+        key = (column, test)
+        if key not in self._masks:
+            codes, labels = self.column_codes(column)
+            distinct = pd.Series(list(labels) + [np.nan], dtype=object)
+            self._masks[key] = np.asarray(test(distinct), dtype=bool)[codes]
+        return self._masks[key]
+    
+    def study_counts(self, rows: np.ndarray) -> np.ndarray:
+        """Distinct PMIDs per stratum code among the selected rows."""
+        selected = rows & (self.stratum_codes >= 0) & (self.pmid_codes >= 0)
+        if self.precision is not None:
+            estimate = self._sketch(pd.DataFrame({'stratum': self.stratum_codes[selected]}), selected).estimate()
+            counts = np.zeros(len(self.stratum_labels), dtype=np.int64)
+            counts[estimate['stratum'].to_numpy()] = estimate['studies'].to_numpy()
+            return counts
+        
+        pairs = np.unique(self.stratum_codes[selected].astype(np.int64) * self.pmid_count + self.pmid_codes[selected])
+        return np.bincount(pairs // max(self.pmid_count, 1), minlength=len(self.stratum_labels))
+    
+    def _sketch(self, keys: pd.DataFrame, rows: np.ndarray) -> StudySketches:
+        """HyperLogLog sketches of the studies of the selected rows, per key."""
+        return StudySketches.from_values(keys, self.df['pmid'].to_numpy()[rows], self.precision)
+    
+    def valid_strata(self, min_stratum_size: int, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Stratum codes with at least min_stratum_size distinct PMIDs among the selected rows."""
+        rows = self.all_rows() if rows is None else rows
+        return self.study_counts(rows) >= min_stratum_size
+    
+    def kept_rows(self, spec: FrequencySpec, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Rows left after a spec's exclusions."""
+        kept = self.all_rows() if rows is None else rows.copy()
+        categorizers = spec.categorizers or (None,) * len(spec.columns)
+        for column, categorizer in zip(spec.columns, categorizers):
+            if spec.exclude is not None:
+                kept &= ~self.label_mask(column, spec.exclude)
+            if categorizer is not None and spec.exclude_categories:
+                codes, labels = self.column_codes(column, categorizer)
+                kept &= ~np.isin(labels, list(spec.exclude_categories))[codes]
+        return kept
+    
+    def _in_strata(self, rows: np.ndarray, strata: np.ndarray) -> np.ndarray:
+        """Restrict a row mask to rows of the given stratum codes."""
+        in_strata = np.append(strata, False)[self.stratum_codes]
+        return rows & in_strata
+    
+    def _stratum_order(self, rows: np.ndarray, stratum_codes: np.ndarray, order: str) -> np.ndarray:
+        """Stable sort positions putting stratum codes in label or first-appearance order."""
+        if order == 'sorted':
+            return np.argsort(stratum_codes, kind='stable')
+        rank = np.zeros(len(self.stratum_labels), dtype=np.int64)
+        appearance = pd.unique(self.stratum_codes[rows])
+        rank[appearance] = np.arange(len(appearance))
+        return np.argsort(rank[stratum_codes], kind='stable')
+    
+    def stratum_summary(self, strata: np.ndarray, rows: Optional[np.ndarray] = None,
+                        order: str = 'sorted') -> pd.DataFrame:
+        """Record, study and year statistics of the given strata.
+        
+        Returns:
+            DataFrame with stratum_id, total_records, unique_studies, avg_year,
+            year_min and year_max, one row per stratum
+        """
+        rows = self.all_rows() if rows is None else rows
+        rows = self._in_strata(rows, strata)
+        frame = pd.DataFrame({
+            'stratum': self.stratum_codes[rows],
+            'pmid': self.df['pmid'].to_numpy()[rows],
+            'year': self.df['year'].to_numpy()[rows]
+        })
+        # Approximate counts replace the placeholder below instead of exact distinct sets
+        summary = frame.groupby('stratum', sort=True).agg(
+            total_records=('pmid', 'size'),
+            unique_studies=('pmid', 'nunique' if self.precision is None else 'size'),
+            avg_year=('year', 'mean'),
+            year_min=('year', 'min'),
+            year_max=('year', 'max')
+        )
+        if self.precision is not None:
+            summary['unique_studies'] = self.study_counts(rows)[summary.index.to_numpy()]
+        summary = summary.iloc[self._stratum_order(rows, summary.index.to_numpy(), order)]
+        summary.insert(0, 'stratum_id', self.stratum_labels[summary.index.to_numpy()].to_numpy(dtype=object))
+        return summary.reset_index(drop=True)
+    
+    def frequency_table(self, spec: FrequencySpec, min_stratum_size: int,
+                        rows: Optional[np.ndarray] = None, strata: Optional[np.ndarray] = None) -> Optional[pd.DataFrame]:
+        """Build one frequency table from a spec.
+        
+        Args:
+            spec: Table description
+            min_stratum_size: Minimum distinct PMIDs of a stratum among the kept rows,
+                used when strata is not given
+            rows: Row mask the table is computed over (all rows if omitted)
+            strata: Stratum codes to report, as a boolean array over the stratum labels
+        
+        Returns:
+            The table, or None if a source column is missing or no stratum has kept rows
+        """
+        if any(column not in self.df.columns for column in spec.columns):
+            return None
+        
+        rows = self.all_rows() if rows is None else rows
+        kept = self.kept_rows(spec, rows)
+        if strata is None:
+            strata = self.valid_strata(min_stratum_size, kept)
+        kept = self._in_strata(kept, strata)
+        if not kept.any():
+            return None
+        
+        denominator_rows = kept if spec.denominator == 'kept' else self._in_strata(rows, strata)
+        total_studies = self.study_counts(denominator_rows)
+        
+        categorizers = spec.categorizers or (None,) * len(spec.columns)
+        value_codes = [self.column_codes(column, categorizer) for column, categorizer in zip(spec.columns, categorizers)]
+        keys = [f'value{i}' for i in range(len(value_codes))]
+        
+        frame = pd.DataFrame({'stratum': self.stratum_codes[kept]})
+        for key, (codes, _) in zip(keys, value_codes):
+            frame[key] = codes[kept]
+        frame['pmid'] = self.df['pmid'].to_numpy()[kept]
+        frame = frame[(frame[keys] >= 0).all(axis=1)]
+        
+        if spec.count == 'studies' and self.precision is not None:
+            frame = frame[frame['pmid'].notna().to_numpy()]
+            sketches = StudySketches.from_values(frame[['stratum'] + keys], frame['pmid'].to_numpy(), self.precision)
+            counts = sketches.estimate().rename(columns={'studies': spec.count_label})
+        else:
+            grouped = frame.groupby(['stratum'] + keys, sort=True)['pmid']
+            counts = (grouped.nunique() if spec.count == 'studies' else grouped.size()).reset_index(name=spec.count_label)
+        counts = counts.iloc[self._stratum_order(kept, counts['stratum'].to_numpy(), spec.order)]
+        
+        stratum_codes = counts['stratum'].to_numpy()
+        table = pd.DataFrame({
+            label: labels[counts[key].to_numpy()].to_numpy(dtype=object)
+            for label, key, (_, labels) in zip(spec.labels, keys, value_codes)
+        })
+        table[spec.count_label] = counts[spec.count_label].to_numpy()
+        table['total_studies'] = total_studies[stratum_codes]
+        table['percentage'] = (table[spec.count_label] / table['total_studies']) * 100
+        table['stratum_id'] = self.stratum_labels[stratum_codes].to_numpy(dtype=object)
+        
+        table = table[table['percentage'] >= spec.min_percentage].reset_index(drop=True)
+        if table.empty and not spec.keep_empty:
+            return None
+        return table[list(spec.output_columns)]
+    
+    def frequency_tables(self, specs, min_stratum_size: int, rows: Optional[np.ndarray] = None,
+                         strata: Optional[np.ndarray] = None) -> Dict[str, pd.DataFrame]:
+        """Build the tables of several specs, skipping those frequency_table() returns None for."""
+        results = {}
+        for spec in specs:
+            table = self.frequency_table(spec, min_stratum_size, rows, strata)
+            if table is not None:
+                results[spec.name] = table
+        return results
+    
+    def stratum_state(self, executor: Optional[Executor] = None) -> StratumState:
+        """Mergeable stratum aggregates of the whole table, built on first use.
+        
+        Args:
+            executor: Pool computing the counts tables concurrently on first use
+        """
+        if self._state is None:
+            self._state = StratumState.from_frame(self.df, precision=self.precision, executor=executor)
+        return self._state
@@ -7,6 +7,9 @@ import pandas as pd
 import numpy as np
 from typing import Dict, List, Optional
 import logging
+import re
+
+from analysis.aggregation_engine import AggregationEngine, FrequencySpec
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,9 +18,16 @@ logger = logging.getLogger(__name__)
 class ElementSpecificAggregator:
     """Analyzes each element using only studies with meaningful data for that element."""
     
-    def __init__(self, min_stratum_size: int = 3):
-        """Initialize aggregator."""
+    def __init__(self, min_stratum_size: int = 3, approximate_error: Optional[float] = None):
+        """Initialize aggregator.
+        
+        Args:
+            min_stratum_size: Minimum number of studies required for a stratum to be included
+            approximate_error: Relative standard error of HyperLogLog study counts
+                (default: exact counts)
+        """
         self.min_stratum_size = min_stratum_size
+        self.approximate_error = approximate_error
         
         # Terms that indicate no meaningful data
         self.meaningless_terms = [
@@ -25,6 +35,42 @@ class ElementSpecificAggregator:
             'not reported', 'nr', 'n/a', 'na', '', 'none'
         ]
         # Note: 'other' is kept as it represents a meaningful category
+        self.meaningless_prefixes = ['unspecified', 'not specified', 'unclear', 'unknown']
+        
+        # Matches a lowercased, stripped value that starts with a prefix or equals a term
+        self.meaningless_pattern = re.compile(
+            '(?:' + '|'.join(re.escape(prefix) for prefix in self.meaningless_prefixes) + ')|'
+            '(?:' + '|'.join(re.escape(term) for term in self.meaningless_terms) + ')$'
+        )
+        
+        # Thresholds are shares of the studies with meaningful data for the element
+        self.element_specs = [
+            FrequencySpec(
+                name='risk_factors_by_stratum', columns=('risk_factors',), labels=('risk_factors',),
+                output_columns=('risk_factors', 'count', 'total_studies', 'percentage', 'stratum_id'),
+                exclude=self.meaningless_labels, count_label='count', denominator='kept',
+                min_percentage=10.0, order='appearance'
+            ),
+            FrequencySpec(
+                name='treatments_by_stratum', columns=('treatment_category',), labels=('treatment_category',),
+                output_columns=('treatment_category', 'count', 'total_studies', 'percentage', 'stratum_id'),
+                exclude=self.meaningless_labels, count_label='count', denominator='kept',
+                min_percentage=10.0, order='appearance'
+            ),
+            FrequencySpec(
+                name='treatment_outcomes_by_stratum', columns=('treatment_category', 'outcome_direction'),
+                labels=('treatment_category', 'outcome_direction'),
+                output_columns=('treatment_category', 'outcome_direction', 'count', 'total_studies', 'percentage', 'stratum_id'),
+                exclude=self.meaningless_labels, count='records', count_label='count', denominator='kept',
+                min_percentage=5.0, order='appearance'
+            ),
+            FrequencySpec(
+                name='symptoms_by_stratum', columns=('symptoms',), labels=('symptoms',),
+                output_columns=('symptoms', 'count', 'total_studies', 'percentage', 'stratum_id'),
+                exclude=self.meaningless_labels, count_label='count', denominator='kept',
+                min_percentage=10.0, order='appearance'
+            )
+        ]
     
     def is_meaningless(self, value: str) -> bool:
         """Check if a value indicates no meaningful data."""
@@ -32,182 +78,50 @@ class ElementSpecificAggregator:
             return True
         
         value_lower = str(value).lower().strip()
-        # Check for exact matches or specific patterns
-        return (
-            value_lower in self.meaningless_terms or
-            value_lower.startswith('unspecified') or
-            value_lower.startswith('not specified') or
-            value_lower.startswith('unclear') or
-            value_lower.startswith('unknown')
-        )
+        # Check for exact matches or specific prefixes
+        return self.meaningless_pattern.match(value_lower) is not None
     
-    def analyze_all_elements(self, df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
-        """Perform element-specific analysis."""
+    def meaningless_labels(self, labels: pd.Series) -> np.ndarray:
+        """Vectorized is_meaningless over a Series of labels."""
+        text = labels.astype(object).str.lower().str.strip()
+        return (text.isna() | text.str.match(self.meaningless_pattern, na=True)).to_numpy(dtype=bool)
+    
+    def analyze_all_elements(self, df: pd.DataFrame, engine: Optional[AggregationEngine] = None) -> Dict[str, pd.DataFrame]:
+        """Perform element-specific analysis.
+        
+        Args:
+            df: Long-format table
+            engine: Aggregation engine over df, to share its work with other aggregators
+        """
         logger.info("Starting element-specific analysis")
-        results = {}
+        engine = engine or AggregationEngine(df, self.approximate_error)
         
         # 1. Stratum Summary (using all data)
-        results['stratum_summary_by_stratum'] = self._analyze_stratum_summary(df)
-        
-        # 2. Risk Factors (only studies with meaningful risk factors)
-        results['risk_factors_by_stratum'] = self._analyze_risk_factors(df)
+        results = {'stratum_summary_by_stratum': self._analyze_stratum_summary(engine)}
         
-        # 3. Treatments (only studies with meaningful treatments)  
-        results['treatments_by_stratum'] = self._analyze_treatments(df)
-        
-        # 4. Treatment-Outcomes (only studies with both meaningful treatment AND outcome)
-        results['treatment_outcomes_by_stratum'] = self._analyze_treatment_outcomes(df)
-        
-        # 5. Symptoms (only studies with meaningful symptoms)
-        results['symptoms_by_stratum'] = self._analyze_symptoms(df)
+        # 2-5. Each element only over studies with meaningful data for it
+        for spec in self.element_specs:
+            results[spec.name] = self._analyze_element(engine, spec)
         
         return results
     
-    def _analyze_stratum_summary(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _analyze_stratum_summary(self, engine: AggregationEngine) -> pd.DataFrame:
         """Analyze overall stratum coverage."""
-        summaries = []
-        
-        for stratum_id in df['stratum_id'].unique():
-            stratum_data = df[df['stratum_id'] == stratum_id]
-            unique_studies = stratum_data['pmid'].nunique()
-            
-            if unique_studies >= self.min_stratum_size:
-                summary = {
-                    'stratum_id': stratum_id,
-                    'total_records': len(stratum_data),
-                    'unique_studies': unique_studies,
-                    'avg_year': stratum_data['year'].mean(),
-                    'date_range': f"{stratum_data['year'].min()}-{stratum_data['year'].max()}"
-                }
-                summaries.append(summary)
-        
-        return pd.DataFrame(summaries).sort_values('unique_studies', ascending=False)
-    
-    def _analyze_risk_factors(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Analyze risk factors using only studies that report meaningful risk factors."""
-        if 'risk_factors' not in df.columns:
-            return pd.DataFrame()
-        
-        # Filter to only meaningful risk factor data
-        meaningful_rf = df[~df['risk_factors'].apply(self.is_meaningless)]
-        logger.info(f"Risk factor analysis: {len(df)} total → {len(meaningful_rf)} with meaningful risk factors")
-        
-        results = []
-        
-        for stratum_id in meaningful_rf['stratum_id'].unique():
-            stratum_data = meaningful_rf[meaningful_rf['stratum_id'] == stratum_id]
-            unique_studies = stratum_data['pmid'].nunique()
-            
-            if unique_studies >= self.min_stratum_size:
-                # Count risk factors
-                rf_counts = stratum_data.groupby('risk_factors')['pmid'].nunique().reset_index()
-                rf_counts.columns = ['risk_factors', 'count']
-                rf_counts['total_studies'] = unique_studies
-                rf_counts['percentage'] = (rf_counts['count'] / unique_studies) * 100
-                rf_counts['stratum_id'] = stratum_id
-                
-                # Only include risk factors mentioned in ≥10% of studies
-                significant_rf = rf_counts[rf_counts['percentage'] >= 10.0]
-                results.append(significant_rf)
-        
-        if results:
-            return pd.concat(results, ignore_index=True)
-        return pd.DataFrame()
-    
-    def _analyze_treatments(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Analyze treatments using only studies that report meaningful treatments."""
-        if 'treatment_category' not in df.columns:
-            return pd.DataFrame()
-        
-        # Filter to only meaningful treatment data
-        meaningful_tx = df[~df['treatment_category'].apply(self.is_meaningless)]
-        logger.info(f"Treatment analysis: {len(df)} total → {len(meaningful_tx)} with meaningful treatments")
-        
-        results = []
-        
-        for stratum_id in meaningful_tx['stratum_id'].unique():
-            stratum_data = meaningful_tx[meaningful_tx['stratum_id'] == stratum_id]
-            unique_studies = stratum_data['pmid'].nunique()
-            
-            if unique_studies >= self.min_stratum_size:
-                # Count treatments
-                tx_counts = stratum_data.groupby('treatment_category')['pmid'].nunique().reset_index()
-                tx_counts.columns = ['treatment_category', 'count']
-                tx_counts['total_studies'] = unique_studies
-                tx_counts['percentage'] = (tx_counts['count'] / unique_studies) * 100
-                tx_counts['stratum_id'] = stratum_id
-                
-                # Only include treatments mentioned in ≥10% of studies
-                significant_tx = tx_counts[tx_counts['percentage'] >= 10.0]
-                results.append(significant_tx)
-        
-        if results:
-            return pd.concat(results, ignore_index=True)
-        return pd.DataFrame()
-    
-    def _analyze_treatment_outcomes(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Analyze treatment-outcome combinations using only studies with BOTH meaningful treatment AND outcome."""
-        if 'treatment_category' not in df.columns or 'outcome_direction' not in df.columns:
+        summary = engine.stratum_summary(engine.valid_strata(self.min_stratum_size), order='appearance')
+        summary['date_range'] = [f"{low}-{high}" for low, high in zip(summary['year_min'], summary['year_max'])]
+        summary = summary[['stratum_id', 'total_records', 'unique_studies', 'avg_year', 'date_range']]
+        return summary.sort_values('unique_studies', ascending=False)
+    
+    def _analyze_element(self, engine: AggregationEngine, spec: FrequencySpec) -> pd.DataFrame:
+        """Count one element per stratum using only rows with meaningful values for it."""
+        if any(column not in engine.df.columns for column in spec.columns):
             return pd.DataFrame()
         
-        # Filter to studies with BOTH meaningful treatment AND meaningful outcome
-        meaningful_both = df[
-            (~df['treatment_category'].apply(self.is_meaningless)) & 
-            (~df['outcome_direction'].apply(self.is_meaningless))
-        ]
-        logger.info(f"Treatment-outcome analysis: {len(df)} total → {len(meaningful_both)} with both treatment & outcome")
-        
-        results = []
+        meaningful = engine.kept_rows(spec)
+        logger.info(f"{' & '.join(spec.columns)} analysis: {len(meaningful)} total → {int(meaningful.sum())} with meaningful values")
         
-        for stratum_id in meaningful_both['stratum_id'].unique():
-            stratum_data = meaningful_both[meaningful_both['stratum_id'] == stratum_id]
-            unique_studies = stratum_data['pmid'].nunique()
-            
-            if unique_studies >= self.min_stratum_size:
-                # Count treatment-outcome combinations
-                combo_counts = stratum_data.groupby(['treatment_category', 'outcome_direction']).size().reset_index(name='count')
-                combo_counts['total_studies'] = unique_studies
-                combo_counts['percentage'] = (combo_counts['count'] / unique_studies) * 100
-                combo_counts['stratum_id'] = stratum_id
-                
-                # Only include combinations mentioned in ≥5% of studies
-                significant_combos = combo_counts[combo_counts['percentage'] >= 5.0]
-                results.append(significant_combos)
-        
-        if results:
-            return pd.concat(results, ignore_index=True)
-        return pd.DataFrame()
-    
-    def _analyze_symptoms(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Analyze symptoms using only studies that report meaningful symptoms."""
-        if 'symptoms' not in df.columns:
-            return pd.DataFrame()
-        
-        # Filter to only meaningful symptom data
-        meaningful_sx = df[~df['symptoms'].apply(self.is_meaningless)]
-        logger.info(f"Symptom analysis: {len(df)} total → {len(meaningful_sx)} with meaningful symptoms")
-        
-        results = []
-        
-        for stratum_id in meaningful_sx['stratum_id'].unique():
-            stratum_data = meaningful_sx[meaningful_sx['stratum_id'] == stratum_id]
-            unique_studies = stratum_data['pmid'].nunique()
-            
-            if unique_studies >= self.min_stratum_size:
-                # Count symptoms
-                sx_counts = stratum_data.groupby('symptoms')['pmid'].nunique().reset_index()
-                sx_counts.columns = ['symptoms', 'count']
-                sx_counts['total_studies'] = unique_studies
-                sx_counts['percentage'] = (sx_counts['count'] / unique_studies) * 100
-                sx_counts['stratum_id'] = stratum_id
-                
-                # Only include symptoms mentioned in ≥10% of studies
-                significant_sx = sx_counts[sx_counts['percentage'] >= 10.0]
-                results.append(significant_sx)
-        
-        if results:
-            return pd.concat(results, ignore_index=True)
-        return pd.DataFrame()
+        table = engine.frequency_table(spec, self.min_stratum_size)
+        return table if table is not None else pd.DataFrame()
     
     def save_results(self, results: Dict[str, pd.DataFrame], output_dir: str):
         """Save analysis results."""
@@ -222,47 +136,35 @@ class ElementSpecificAggregator:
             else:
                 logger.warning(f"Skipping empty result: {name}")
     
-    def generate_filtering_report(self, df: pd.DataFrame) -> Dict[str, any]:
-        """Generate report on filtering effectiveness."""
+    def generate_filtering_report(self, df: pd.DataFrame, engine: Optional[AggregationEngine] = None) -> Dict[str, any]:
+        """Generate report on filtering effectiveness.
+        
+        Args:
+            df: Long-format table
+            engine: Aggregation engine over df, to reuse the masks of analyze_all_elements()
+        """
         report = {
             'original_total_records': len(df),
             'element_analysis': []
         }
         
-        # Risk factors
-        if 'risk_factors' in df.columns:
-            meaningful_rf = df[~df['risk_factors'].apply(self.is_meaningless)]
-            report['element_analysis'].append({
-                'element': 'risk_factors',
-                'total_records': len(df),
-                'meaningful_records': len(meaningful_rf),
-                'retention_rate': (len(meaningful_rf) / len(df)) * 100,
-                'excluded_records': len(df) - len(meaningful_rf)
-            })
-        
-        # Treatments  
-        if 'treatment_category' in df.columns:
-            meaningful_tx = df[~df['treatment_category'].apply(self.is_meaningless)]
-            report['element_analysis'].append({
-                'element': 'treatment_category',
-                'total_records': len(df),
-                'meaningful_records': len(meaningful_tx),
-                'retention_rate': (len(meaningful_tx) / len(df)) * 100,
-                'excluded_records': len(df) - len(meaningful_tx)
-            })
+        engine = engine or AggregationEngine(df, self.approximate_error)
+        specs = {spec.name: spec for spec in self.element_specs}
         
-        # Treatment-Outcome combinations
-        if 'treatment_category' in df.columns and 'outcome_direction' in df.columns:
-            meaningful_both = df[
-                (~df['treatment_category'].apply(self.is_meaningless)) & 
-                (~df['outcome_direction'].apply(self.is_meaningless))
-            ]
+        for element, spec_name in [('risk_factors', 'risk_factors_by_stratum'),
+                                   ('treatment_category', 'treatments_by_stratum'),
+                                   ('treatment_outcome_combinations', 'treatment_outcomes_by_stratum')]:
+            spec = specs[spec_name]
+            if any(column not in df.columns for column in spec.columns):
+                continue
+            
+            meaningful_records = int(engine.kept_rows(spec).sum())
             report['element_analysis'].append({
-                'element': 'treatment_outcome_combinations',
+                'element': element,
                 'total_records': len(df),
-                'meaningful_records': len(meaningful_both),
-                'retention_rate': (len(meaningful_both) / len(df)) * 100,
-                'excluded_records': len(df) - len(meaningful_both)
+                'meaningful_records': meaningful_records,
+                'retention_rate': (meaningful_records / len(df)) * 100,
+                'excluded_records': len(df) - meaningful_records
             })
         
         return report
@@ -273,7 +175,7 @@ def main():
     import sys
     
     if len(sys.argv) != 3:
-        print("Usage: python element_specific_aggregates.py <normalized_csv> <output_dir>")
+        print("Usage (from src): python -m analysis.element_specific_aggregates <normalized_csv> <output_dir>")
         sys.exit(1)
     
     input_file = sys.argv[1]
@@ -284,13 +186,14 @@ def main():
     
     # Run analysis
     aggregator = ElementSpecificAggregator(min_stratum_size=3)
-    results = aggregator.analyze_all_elements(df)
+    engine = AggregationEngine(df, aggregator.approximate_error)
+    results = aggregator.analyze_all_elements(df, engine)
     
     # Save results
     aggregator.save_results(results, output_dir)
     
     # Generate report
-    report = aggregator.generate_filtering_report(df)
+    report = aggregator.generate_filtering_report(df, engine)
     
     print("\n" + "="*80)
     print("🎯 ELEMENT-SPECIFIC ANALYSIS REPORT")
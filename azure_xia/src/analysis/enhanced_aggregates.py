@@ -9,16 +9,33 @@ from typing import Dict, List, Optional
 import logging
 import re
 
+from analysis.aggregation_engine import AggregationEngine, FrequencySpec
+from prepare.keyword_index import KeywordIndex
+from prepare.normalization_memo import NormalizationMemo
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Cleaning steps of categorize_text, compiled once
+ARTICLE_PREFIX = re.compile(r'^(the |a |an )')
+PUNCTUATION = re.compile(r'[^\w\s]')
+
 
 class EnhancedStratumAggregator:
     """Enhanced stratum aggregator with clear categorization."""
     
-    def __init__(self, min_stratum_size: int = 3):
-        """Initialize aggregator."""
+    def __init__(self, min_stratum_size: int = 3, memo_size: int = 10000, approximate_error: Optional[float] = None):
+        """Initialize aggregator.
+        
+        Args:
+            min_stratum_size: Minimum number of studies required for a stratum to be included
+            memo_size: Maximum number of categorized labels kept between analyses; 0 disables it
+            approximate_error: Relative standard error of HyperLogLog study counts
+                (default: exact counts)
+        """
         self.min_stratum_size = min_stratum_size
+        self.approximate_error = approximate_error
+        self.memo = NormalizationMemo(maxsize=memo_size)
         
         # Risk factor categorization mapping
         self.risk_factor_categories = {
@@ -44,6 +61,43 @@ class EnhancedStratumAggregator:
             'psychotic_symptoms': ['hallucination', 'delusion', 'psychosis', 'paranoid', 'bizarre'],
             'other': []  # catch-all
         }
+        
+        # Indexes of the category mappings above, keyed by mapping id
+        self._category_indexes = {
+            id(mapping): (mapping, KeywordIndex(mapping))
+            for mapping in [self.risk_factor_categories, self.symptom_categories]
+        }
+        
+        # Labels are categorized or cleaned once per distinct value of the whole frame
+        # (and memoized across frames), then 'unspecified' ones are dropped;
+        # percentages are shares of the studies with a meaningful label
+        self.table_specs = [
+            FrequencySpec(
+                name='risk_factors_by_stratum', columns=('risk_factor',), labels=('risk_factor',),
+                output_columns=('risk_factor', 'study_count', 'percentage', 'stratum_id', 'total_studies'),
+                categorizers=(self.categorize_risk_factor,), exclude_categories=('unspecified',),
+                denominator='kept', min_percentage=10.0
+            ),
+            FrequencySpec(
+                name='symptoms_by_stratum', columns=('symptom',), labels=('symptom',),
+                output_columns=('symptom', 'study_count', 'percentage', 'stratum_id', 'total_studies'),
+                categorizers=(self.categorize_symptom,), exclude_categories=('unspecified',),
+                denominator='kept', min_percentage=15.0
+            ),
+            FrequencySpec(
+                name='treatments_by_stratum', columns=('treatment_category',), labels=('treatment_category',),
+                output_columns=('treatment_category', 'study_count', 'percentage', 'stratum_id', 'total_studies'),
+                categorizers=(self.clean_treatment,), exclude_categories=('unspecified',),
+                denominator='kept', min_percentage=10.0
+            ),
+            FrequencySpec(
+                name='treatment_outcomes_by_stratum', columns=('treatment_category', 'outcome_direction'),
+                labels=('treatment_category', 'outcome_direction'),
+                output_columns=('treatment_category', 'outcome_direction', 'count', 'stratum_id', 'total_studies', 'percentage'),
+                categorizers=(self.clean_treatment, self.clean_outcome), exclude_categories=('unspecified',),
+                count='records', count_label='count', denominator='kept', min_percentage=15.0
+            )
+        ]
     
     def categorize_text(self, text: str, category_mapping: Dict) -> str:
         """Categorize text into predefined categories."""
@@ -53,8 +107,8 @@ class EnhancedStratumAggregator:
         text_lower = str(text).lower().strip()
         
         # Remove common prefixes/suffixes and clean
-        text_clean = re.sub(r'^(the |a |an )', '', text_lower)
-        text_clean = re.sub(r'[^\w\s]', ' ', text_clean)
+        text_clean = ARTICLE_PREFIX.sub('', text_lower)
+        text_clean = PUNCTUATION.sub(' ', text_clean)
         text_clean = ' '.join(text_clean.split())  # normalize whitespace
         
         # Skip overly long or generic entries
@@ -62,12 +116,11 @@ class EnhancedStratumAggregator:
             return 'other'
         
         # Match against categories
-        for category, keywords in category_mapping.items():
-            if category == 'other':
-                continue
-            for keyword in keywords:
-                if keyword in text_clean:
-                    return category
+        entry = self._category_indexes.get(id(category_mapping))
+        index = entry[1] if entry is not None and entry[0] is category_mapping else KeywordIndex(category_mapping)
+        category = index.first_match(text_clean)
+        if category is not None and category != 'other':
+            return category
         
         # If no match and reasonably specific, create a cleaned version
         if len(text_clean) > 5 and len(text_clean) < 50:
@@ -75,151 +128,47 @@ class EnhancedStratumAggregator:
         
         return 'other'
     
-    def analyze_enhanced_strata(self, df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
-        """Enhanced stratum analysis with symptoms and risk factors."""
-        logger.info("Starting enhanced stratum analysis with clear categorization")
+    def _memoized(self, namespace: str, text, compute) -> str:
+        """Look up a label's cleaned form in the memo; missing values are computed directly."""
+        if not isinstance(text, str):
+            return compute()
+        return self.memo.lookup(namespace, text, compute)
+    
+    def categorize_risk_factor(self, text: str) -> str:
+        """Categorize a risk factor label."""
+        return self._memoized('risk_factor', text, lambda: self.categorize_text(text, self.risk_factor_categories))
+    
+    def categorize_symptom(self, text: str) -> str:
+        """Categorize a symptom label."""
+        return self._memoized('symptom', text, lambda: self.categorize_text(text, self.symptom_categories))
+    
+    def analyze_enhanced_strata(self, df: pd.DataFrame, engine: Optional[AggregationEngine] = None) -> Dict[str, pd.DataFrame]:
+        """Enhanced stratum analysis with symptoms and risk factors.
         
-        # Group by stratum
-        stratum_groups = df.groupby('stratum_id')
+        Args:
+            df: Long-format table
+            engine: Aggregation engine over df, to share its work with other aggregators
+        """
+        logger.info("Starting enhanced stratum analysis with clear categorization")
+        engine = engine or AggregationEngine(df, self.approximate_error)
         
         # Filter strata by minimum size
-        valid_strata = []
-        for name, group in stratum_groups:
-            if len(group['pmid'].unique()) >= self.min_stratum_size:
-                valid_strata.append((name, group))
-        
-        logger.info(f"Found {len(valid_strata)} valid strata (≥{self.min_stratum_size} studies each)")
+        valid_strata = engine.valid_strata(self.min_stratum_size)
         
-        results = {}
+        logger.info(f"Found {int(valid_strata.sum())} valid strata (≥{self.min_stratum_size} studies each)")
         
         # 1. Enhanced Stratum Summary
-        stratum_summaries = []
-        for stratum_name, stratum_data in valid_strata:
-            summary = {
-                'stratum_id': stratum_name,
-                'total_records': len(stratum_data),
-                'unique_studies': stratum_data['pmid'].nunique(),
-                'unique_papers': stratum_data['pmid'].nunique(),  # Same as unique_studies for clarity
-                'avg_year': round(stratum_data['year'].mean(), 1),
-                'year_range': f"{stratum_data['year'].min()}-{stratum_data['year'].max()}"
-            }
-            stratum_summaries.append(summary)
+        summary = engine.stratum_summary(valid_strata)
+        summary['unique_papers'] = summary['unique_studies']  # Same as unique_studies for clarity
+        summary['avg_year'] = summary['avg_year'].round(1)
+        summary['year_range'] = [f"{low}-{high}" for low, high in zip(summary['year_min'], summary['year_max'])]
+        summary = summary[['stratum_id', 'total_records', 'unique_studies', 'unique_papers', 'avg_year', 'year_range']]
+        results = {'stratum_summary_by_stratum': summary.sort_values('unique_studies', ascending=False)}
         
-        results['stratum_summary_by_stratum'] = pd.DataFrame(stratum_summaries).sort_values('unique_studies', ascending=False)
-        
-        # 2. Enhanced Risk Factors Analysis
-        risk_factor_results = []
-        for stratum_name, stratum_data in valid_strata:
-            if 'risk_factor' in stratum_data.columns:
-                # Categorize risk factors
-                stratum_data_copy = stratum_data.copy()
-                stratum_data_copy['risk_category'] = stratum_data_copy['risk_factor'].apply(
-                    lambda x: self.categorize_text(x, self.risk_factor_categories)
-                )
-                
-                # Filter out unspecified
-                meaningful_risks = stratum_data_copy[stratum_data_copy['risk_category'] != 'unspecified']
-                
-                if len(meaningful_risks) > 0:
-                    total_studies = meaningful_risks['pmid'].nunique()
-                    risk_counts = meaningful_risks.groupby('risk_category')['pmid'].nunique().reset_index()
-                    risk_counts.columns = ['risk_factor', 'study_count']
-                    risk_counts['percentage'] = (risk_counts['study_count'] / total_studies) * 100
-                    risk_counts['stratum_id'] = stratum_name
-                    risk_counts['total_studies'] = total_studies
-                    
-                    # Only include significant risk factors
-                    significant_risks = risk_counts[risk_counts['percentage'] >= 10.0]
-                    risk_factor_results.append(significant_risks)
-        
-        if risk_factor_results:
-            results['risk_factors_by_stratum'] = pd.concat(risk_factor_results, ignore_index=True)
-        
-        # 3. Enhanced Symptoms Analysis
-        symptom_results = []
-        for stratum_name, stratum_data in valid_strata:
-            if 'symptom' in stratum_data.columns:
-                # Categorize symptoms
-                stratum_data_copy = stratum_data.copy()
-                stratum_data_copy['symptom_category'] = stratum_data_copy['symptom'].apply(
-                    lambda x: self.categorize_text(x, self.symptom_categories)
-                )
-                
-                # Filter out unspecified
-                meaningful_symptoms = stratum_data_copy[stratum_data_copy['symptom_category'] != 'unspecified']
-                
-                if len(meaningful_symptoms) > 0:
-                    total_studies = meaningful_symptoms['pmid'].nunique()
-                    symptom_counts = meaningful_symptoms.groupby('symptom_category')['pmid'].nunique().reset_index()
-                    symptom_counts.columns = ['symptom', 'study_count']
-                    symptom_counts['percentage'] = (symptom_counts['study_count'] / total_studies) * 100
-                    symptom_counts['stratum_id'] = stratum_name
-                    symptom_counts['total_studies'] = total_studies
-                    
-                    # Only include significant symptoms
-                    significant_symptoms = symptom_counts[symptom_counts['percentage'] >= 15.0]
-                    symptom_results.append(significant_symptoms)
-        
-        if symptom_results:
-            results['symptoms_by_stratum'] = pd.concat(symptom_results, ignore_index=True)
-        
-        # 4. Enhanced Treatment Analysis
-        treatment_results = []
-        for stratum_name, stratum_data in valid_strata:
-            if 'treatment_category' in stratum_data.columns:
-                # Clean treatment categories
-                stratum_data_copy = stratum_data.copy()
-                stratum_data_copy['clean_treatment'] = stratum_data_copy['treatment_category'].apply(
-                    lambda x: self.clean_treatment_name(x)
-                )
-                
-                # Filter out unspecified
-                meaningful_treatments = stratum_data_copy[stratum_data_copy['clean_treatment'] != 'unspecified']
-                
-                if len(meaningful_treatments) > 0:
-                    total_studies = meaningful_treatments['pmid'].nunique()
-                    treatment_counts = meaningful_treatments.groupby('clean_treatment')['pmid'].nunique().reset_index()
-                    treatment_counts.columns = ['treatment_category', 'study_count']
-                    treatment_counts['percentage'] = (treatment_counts['study_count'] / total_studies) * 100
-                    treatment_counts['stratum_id'] = stratum_name
-                    treatment_counts['total_studies'] = total_studies
-                    
-                    # Only include significant treatments
-                    significant_treatments = treatment_counts[treatment_counts['percentage'] >= 10.0]
-                    treatment_results.append(significant_treatments)
-        
-        if treatment_results:
-            results['treatments_by_stratum'] = pd.concat(treatment_results, ignore_index=True)
-        
-        # 5. Treatment-Outcome Analysis (enhanced)
-        outcome_results = []
-        for stratum_name, stratum_data in valid_strata:
-            if 'treatment_category' in stratum_data.columns and 'outcome_direction' in stratum_data.columns:
-                # Clean both columns
-                stratum_data_copy = stratum_data.copy()
-                stratum_data_copy['clean_treatment'] = stratum_data_copy['treatment_category'].apply(self.clean_treatment_name)
-                stratum_data_copy['clean_outcome'] = stratum_data_copy['outcome_direction'].apply(self.clean_outcome_name)
-                
-                # Filter meaningful combinations
-                meaningful_data = stratum_data_copy[
-                    (stratum_data_copy['clean_treatment'] != 'unspecified') &
-                    (stratum_data_copy['clean_outcome'] != 'unspecified')
-                ]
-                
-                if len(meaningful_data) > 0:
-                    pairs = meaningful_data.groupby(['clean_treatment', 'clean_outcome']).size().reset_index(name='count')
-                    pairs['stratum_id'] = stratum_name
-                    pairs['total_studies'] = meaningful_data['pmid'].nunique()
-                    pairs['percentage'] = (pairs['count'] / pairs['total_studies']) * 100
-                    pairs = pairs.rename(columns={'clean_treatment': 'treatment_category', 'clean_outcome': 'outcome_direction'})
-                    
-                    # Only meaningful combinations
-                    significant_pairs = pairs[pairs['percentage'] >= 15.0]
-                    outcome_results.append(significant_pairs)
-        
-        if outcome_results:
-            results['treatment_outcomes_by_stratum'] = pd.concat(outcome_results, ignore_index=True)
+        # 2-5. Categorized risk factors and symptoms, cleaned treatments and treatment-outcomes
+        results.update(engine.frequency_tables(self.table_specs, self.min_stratum_size, strata=valid_strata))
         
+        self.memo.log_stats()
         logger.info(f"Enhanced analysis complete. Generated {len(results)} result tables.")
         return results
     
@@ -261,6 +210,14 @@ class EnhancedStratumAggregator:
         
         return 'Other'
     
+    def clean_treatment(self, text: str) -> str:
+        """Memoized clean_treatment_name."""
+        return self._memoized('treatment', text, lambda: self.clean_treatment_name(text))
+    
+    def clean_outcome(self, text: str) -> str:
+        """Memoized clean_outcome_name."""
+        return self._memoized('outcome', text, lambda: self.clean_outcome_name(text))
+    
     def clean_outcome_name(self, text: str) -> str:
         """Clean outcome names for better display."""
         if pd.isna(text) or text == '':
@@ -310,7 +267,7 @@ def main():
     import sys
     
     if len(sys.argv) != 3:
-        print("Usage: python enhanced_aggregates.py <normalized_csv> <output_dir>")
+        print("Usage (from src): python -m analysis.enhanced_aggregates <normalized_csv> <output_dir>")
         sys.exit(1)
     
     input_file = sys.argv[1]
@@ -0,0 +1,135 @@
+"""
+HyperLogLog Module
+Mergeable approximate distinct-study counting, stored as sparse register tables.
+"""
+
+from typing import List
+
+import pandas as pd
+import numpy as np
+
+# Register count limits: 2^4 registers (26% error) to 2^18 registers (0.2% error)
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+
+def precision_for_error(error: float) -> int:
+    """Smallest precision whose standard error 1.04 / sqrt(2^precision) is within the bound."""
+    if not 0 < error < 1:
+        raise ValueError(f"Approximate count error must be between 0 and 1, got {error}")
+    precision = int(np.ceil(np.log2((1.04 / error) ** 2)))
+    return min(max(precision, MIN_PRECISION), MAX_PRECISION)
+
+
+def hash_values(values) -> np.ndarray:
+    """Stable 64-bit hashes of study identifiers.
+    
+    Integral floats are hashed like integers and everything is hashed by its text, so
+    shards read with different dtypes produce the same hashes.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_float_dtype(values) and (values == values.round()).all():
+        values = values.astype('int64')
+    return pd.util.hash_array(values.astype(str).to_numpy(dtype=object))
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """Number of significant bits of each unsigned 64-bit value."""
+    values = values.copy()
+    length = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        large = values >= np.uint64(1 << shift)
+        length[large] += shift
+        values[large] >>= np.uint64(shift)
+    return length + (values > 0)
+
+
+class StudySketches:
+    """One HyperLogLog sketch of distinct studies per key, for many keys at once.
+    
+    Only non-empty registers are stored, as a (keys..., register, rank) table, so a key
+    with few studies costs about as much as its exact study set while a key with many
+    studies never costs more than 2^precision registers. Sketches with the same precision
+    merge by taking the largest rank per register, which is exactly the sketch of the
+    combined studies, so shards can be sketched separately and merged later.
+    """
+    
+    def __init__(self, keys: List[str], registers: pd.DataFrame, precision: int):
+        """Wrap a register table; use from_values() to sketch studies.
+        
+        Args:
+            keys: Key columns of the register table
+            registers: keys..., register and rank columns, one row per non-empty register
+            precision: Number of index bits; each sketch has 2^precision registers
+        """
+        self.keys = list(keys)
+        self.registers = registers
+        self.precision = precision
+    
+    @classmethod
+    def from_values(cls, keys: pd.DataFrame, pmids, precision: int) -> 'StudySketches':
+        """Sketch the studies of each key.
+        
+        Args:
+            keys: Key columns, one row per record
+            pmids: Study identifier of each record (no missing values)
+            precision: Number of index bits
+        """
+        hashes = hash_values(pmids)
+        suffix_bits = 64 - precision
+        register = (hashes >> np.uint64(suffix_bits)).astype(np.int64)
+        suffix = hashes & np.uint64((1 << suffix_bits) - 1)
+        rank = (suffix_bits - _bit_length(suffix) + 1).astype(np.int8)
+        
+        frame = keys.reset_index(drop=True).copy()
+        frame['register'] = register
+        frame['rank'] = rank
+        return cls(keys.columns, cls._max_ranks(frame, list(keys.columns)), precision)
+    
+    @staticmethod
+    def _max_ranks(frame: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+        """Keep the largest rank per (key, register)."""
+        return frame.groupby(keys + ['register'], sort=False, observed=True)['rank'].max().reset_index()
+    
+    def merge(self, other: 'StudySketches') -> 'StudySketches':
+        """Combine sketches of disjoint or overlapping records."""
+        if other.precision != self.precision or other.keys != self.keys:
+            raise ValueError(f"Cannot merge sketches with precision {other.precision} and keys {other.keys} "
+                             f"into sketches with precision {self.precision} and keys {self.keys}")
+        registers = pd.concat([self.registers, other.registers], ignore_index=True)
+        return StudySketches(self.keys, self._max_ranks(registers, self.keys), self.precision)
+    
+    def estimate(self) -> pd.DataFrame:
+        """Estimated distinct studies per key, sorted by key.
+        
+        Returns:
+            DataFrame with the key columns and an integer 'studies' column
+        """
+        registers = 1 << self.precision
+        if registers == 16:
+            alpha = 0.673
+        elif registers == 32:
+            alpha = 0.697
+        elif registers == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / registers)
+        
+        frame = self.registers.assign(inverse=np.exp2(-self.registers['rank'].astype(np.float64)))
+        grouped = frame.groupby(self.keys, sort=True, observed=True)
+        sums = grouped.agg(filled=('rank', 'size'), inverse=('inverse', 'sum')).reset_index()
+        
+        # Empty registers contribute 2^0 each; small counts use linear counting
+        empty = registers - sums['filled'].to_numpy()
+        raw = alpha * registers * registers / (sums['inverse'].to_numpy() + empty)
+        with np.errstate(divide='ignore'):
+            linear = registers * np.log(registers / np.maximum(empty, 1))
+        estimate = np.where((raw <= 2.5 * registers) & (empty > 0), linear, raw)
+        
+        result = sums[self.keys].copy()
+        result['studies'] = np.rint(estimate).astype(np.int64)
+        return result
+    
+    def standard_error(self) -> float:
+        """Relative standard error of the estimates."""
+        return 1.04 / np.sqrt(1 << self.precision)
@@ -7,6 +7,9 @@ import pandas as pd
 import numpy as np
 from typing import Dict, List, Optional
 import logging
+import re
+
+from analysis.aggregation_engine import AggregationEngine, FrequencySpec
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,10 +18,21 @@ logger = logging.getLogger(__name__)
 class ImprovedStratumAggregator:
     """Enhanced stratum aggregator with quality filtering."""
     
-    def __init__(self, min_stratum_size: int = 3, filter_unspecified: bool = True):
-        """Initialize aggregator with quality settings."""
+    QUALITY_COLUMNS = ['risk_factor', 'treatment_category', 'outcome_direction', 'symptom']
+    
+    def __init__(self, min_stratum_size: int = 3, filter_unspecified: bool = True,
+                 approximate_error: Optional[float] = None):
+        """Initialize aggregator with quality settings.
+        
+        Args:
+            min_stratum_size: Minimum number of studies required for a stratum to be included
+            filter_unspecified: Drop rows with unspecified labels before analyzing
+            approximate_error: Relative standard error of HyperLogLog study counts
+                (default: exact counts)
+        """
         self.min_stratum_size = min_stratum_size
         self.filter_unspecified = filter_unspecified
+        self.approximate_error = approximate_error
         
         # Terms to filter out for better quality
         self.unspecified_terms = [
@@ -26,6 +40,32 @@ class ImprovedStratumAggregator:
             'various', 'mixed', 'general', 'broad', 'diverse', 'multiple',
             'not reported', 'nr', 'n/a', 'na', 'none specified'
         ]
+        self.unspecified_pattern = re.compile('|'.join(re.escape(term) for term in self.unspecified_terms))
+        
+        # Only include values with meaningful prevalence (≥5% of studies, ≥10% for symptoms)
+        self.table_specs = [
+            FrequencySpec(
+                name='risk_factors_by_stratum', columns=('risk_factor',), labels=('risk_factor',),
+                output_columns=('risk_factor', 'study_count', 'percentage', 'stratum_id', 'total_studies'),
+                min_percentage=5.0
+            ),
+            FrequencySpec(
+                name='treatments_by_stratum', columns=('treatment_category',), labels=('treatment_category',),
+                output_columns=('treatment_category', 'study_count', 'percentage', 'stratum_id', 'total_studies'),
+                min_percentage=5.0
+            ),
+            FrequencySpec(
+                name='treatment_outcomes_by_stratum', columns=('treatment_category', 'outcome_direction'),
+                labels=('treatment_category', 'outcome_direction'),
+                output_columns=('treatment_category', 'outcome_direction', 'count', 'stratum_id', 'total_studies', 'percentage'),
+                count='records', count_label='count', min_percentage=5.0
+            ),
+            FrequencySpec(
+                name='symptoms_by_stratum', columns=('symptom',), labels=('symptom',),
+                output_columns=('symptom', 'study_count', 'percentage', 'stratum_id', 'total_studies'),
+                exclude=self.unspecified_labels, denominator='kept', min_percentage=10.0, keep_empty=False
+            )
+        ]
     
     def is_unspecified(self, value: str) -> bool:
         """Check if a value should be filtered as unspecified."""
@@ -33,138 +73,67 @@ class ImprovedStratumAggregator:
             return True
         
         value_lower = str(value).lower().strip()
-        return any(term in value_lower for term in self.unspecified_terms)
+        return self.unspecified_pattern.search(value_lower) is not None
     
-    def filter_quality_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Filter out low-quality unspecified entries."""
+    def unspecified_labels(self, labels: pd.Series) -> np.ndarray:
+        """Vectorized is_unspecified over a Series of labels."""
+        text = labels.astype(object).str.lower().str.strip()
+        return (text.isna() | (text == '') | text.str.contains(self.unspecified_pattern, na=True)).to_numpy(dtype=bool)
+    
+    def quality_mask(self, engine: AggregationEngine) -> np.ndarray:
+        """Rows that pass quality filtering, logging the rows removed per column."""
+        rows = engine.all_rows()
         if not self.filter_unspecified:
-            return df
+            return rows
         
-        logger.info(f"Filtering data quality - original rows: {len(df)}")
-        
-        # Create quality-filtered dataset
-        quality_df = df.copy()
+        logger.info(f"Filtering data quality - original rows: {len(rows)}")
         
         # Filter each important column
-        for col in ['risk_factor', 'treatment_category', 'outcome_direction', 'symptom']:
-            if col in quality_df.columns:
-                before_count = len(quality_df)
-                quality_df = quality_df[~quality_df[col].apply(self.is_unspecified)]
-                after_count = len(quality_df)
+        for col in self.QUALITY_COLUMNS:
+            if col in engine.df.columns:
+                before_count = int(rows.sum())
+                rows = rows & ~engine.label_mask(col, self.unspecified_labels)
+                after_count = int(rows.sum())
                 logger.info(f"Filtered {col}: {before_count} → {after_count} rows ({before_count-after_count} removed)")
         
-        logger.info(f"Quality filtering complete - final rows: {len(quality_df)}")
-        return quality_df
+        logger.info(f"Quality filtering complete - final rows: {int(rows.sum())}")
+        return rows
     
-    def analyze_by_strata_improved(self, df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
-        """Enhanced stratum analysis with quality filtering."""
-        logger.info("Starting improved stratum analysis with quality filtering")
+    def filter_quality_data(self, df: pd.DataFrame, engine: Optional[AggregationEngine] = None) -> pd.DataFrame:
+        """Filter out low-quality unspecified entries.
         
-        # Filter for quality
-        quality_df = self.filter_quality_data(df)
-        
-        # Group by stratum
-        stratum_groups = quality_df.groupby('stratum_id')
+        Args:
+            df: Long-format table
+            engine: Aggregation engine over df, to share its work with other aggregators
+        """
+        if not self.filter_unspecified:
+            return df
+        return df[self.quality_mask(engine or AggregationEngine(df, self.approximate_error))]
+    
+    def analyze_by_strata_improved(self, df: pd.DataFrame, engine: Optional[AggregationEngine] = None) -> Dict[str, pd.DataFrame]:
+        """Enhanced stratum analysis with quality filtering.
         
-        # Filter strata by minimum size
-        valid_strata = []
-        for name, group in stratum_groups:
-            if len(group['pmid'].unique()) >= self.min_stratum_size:
-                valid_strata.append((name, group))
+        Args:
+            df: Long-format table
+            engine: Aggregation engine over df, to share its work with other aggregators
+        """
+        logger.info("Starting improved stratum analysis with quality filtering")
+        engine = engine or AggregationEngine(df, self.approximate_error)
         
-        logger.info(f"Found {len(valid_strata)} valid strata (≥{self.min_stratum_size} studies each)")
+        # Filter for quality, then strata by minimum size
+        rows = self.quality_mask(engine)
+        valid_strata = engine.valid_strata(self.min_stratum_size, rows)
         
-        results = {}
+        logger.info(f"Found {int(valid_strata.sum())} valid strata (≥{self.min_stratum_size} studies each)")
         
         # 1. Stratum summary
-        stratum_summaries = []
-        for stratum_name, stratum_data in valid_strata:
-            summary = {
-                'stratum_id': stratum_name,
-                'total_records': len(stratum_data),
-                'unique_studies': stratum_data['pmid'].nunique(),
-                'avg_year': stratum_data['year'].mean(),
-                'date_range': f"{stratum_data['year'].min()}-{stratum_data['year'].max()}"
-            }
-            stratum_summaries.append(summary)
-        
-        results['stratum_summary_by_stratum'] = pd.DataFrame(stratum_summaries).sort_values('unique_studies', ascending=False)
-        
-        # 2. Risk factors analysis (quality filtered)
-        risk_factor_results = []
-        for stratum_name, stratum_data in valid_strata:
-            if 'risk_factor' in stratum_data.columns:
-                total_studies = stratum_data['pmid'].nunique()
-                risk_counts = stratum_data.groupby('risk_factor')['pmid'].nunique().reset_index()
-                risk_counts.columns = ['risk_factor', 'study_count']
-                risk_counts['percentage'] = (risk_counts['study_count'] / total_studies) * 100
-                risk_counts['stratum_id'] = stratum_name
-                risk_counts['total_studies'] = total_studies
-                
-                # Only include meaningful risk factors (>5% prevalence)
-                significant_risks = risk_counts[risk_counts['percentage'] >= 5.0]
-                risk_factor_results.append(significant_risks)
-        
-        if risk_factor_results:
-            results['risk_factors_by_stratum'] = pd.concat(risk_factor_results, ignore_index=True)
-        
-        # 3. Treatment analysis (quality filtered)
-        treatment_results = []
-        for stratum_name, stratum_data in valid_strata:
-            if 'treatment_category' in stratum_data.columns:
-                total_studies = stratum_data['pmid'].nunique()
-                treatment_counts = stratum_data.groupby('treatment_category')['pmid'].nunique().reset_index()
-                treatment_counts.columns = ['treatment_category', 'study_count']
-                treatment_counts['percentage'] = (treatment_counts['study_count'] / total_studies) * 100
-                treatment_counts['stratum_id'] = stratum_name
-                treatment_counts['total_studies'] = total_studies
-                
-                # Only include treatments with meaningful prevalence
-                significant_treatments = treatment_counts[treatment_counts['percentage'] >= 5.0]
-                treatment_results.append(significant_treatments)
-        
-        if treatment_results:
-            results['treatments_by_stratum'] = pd.concat(treatment_results, ignore_index=True)
-        
-        # 4. Treatment-Outcome combinations (quality filtered)
-        outcome_results = []
-        for stratum_name, stratum_data in valid_strata:
-            if 'treatment_category' in stratum_data.columns and 'outcome_direction' in stratum_data.columns:
-                # Create treatment-outcome pairs
-                pairs = stratum_data.groupby(['treatment_category', 'outcome_direction']).size().reset_index(name='count')
-                pairs['stratum_id'] = stratum_name
-                pairs['total_studies'] = stratum_data['pmid'].nunique()
-                pairs['percentage'] = (pairs['count'] / pairs['total_studies']) * 100
-                
-                # Only include meaningful combinations
-                significant_pairs = pairs[pairs['percentage'] >= 5.0]
-                outcome_results.append(significant_pairs)
-        
-        if outcome_results:
-            results['treatment_outcomes_by_stratum'] = pd.concat(outcome_results, ignore_index=True)
-        
-        # 5. Symptoms analysis (quality filtered)
-        symptom_results = []
-        for stratum_name, stratum_data in valid_strata:
-            if 'symptom' in stratum_data.columns:
-                # Filter out rows where symptom is unspecified
-                symptom_data = stratum_data[~stratum_data['symptom'].apply(self.is_unspecified)]
-                
-                if len(symptom_data) > 0:
-                    total_studies = symptom_data['pmid'].nunique()
-                    symptom_counts = symptom_data.groupby('symptom')['pmid'].nunique().reset_index()
-                    symptom_counts.columns = ['symptom', 'study_count']
-                    symptom_counts['percentage'] = (symptom_counts['study_count'] / total_studies) * 100
-                    symptom_counts['stratum_id'] = stratum_name
-                    symptom_counts['total_studies'] = total_studies
-                    
-                    # Only include symptoms with meaningful prevalence
-                    significant_symptoms = symptom_counts[symptom_counts['percentage'] >= 10.0]
-                    if len(significant_symptoms) > 0:
-                        symptom_results.append(significant_symptoms)
-        
-        if symptom_results:
-            results['symptoms_by_stratum'] = pd.concat(symptom_results, ignore_index=True)
+        summary = engine.stratum_summary(valid_strata, rows)
+        summary['date_range'] = [f"{low}-{high}" for low, high in zip(summary['year_min'], summary['year_max'])]
+        summary = summary[['stratum_id', 'total_records', 'unique_studies', 'avg_year', 'date_range']]
+        results = {'stratum_summary_by_stratum': summary.sort_values('unique_studies', ascending=False)}
+        
+        # 2-5. Risk factors, treatments, treatment-outcomes and symptoms (quality filtered)
+        results.update(engine.frequency_tables(self.table_specs, self.min_stratum_size, rows, valid_strata))
         
         logger.info(f"Analysis complete. Generated {len(results)} result tables.")
         return results
@@ -179,8 +148,15 @@ class ImprovedStratumAggregator:
             df.to_csv(output_path, index=False)
             logger.info(f"Saved {name} with {len(df)} rows to {output_path}")
     
-    def generate_quality_report(self, original_df: pd.DataFrame, filtered_df: pd.DataFrame) -> Dict[str, any]:
-        """Generate data quality improvement report."""
+    def generate_quality_report(self, original_df: pd.DataFrame, filtered_df: pd.DataFrame,
+                                engine: Optional[AggregationEngine] = None) -> Dict[str, any]:
+        """Generate data quality improvement report.
+        
+        Args:
+            original_df: Long-format table before filtering
+            filtered_df: Table returned by filter_quality_data()
+            engine: Aggregation engine over original_df, to reuse its label masks
+        """
         report = {
             'original_records': len(original_df),
             'filtered_records': len(filtered_df),
@@ -189,11 +165,14 @@ class ImprovedStratumAggregator:
             'improvements': []
         }
         
+        original = engine or AggregationEngine(original_df, self.approximate_error)
+        filtered = AggregationEngine(filtered_df, self.approximate_error)
+        
         # Analyze specific improvements
-        for col in ['risk_factor', 'treatment_category', 'outcome_direction', 'symptom']:
+        for col in self.QUALITY_COLUMNS:
             if col in original_df.columns:
-                original_unspecified = original_df[col].apply(self.is_unspecified).sum()
-                filtered_unspecified = filtered_df[col].apply(self.is_unspecified).sum() if col in filtered_df.columns else 0
+                original_unspecified = original.label_mask(col, self.unspecified_labels).sum()
+                filtered_unspecified = filtered.label_mask(col, self.unspecified_labels).sum() if col in filtered_df.columns else 0
                 
                 report['improvements'].append({
                     'field': col,
@@ -210,7 +189,7 @@ def main():
     import sys
     
     if len(sys.argv) != 3:
-        print("Usage: python improved_aggregates.py <normalized_csv> <output_dir>")
+        print("Usage (from src): python -m analysis.improved_aggregates <normalized_csv> <output_dir>")
         sys.exit(1)
     
     input_file = sys.argv[1]
@@ -221,15 +200,15 @@ def main():
     
     # Analyze with improvements
     aggregator = ImprovedStratumAggregator(min_stratum_size=3, filter_unspecified=True)
-    results = aggregator.analyze_by_strata_improved(df)
+    engine = AggregationEngine(df, aggregator.approximate_error)
+    results = aggregator.analyze_by_strata_improved(df, engine)
     
     # Save results
     aggregator.save_analysis_results(results, output_dir)
     
     # Generate quality report
-    original_df = pd.read_csv(input_file)
-    filtered_df = aggregator.filter_quality_data(original_df)
-    quality_report = aggregator.generate_quality_report(original_df, filtered_df)
+    filtered_df = aggregator.filter_quality_data(df, engine)
+    quality_report = aggregator.generate_quality_report(df, filtered_df, engine)
     
     print("\n" + "="*60)
     print("🔍 DATA QUALITY IMPROVEMENT REPORT")
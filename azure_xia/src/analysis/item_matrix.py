@@ -0,0 +1,196 @@
+"""
+Stratum Item Matrix Module
+Sparse stratum x item count matrices for the free-text risk factor and symptom tables.
+"""
+
+from typing import List, Optional, Sequence
+
+import pandas as pd
+import numpy as np
+from scipy import sparse
+
+
+class StratumItemMatrix:
+    """Item counts per stratum as a CSR matrix with stratum and item vocabularies.
+    
+    Rows are strata in table order and columns are items in order of first appearance.
+    Each stored entry also keeps its 'first' sequence number (aligned with the matrix
+    data), so ties between equally frequent items keep their first-appearance order.
+    Long tables, top-N lists, percentages and heatmap pivots are all derived from the
+    matrix; only the requested block is ever densified.
+    """
+    
+    def __init__(self, counts: sparse.csr_matrix, first: np.ndarray, strata: Sequence[str],
+                 items: Sequence[str], total_studies: np.ndarray):
+        """Wrap an already-built matrix; use from_counts(), from_table() or load() to build one.
+        
+        Args:
+            counts: Stratum x item counts
+            first: First sequence number of each stored entry, aligned with counts.data
+            strata: Row labels
+            items: Column labels
+            total_studies: Distinct studies per stratum, the percentage denominator
+        """
+        self.counts = counts
+        self.first = first
+        self.strata = pd.Index(strata, dtype=object)
+        self.items = pd.Index(items, dtype=object)
+        self.total_studies = np.asarray(total_studies)
+    
+    @classmethod
+    def from_counts(cls, counts: pd.DataFrame, strata: Sequence[str], total_studies: np.ndarray) -> 'StratumItemMatrix':
+        """Build the matrix of one counts table.
+        
+        Args:
+            counts: stratum_id, value, count and first columns, one row per (stratum, item);
+                rows of other strata are ignored
+            strata: Strata to keep, in row order
+            total_studies: Distinct studies of each of those strata
+        """
+        strata = pd.Index(strata, dtype=object)
+        rows = strata.get_indexer(counts['stratum_id'])
+        kept = rows >= 0
+        rows = rows[kept]
+        values = counts['value'].to_numpy()[kept]
+        count = counts['count'].to_numpy()[kept]
+        first = counts['first'].to_numpy()[kept]
+        
+        # Item vocabulary in order of first appearance
+        by_first = np.argsort(first, kind='stable')
+        codes, items = pd.factorize(values[by_first])
+        columns = np.empty(len(codes), dtype=np.int64)
+        columns[by_first] = codes
+        
+        # Entries grouped by row, so data and first line up with a canonical CSR layout
+        order = np.lexsort((columns, rows))
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(strata)))])
+        matrix = sparse.csr_matrix((count[order], columns[order], indptr), shape=(len(strata), len(items)))
+        return cls(matrix, first[order], strata, items, total_studies)
+    
+    @classmethod
+    def from_table(cls, table: pd.DataFrame, item_column: str) -> 'StratumItemMatrix':
+        """Rebuild the matrix from a long frequency table such as risk_factors_by_stratum.csv.
+        
+        Row order stands in for first appearance, so ties keep the table's order.
+        """
+        strata = pd.unique(table['stratum_id'])
+        totals = table.groupby('stratum_id', sort=False)['total_studies'].first()
+        counts = pd.DataFrame({
+            'stratum_id': table['stratum_id'].to_numpy(),
+            'value': table[item_column].to_numpy(),
+            'count': table['count'].to_numpy(),
+            'first': np.arange(len(table), dtype=np.int64)
+        })
+        return cls.from_counts(counts, strata, totals.reindex(strata).to_numpy())
+    
+    @property
+    def nnz(self) -> int:
+        """Number of stored (stratum, item) counts."""
+        return self.counts.nnz
+    
+    def _entry_rows(self) -> np.ndarray:
+        """Row index of each stored entry."""
+        return np.repeat(np.arange(len(self.strata)), np.diff(self.counts.indptr))
+    
+    def _ranked_entries(self) -> np.ndarray:
+        """Stored entries by row, then most frequent first, then by first appearance."""
+        return np.lexsort((self.first, -self.counts.data, self._entry_rows()))
+    
+    def percentages(self) -> sparse.csr_matrix:
+        """Counts as percentages of each stratum's studies, with the same sparsity."""
+        totals = np.repeat(self.total_studies, np.diff(self.counts.indptr))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            data = (self.counts.data / totals) * 100
+        return sparse.csr_matrix((data, self.counts.indices, self.counts.indptr), shape=self.counts.shape)
+    
+    def to_frame(self, item_column: str) -> pd.DataFrame:
+        """Long frequency table, by stratum and then most frequent item first."""
+        order = self._ranked_entries()
+        rows = self._entry_rows()[order]
+        count = self.counts.data[order]
+        total_studies = self.total_studies[rows]
+        return pd.DataFrame({
+            'stratum_id': self.strata.to_numpy()[rows],
+            item_column: self.items.to_numpy()[self.counts.indices[order]],
+            'count': count,
+            'total_studies': total_studies,
+            'percentage': (count / total_studies) * 100
+        })
+    
+    def top_labels(self, default: str = 'unknown') -> np.ndarray:
+        """Most frequent item of every stratum, default for strata without items."""
+        order = self._ranked_entries()
+        rows = self._entry_rows()[order]
+        is_top = np.ones(len(rows), dtype=bool)
+        is_top[1:] = rows[1:] != rows[:-1]
+        
+        labels = np.full(len(self.strata), default, dtype=object)
+        labels[rows[is_top]] = self.items.to_numpy()[self.counts.indices[order][is_top]]
+        return labels
+    
+    def top_n(self, stratum: str, n: int = 10) -> pd.DataFrame:
+        """Most frequent items of one stratum with their counts and percentages."""
+        row = self.strata.get_loc(stratum)
+        start, end = self.counts.indptr[row], self.counts.indptr[row + 1]
+        order = np.lexsort((self.first[start:end], -self.counts.data[start:end]))[:n] + start
+        count = self.counts.data[order]
+        return pd.DataFrame({
+            'item': self.items.to_numpy()[self.counts.indices[order]],
+            'count': count,
+            'percentage': (count / self.total_studies[row]) * 100
+        })
+    
+    def largest_strata(self, n: int = 5) -> List[str]:
+        """Strata with the most studies; ties go to the smallest stratum id."""
+        totals = pd.Series(self.total_studies, index=self.strata).sort_index()
+        return totals.nlargest(n).index.tolist()
+    
+    def top_items(self, n: int = 10) -> List[str]:
+        """Items with the highest counts summed over all strata; ties go to the smallest label."""
+        totals = pd.Series(np.asarray(self.counts.sum(axis=0)).ravel(), index=self.items).sort_index()
+        return totals.nlargest(n).index.tolist()
+    
+    def pivot(self, strata: Optional[Sequence[str]] = None, items: Optional[Sequence[str]] = None,
+              values: str = 'percentage') -> pd.DataFrame:
+        """Dense stratum x item block for heatmaps, zero where an item is absent.
+        
+        Args:
+            strata: Rows to include (default: all)
+            items: Columns to include (default: all)
+            values: 'percentage' or 'count'
+        """
+        if values not in ('percentage', 'count'):
+            raise ValueError(f"Unknown pivot values '{values}', expected 'percentage' or 'count'")
+        strata = self.strata if strata is None else pd.Index(strata, dtype=object)
+        items = self.items if items is None else pd.Index(items, dtype=object)
+        
+        matrix = self.percentages() if values == 'percentage' else self.counts
+        block = matrix[self.strata.get_indexer(strata)][:, self.items.get_indexer(items)]
+        return pd.DataFrame(block.toarray(), index=strata, columns=items)
+    
+    def save(self, path: str):
+        """Write the matrix, entry order and vocabularies to one .npz file.
+        
+        The file also loads as a plain matrix with scipy.sparse.load_npz().
+        """
+        np.savez_compressed(
+            path,
+            format=np.array(b'csr'),
+            shape=np.array(self.counts.shape),
+            data=self.counts.data,
+            indices=self.counts.indices,
+            indptr=self.counts.indptr,
+            first=self.first,
+            strata=self.strata.to_numpy(dtype=str),
+            items=self.items.astype(str).to_numpy(dtype=str),
+            total_studies=self.total_studies
+        )
+    
+    @classmethod
+    def load(cls, path: str) -> 'StratumItemMatrix':
+        """Read a matrix written by save()."""
+        with np.load(path) as saved:
+            counts = sparse.csr_matrix((saved['data'], saved['indices'], saved['indptr']),
+                                       shape=tuple(saved['shape']))
+            return cls(counts, saved['first'], saved['strata'].astype(object),
+                       saved['items'].astype(object), saved['total_studies'])
@@ -0,0 +1,202 @@
+"""
+Stratum Cube Module
+Distinct-study counts precomputed over every combination of the population and treatment dimensions.
+"""
+
+import itertools
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+import numpy as np
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bump when the saved cube layout changes
+CUBE_VERSION = '1'
+
+# Dimensions of the long-format table, in lattice order
+CUBE_DIMENSIONS = ['age_group', 'sex', 'clinical_cohort', 'setting', 'treatment_category', 'outcome_direction']
+
+# Label of a rolled-up dimension in the saved cells table
+ALL = '*'
+
+
+class StratumCube:
+    """Distinct-PMID and record counts at every level of the dimension lattice.
+    
+    Each cuboid (subset of the dimensions) holds one row per observed combination of
+    its labels with the number of distinct studies and of records. Distinct counts do
+    not add up across cells, so every cuboid is computed from the (dimensions, pmid)
+    pairs, each from its smallest already-computed parent. Roll-ups and single-label
+    slices are then lookups in a precomputed cuboid; slices over several labels of one
+    dimension are recounted from the stored pairs.
+    """
+    
+    def __init__(self, dimensions: List[str], cuboids: Dict[Tuple[str, ...], pd.DataFrame], pairs: pd.DataFrame):
+        """Wrap already-computed cuboids; use from_frame() or load() to build one.
+        
+        Args:
+            dimensions: Dimension columns, in lattice order
+            cuboids: Dimension subset (in lattice order) -> labels, studies and records
+            pairs: Distinct (dimensions..., pmid) rows with their record counts
+        """
+        self.dimensions = dimensions
+        self.cuboids = cuboids
+        self.pairs = pairs
+    
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, dimensions: Optional[List[str]] = None) -> 'StratumCube':
+        """Build the full cube from a long-format table.
+        
+        Missing dimension labels are counted as 'unspecified'.
+        """
+        dimensions = list(dimensions or CUBE_DIMENSIONS)
+        missing = [dimension for dimension in dimensions if dimension not in df.columns]
+        if missing:
+            raise ValueError(f"Cannot build a stratum cube without the columns {missing}")
+        
+        frame = pd.DataFrame({
+            dimension: df[dimension].astype(object).fillna('unspecified').astype('category')
+            for dimension in dimensions
+        })
+        frame['pmid'] = df['pmid'].to_numpy()
+        
+        pairs = frame.groupby(dimensions + ['pmid'], observed=True, sort=False).size().reset_index(name='records')
+        
+        # Project (dimensions, pmid) pairs down the lattice, each from its smallest parent
+        projections = {tuple(dimensions): pairs}
+        cuboids = {}
+        for size in range(len(dimensions), -1, -1):
+            for subset in itertools.combinations(dimensions, size):
+                if subset not in projections:
+                    parents = [projections[parent] for parent in projections
+                               if len(parent) == size + 1 and set(subset) <= set(parent)]
+                    parent = min(parents, key=len)
+                    projections[subset] = parent.groupby(list(subset) + ['pmid'], observed=True, sort=False)['records'].sum().reset_index()
+                cuboids[subset] = cls._cuboid_counts(projections[subset], subset)
+        
+        logger.info(f"Built stratum cube with {len(cuboids)} cuboids from {len(pairs)} distinct (cell, study) pairs")
+        return cls(dimensions, cuboids, cls._plain_labels(pairs))
+    
+    @staticmethod
+    def _cuboid_counts(projection: pd.DataFrame, subset: Sequence[str]) -> pd.DataFrame:
+        """Studies and records per label combination of one projection."""
+        if not subset:
+            return pd.DataFrame({'studies': [len(projection)], 'records': [int(projection['records'].sum())]})
+        counts = projection.groupby(list(subset), observed=True, sort=True).agg(
+            studies=('pmid', 'size'), records=('records', 'sum')
+        ).reset_index()
+        return StratumCube._plain_labels(counts)
+    
+    @staticmethod
+    def _plain_labels(frame: pd.DataFrame) -> pd.DataFrame:
+        """Store categorical labels as plain values."""
+        for column in frame.columns:
+            if isinstance(frame[column].dtype, pd.CategoricalDtype):
+                frame[column] = frame[column].astype(object)
+        return frame
+    
+    def _subset(self, dimensions: Sequence[str]) -> Tuple[str, ...]:
+        """Dimension subset in lattice order, validating the names."""
+        unknown = [dimension for dimension in dimensions if dimension not in self.dimensions]
+        if unknown:
+            raise ValueError(f"Unknown cube dimensions {unknown}; available: {self.dimensions}")
+        return tuple(dimension for dimension in self.dimensions if dimension in dimensions)
+    
+    def cuboid(self, dimensions: Sequence[str] = ()) -> pd.DataFrame:
+        """Counts rolled up to the given dimensions (all other dimensions aggregated)."""
+        return self.cuboids[self._subset(dimensions)].copy()
+    
+    def query(self, by: Sequence[str] = (), where: Optional[Dict[str, Union[str, List[str]]]] = None) -> pd.DataFrame:
+        """Distinct studies and records grouped by some dimensions within a slice.
+        
+        Args:
+            by: Dimensions to group by; all others are rolled up
+            where: Dimension -> label (or list of labels) restricting the slice
+        
+        Returns:
+            DataFrame with the by dimensions, studies and records, most studies first
+        
+        Example:
+            cube.query(by=['age_group'], where={'sex': 'female'})
+        """
+        by = list(self._subset(by))
+        where = {dimension: labels if isinstance(labels, (list, tuple, set)) else [labels]
+                 for dimension, labels in (where or {}).items()}
+        self._subset(list(where))
+        
+        if all(len(labels) == 1 for labels in where.values()):
+            # Single-label slices are rows of the cuboid over by + where dimensions
+            counts = self.cuboids[self._subset(by + list(where))]
+            mask = np.ones(len(counts), dtype=bool)
+            for dimension, labels in where.items():
+                mask &= (counts[dimension] == list(labels)[0]).to_numpy()
+            result = counts[mask][by + ['studies', 'records']]
+        else:
+            # A study can fall under several labels, so unions are recounted from the pairs
+            pairs = self.pairs
+            mask = np.ones(len(pairs), dtype=bool)
+            for dimension, labels in where.items():
+                mask &= pairs[dimension].isin(list(labels)).to_numpy()
+            pairs = pairs[mask]
+            if by:
+                result = pairs.groupby(by, sort=True).agg(
+                    studies=('pmid', 'nunique'), records=('records', 'sum')
+                ).reset_index()
+            else:
+                result = pd.DataFrame({'studies': [pairs['pmid'].nunique()], 'records': [int(pairs['records'].sum())]})
+        
+        if not by and result.empty:
+            result = pd.DataFrame({'studies': [0], 'records': [0]})
+        return result.sort_values('studies', ascending=False, kind='stable').reset_index(drop=True)
+    
+    def cells(self) -> pd.DataFrame:
+        """All cuboids in one table, with rolled-up dimensions labelled ALL."""
+        frames = []
+        for subset, counts in self.cuboids.items():
+            frame = counts.copy()
+            for dimension in self.dimensions:
+                if dimension not in subset:
+                    frame[dimension] = ALL
+            frames.append(frame[self.dimensions + ['studies', 'records']])
+        return pd.concat(frames, ignore_index=True)
+    
+    def save(self, cube_dir: str):
+        """Write the cells and distinct pairs as CSV plus a JSON manifest."""
+        os.makedirs(cube_dir, exist_ok=True)
+        self.cells().to_csv(os.path.join(cube_dir, 'cube_cells.csv'), index=False)
+        self.pairs.to_csv(os.path.join(cube_dir, 'cube_pairs.csv'), index=False)
+        
+        manifest = {'version': CUBE_VERSION, 'dimensions': self.dimensions}
+        with open(os.path.join(cube_dir, 'cube.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        logger.info(f"Saved stratum cube ({len(self.cuboids)} cuboids) to {cube_dir}")
+    
+    @classmethod
+    def load(cls, cube_dir: str) -> 'StratumCube':
+        """Read a cube written by save()."""
+        with open(os.path.join(cube_dir, 'cube.json'), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != CUBE_VERSION:
+            raise ValueError(f"Stratum cube in {cube_dir} has version {manifest.get('version')}, "
+                             f"expected {CUBE_VERSION}; rebuild it")
+        
+        dimensions = manifest['dimensions']
+        labels = {dimension: object for dimension in dimensions}
+        cells = pd.read_csv(os.path.join(cube_dir, 'cube_cells.csv'), dtype=labels, keep_default_na=False)
+        pairs = pd.read_csv(os.path.join(cube_dir, 'cube_pairs.csv'), dtype=labels, keep_default_na=False)
+        
+        # Split the cells back into cuboids by which dimensions are rolled up
+        rolled_up = (cells[dimensions] == ALL).to_numpy()
+        cuboids = {}
+        for size in range(len(dimensions) + 1):
+            for subset in itertools.combinations(dimensions, size):
+                present = np.array([dimension in subset for dimension in dimensions])
+                mask = (rolled_up == ~present).all(axis=1)
+                cuboids[subset] = cells[mask][list(subset) + ['studies', 'records']].reset_index(drop=True)
+        
+        return cls(dimensions, cuboids, pairs)
@@ -0,0 +1,292 @@
+"""
+Stratum State Module
+Mergeable per-stratum aggregates, persisted so new batches can be folded in without rescanning history.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import Executor, Future
+from typing import List, Optional, Tuple
+
+import pandas as pd
+import numpy as np
+import logging
+
+from analysis.hyperloglog import StudySketches
+from prepare.long_format import apply_categories, build_item_index
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bump when the state layout changes so old states are rebuilt
+STATE_VERSION = '1'
+
+
+class StratumState:
+    """Per-stratum counts, PMID/journal sets and year ranges that merge by sum, union and min/max.
+    
+    Tables:
+        strata: stratum_id, first, total_records, year_min, year_max
+        pmids: distinct (stratum_id, pmid) pairs (empty in approximate mode)
+        pmid_sketches: HyperLogLog sketches of the PMIDs per stratum_id (approximate mode only)
+        journals: distinct (stratum_id, journal) pairs
+        counts: table, stratum_id, value, value2, count, first
+    
+    'first' is a global sequence number (row for labels, item for multi-value fields)
+    that keeps the first-appearance ordering of the tables stable across batches.
+    """
+    
+    # counts.table -> source column (value2 is only used by treatment_outcome pairs)
+    LABEL_TABLES = {'treatment_category': 'treatment_category', 'outcome_direction': 'outcome_direction'}
+    ITEM_TABLES = {'risk_factor': 'risk_factors', 'symptom': 'symptoms', 'treatment_name': 'treatment_names'}
+    
+    # Long-format columns read by from_frame(), for readers that project columns
+    INPUT_COLUMNS = ['pmid', 'year', 'journal', 'stratum_id'] + list(LABEL_TABLES.values()) + list(ITEM_TABLES.values())
+    
+    def __init__(self, strata: pd.DataFrame, pmids: pd.DataFrame, journals: pd.DataFrame,
+                 counts: pd.DataFrame, rows_seen: int = 0, items_seen: int = 0,
+                 batches: Optional[List[str]] = None, pmid_sketches: Optional[StudySketches] = None):
+        """Wrap already-aggregated tables; use from_frame(), fold() or load() to build one."""
+        self.strata = strata
+        self.pmids = pmids
+        self.pmid_sketches = pmid_sketches
+        self.journals = journals
+        self.counts = counts
+        self.rows_seen = rows_seen
+        self.items_seen = items_seen
+        self.batches = batches or []
+    
+    @classmethod
+    def empty(cls, precision: Optional[int] = None) -> 'StratumState':
+        """State with no rows folded in."""
+        return cls.from_frame(pd.DataFrame(columns=['pmid', 'year', 'journal', 'stratum_id',
+                                                    'treatment_category', 'outcome_direction']),
+                              precision=precision)
+    
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, rows_seen: int = 0, items_seen: int = 0,
+                   precision: Optional[int] = None, executor: Optional[Executor] = None) -> 'StratumState':
+        """Aggregate a long-format table, numbering its rows and items after the given offsets.
+        
+        With a precision, distinct PMIDs per stratum are kept as HyperLogLog sketches
+        with 2^precision registers instead of exact (stratum_id, pmid) pairs.
+        
+        With an executor, every counts table is computed as a separate task. Each task
+        only receives the stratum column and the columns it counts: thread pools read
+        them in place, process pools are sent just those columns.
+        """
+        df = apply_categories(df.reset_index(drop=True))
+        row_seq = np.arange(len(df), dtype=np.int64) + rows_seen
+        stratum = df['stratum_id']
+        
+        def submit(function, *args):
+            if executor is not None:
+                return executor.submit(function, *args)
+            future = Future()
+            future.set_result(function(*args))
+            return future
+        
+        label_tasks = []
+        for table, column in cls.LABEL_TABLES.items():
+            if column in df.columns:
+                label_tasks.append(submit(cls._count, table, stratum, df[column], '', row_seq))
+        
+        if {'treatment_category', 'outcome_direction'} <= set(df.columns):
+            label_tasks.append(submit(cls._count, 'treatment_outcome', stratum, df['treatment_category'],
+                                      df['outcome_direction'], row_seq))
+        
+        item_tasks = [submit(cls._count_items, table, stratum,
+                             df[field] if field in df.columns else pd.Series(np.nan, index=df.index, dtype=object, name=field))
+                      for table, field in cls.ITEM_TABLES.items()]
+        
+        rows = pd.DataFrame({'stratum_id': stratum, 'seq': row_seq, 'pmid': df['pmid'],
+                             'year': pd.to_numeric(df['year'], errors='coerce'), 'journal': df['journal']})
+        rows = rows[stratum.notna().to_numpy()]
+        
+        strata = rows.groupby('stratum_id', sort=False, observed=True).agg(
+            first=('seq', 'min'),
+            total_records=('seq', 'size'),
+            year_min=('year', 'min'),
+            year_max=('year', 'max')
+        ).reset_index()
+        pmids = rows[['stratum_id', 'pmid']].dropna()
+        pmid_sketches = None
+        if precision is not None:
+            pmid_sketches = StudySketches.from_values(cls._plain_labels(pmids[['stratum_id']].copy()),
+                                                      pmids['pmid'].to_numpy(), precision)
+            pmids = pmids.iloc[:0]
+        pmids = pmids.drop_duplicates()
+        journals = rows[['stratum_id', 'journal']].dropna().drop_duplicates()
+        
+        # Items are numbered field by field, so each field's numbers start after the previous fields
+        counts = [task.result() for task in label_tasks]
+        item_offset = items_seen
+        for task in item_tasks:
+            item_counts, item_total = task.result()
+            item_counts['first'] += item_offset
+            counts.append(item_counts)
+            item_offset += item_total
+        
+        return cls(
+            strata=cls._plain_labels(strata),
+            pmids=cls._plain_labels(pmids.reset_index(drop=True)),
+            journals=cls._plain_labels(journals.reset_index(drop=True)),
+            counts=pd.concat(counts, ignore_index=True),
+            rows_seen=rows_seen + len(df),
+            items_seen=item_offset,
+            pmid_sketches=pmid_sketches
+        )
+    
+    @staticmethod
+    def _count_items(table: str, stratum: pd.Series, values: pd.Series) -> Tuple[pd.DataFrame, int]:
+        """Count the items of one multi-value column, numbered from 0 in row and split order.
+        
+        Returns:
+            The counts table and the number of items in the column
+        """
+        item_index = build_item_index(values.to_frame(), [values.name])
+        counts = StratumState._count(table, stratum.iloc[item_index['row_id'].to_numpy()].reset_index(drop=True),
+                                     item_index['item'], '', np.arange(len(item_index), dtype=np.int64))
+        return counts, len(item_index)
+    
+    @staticmethod
+    def _count(table: str, stratum: pd.Series, value: pd.Series, value2, seq: np.ndarray) -> pd.DataFrame:
+        """Count (stratum, value[, value2]) combinations with their first sequence number."""
+        frame = pd.DataFrame({'stratum_id': stratum, 'value': value, 'value2': value2, 'seq': seq})
+        frame = frame.dropna(subset=['stratum_id', 'value', 'value2'])
+        counts = frame.groupby(['stratum_id', 'value', 'value2'], sort=False, observed=True).agg(
+            count=('seq', 'size'), first=('seq', 'min')
+        ).reset_index()
+        counts.insert(0, 'table', table)
+        return StratumState._plain_labels(counts)
+    
+    @staticmethod
+    def _plain_labels(frame: pd.DataFrame) -> pd.DataFrame:
+        """Store categorical labels as plain values so states from different batches merge."""
+        for column in frame.columns:
+            if isinstance(frame[column].dtype, pd.CategoricalDtype):
+                frame[column] = frame[column].astype(object)
+        return frame
+    
+    @property
+    def precision(self) -> Optional[int]:
+        """Sketch precision in approximate mode, None for exact counts."""
+        return self.pmid_sketches.precision if self.pmid_sketches is not None else None
+    
+    def study_counts(self) -> pd.Series:
+        """Distinct PMIDs per stratum_id, estimated in approximate mode."""
+        if self.pmid_sketches is not None:
+            return self.pmid_sketches.estimate().set_index('stratum_id')['studies']
+        return self.pmids.groupby('stratum_id').size()
+    
+    def merge(self, other: 'StratumState') -> 'StratumState':
+        """Combine two states built over disjoint rows (or separately processed shards)."""
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge a stratum state with sketch precision {other.precision} "
+                             f"into one with precision {self.precision}")
+        
+        strata = pd.concat([self.strata, other.strata], ignore_index=True)
+        strata = strata.groupby('stratum_id', sort=False).agg(
+            first=('first', 'min'),
+            total_records=('total_records', 'sum'),
+            year_min=('year_min', 'min'),
+            year_max=('year_max', 'max')
+        ).reset_index()
+        
+        counts = pd.concat([self.counts, other.counts], ignore_index=True)
+        counts = counts.groupby(['table', 'stratum_id', 'value', 'value2'], sort=False).agg(
+            count=('count', 'sum'), first=('first', 'min')
+        ).reset_index()
+        
+        return StratumState(
+            strata=strata,
+            pmids=pd.concat([self.pmids, other.pmids], ignore_index=True).drop_duplicates(ignore_index=True),
+            journals=pd.concat([self.journals, other.journals], ignore_index=True).drop_duplicates(ignore_index=True),
+            counts=counts,
+            rows_seen=max(self.rows_seen, other.rows_seen),
+            items_seen=max(self.items_seen, other.items_seen),
+            batches=self.batches + [batch for batch in other.batches if batch not in self.batches],
+            pmid_sketches=self.pmid_sketches.merge(other.pmid_sketches) if self.pmid_sketches is not None else None
+        )
+    
+    def fold(self, df: pd.DataFrame, batch_id: Optional[str] = None) -> 'StratumState':
+        """Fold a batch of new long-format rows into the state.
+        
+        A batch_id that was already folded in is skipped, so rerunning on the same
+        input does not double-count it.
+        """
+        if batch_id is not None and batch_id in self.batches:
+            logger.warning(f"Batch {batch_id[:12]} was already folded into the stratum state, skipping")
+            return self
+        
+        batch = StratumState.from_frame(df, self.rows_seen, self.items_seen, self.precision)
+        if batch_id is not None:
+            batch.batches = [batch_id]
+        logger.info(f"Folding {len(df)} new records into stratum state with {self.rows_seen} records")
+        return self.merge(batch)
+    
+    @staticmethod
+    def file_batch_id(path: str) -> str:
+        """Content hash identifying an input batch file."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def save(self, state_dir: str):
+        """Write the state as CSV tables plus a JSON manifest."""
+        os.makedirs(state_dir, exist_ok=True)
+        self.strata.to_csv(os.path.join(state_dir, 'strata.csv'), index=False)
+        self.pmids.to_csv(os.path.join(state_dir, 'pmids.csv'), index=False)
+        self.journals.to_csv(os.path.join(state_dir, 'journals.csv'), index=False)
+        self.counts.to_csv(os.path.join(state_dir, 'counts.csv'), index=False)
+        if self.pmid_sketches is not None:
+            self.pmid_sketches.registers.to_csv(os.path.join(state_dir, 'pmid_sketches.csv'), index=False)
+        
+        manifest = {
+            'version': STATE_VERSION,
+            'precision': self.precision,
+            'rows_seen': self.rows_seen,
+            'items_seen': self.items_seen,
+            'batches': self.batches
+        }
+        with open(os.path.join(state_dir, 'state.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        logger.info(f"Saved stratum state ({self.rows_seen} records, {len(self.strata)} strata) to {state_dir}")
+    
+    @classmethod
+    def load(cls, state_dir: str, precision: Optional[int] = None) -> 'StratumState':
+        """Read a saved state, or return an empty one with the given sketch precision if none exists."""
+        manifest_path = os.path.join(state_dir, 'state.json')
+        if not os.path.exists(manifest_path):
+            logger.info(f"No stratum state in {state_dir}, starting a new one")
+            return cls.empty(precision)
+        
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != STATE_VERSION:
+            raise ValueError(f"Stratum state in {state_dir} has version {manifest.get('version')}, "
+                             f"expected {STATE_VERSION}; rebuild it with a full analysis")
+        
+        # Labels and items are text; only empty year cells are missing values
+        def read(name, dtypes):
+            return pd.read_csv(os.path.join(state_dir, name), dtype=dtypes,
+                               keep_default_na=False, na_values={'year_min': [''], 'year_max': ['']})
+        
+        pmid_sketches = None
+        if manifest.get('precision') is not None:
+            registers = read('pmid_sketches.csv', {'stratum_id': object, 'register': np.int64, 'rank': np.int8})
+            pmid_sketches = StudySketches(['stratum_id'], registers, manifest['precision'])
+        
+        return cls(
+            strata=read('strata.csv', {'stratum_id': object}),
+            pmids=read('pmids.csv', {'stratum_id': object}),
+            journals=read('journals.csv', {'stratum_id': object, 'journal': object}),
+            counts=read('counts.csv', {'table': object, 'stratum_id': object, 'value': object, 'value2': object}),
+            rows_seen=manifest['rows_seen'],
+            items_seen=manifest['items_seen'],
+            batches=manifest.get('batches', []),
+            pmid_sketches=pmid_sketches
+        )
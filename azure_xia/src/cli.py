@@ -10,14 +10,23 @@ import logging
 import os
 import json
 from pathlib import Path
+from typing import Optional
 
 # Add src to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
 from prepare.gpt_output_splitter import GPTOutputSplitter
+from prepare.extraction_cache import ExtractionCache
 from prepare.normalize_labels import FieldNormalizer
 from loaders.csv_loader import MentalHealthDataLoader
 from analysis.aggregates import StratumAggregator
+from analysis.stratum_state import StratumState
+from analysis.stratum_cube import CUBE_DIMENSIONS, StratumCube
+from analysis.hyperloglog import precision_for_error
+from pipeline_runner import INTERMEDIATE_MODES, PipelineRunner
+from loaders.table_io import infer_format, read_result_table, read_table, result_table_path, with_format, write_table
+from loaders.text_store import TEXT_STORE_FIELDS, TextStore, TextStoreWriter
+from loaders.data_profile import PROFILE_FILE, DatasetProfile, ProfileBuilder
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -27,23 +36,63 @@ def split_fields_command(args):
     """Split GPT output fields."""
     logger.info(f"Splitting GPT output fields from {args.input}")
     
-    import pandas as pd
-    df = pd.read_csv(args.input)
-    
     splitter = GPTOutputSplitter()
-    processed_df = splitter.process_dataframe(df)
-    splitter.save_processed_data(processed_df, args.output)
+    
+    cache = None
+    if args.cache:
+        cache = ExtractionCache(args.cache)
+        # Entries from other pattern versions can never hit again
+        cache.invalidate(keep_version=None if args.clear_cache else splitter.pattern_version)
+    
+    # The long texts go to the store and the processed table keeps only their pmid
+    text_store = TextStoreWriter(args.text_store) if args.text_store else None
+    
+    # Profiled as the rows are split, before the texts are moved out
+    profiler = ProfileBuilder() if args.profile else None
+    
+    output_format = args.format or infer_format(args.output)
+    if args.chunksize:
+        _check_chunked_formats(args.input, output_format)
+        splitter.process_csv_in_chunks(args.input, args.output, args.chunksize,
+                                       workers=args.workers, cache=cache, text_store=text_store,
+                                       profiler=profiler)
+    else:
+        df = read_table(args.input)
+        
+        processed_df = splitter.process_dataframe(df, workers=args.workers, cache=cache)
+        if profiler is not None:
+            profiler.add(processed_df)
+        if text_store is not None:
+            processed_df = text_store.detach(processed_df)
+        splitter.save_processed_data(processed_df, args.output, output_format)
+    
+    if cache is not None:
+        cache.close()
+    if text_store is not None:
+        text_store.close()
+    if profiler is not None:
+        profiler.build().save(args.profile)
     
     print(f"✓ Field splitting complete. Output saved to {args.output}")
 
 
+def _check_chunked_formats(input_path: str, output_format: str):
+    """Chunked processing streams CSV rows in and appends CSV chunks out."""
+    if infer_format(input_path) != 'csv' or output_format != 'csv':
+        raise ValueError("--chunksize reads and appends CSV chunks; use CSV input and --format csv")
+
+
 def load_data_command(args):
     """Load and validate data."""
     logger.info(f"Loading and validating data from {args.input}")
     
-    loader = MentalHealthDataLoader()
-    df = loader.load_data(args.input)
-    stats = loader.get_summary_stats(df)
+    # Only the columns the summary reports; the abstract and raw GPT text are not read
+    loader = MentalHealthDataLoader(approximate_distinct=args.approximate)
+    df = loader.load_data(args.input, columns=MentalHealthDataLoader.SUMMARY_COLUMNS, text_store_dir=args.text_store)
+    
+    # The profile computed while loading is reused instead of rescanning the data
+    profile = loader.profile
+    stats = loader.get_summary_stats(df, profile)
     
     print("\n" + "="*50)
     print("DATASET SUMMARY")
@@ -55,38 +104,65 @@ def load_data_command(args):
     print("\nField Completeness:")
     for field, data in stats['field_completeness'].items():
         print(f"  {field}: {data['count']} ({data['percentage']:.1f}%)")
+    
+    print("\nRecords per Year:")
+    for year, count in profile.year_histogram.items():
+        print(f"  {year}: {count}")
+    
+    print("\nTop Journals:")
+    for journal, count in profile.journal_counts.head(5).items():
+        print(f"  {journal}: {count}")
+    
+    if args.profile:
+        profile.save(args.profile)
+        print(f"\n✓ Dataset profile saved to {args.profile}")
 
 
 def normalize_command(args):
     """Normalize fields and convert to long format."""
     logger.info(f"Normalizing fields from {args.input}")
     
-    import pandas as pd
-    df = pd.read_csv(args.input)
+    normalizer = FieldNormalizer(memo_size=args.memo_size, memo_path=args.memo_cache)
     
-    normalizer = FieldNormalizer()
-    normalized_df = normalizer.explode_to_long_format(df)
+    output_format = args.format or infer_format(args.output)
+    if args.chunksize:
+        _check_chunked_formats(args.input, output_format)
+        original_rows, normalized_rows = normalizer.explode_csv_in_chunks(args.input, args.output, args.chunksize)
+    else:
+        # Only the fields being normalized; the abstract and raw GPT output are not parsed
+        df = read_table(args.input, columns=FieldNormalizer.INPUT_COLUMNS)
+        
+        normalized_df = normalizer.explode_to_long_format(df)
+        write_table(normalized_df, args.output, output_format)
+        original_rows, normalized_rows = len(df), len(normalized_df)
+    
+    normalizer.memo.log_stats()
+    normalizer.memo.save()
     
-    normalized_df.to_csv(args.output, index=False)
     print(f"✓ Normalization complete. Output saved to {args.output}")
-    print(f"  Original rows: {len(df)}")
-    print(f"  Normalized rows: {len(normalized_df)}")
+    print(f"  Original rows: {original_rows}")
+    print(f"  Normalized rows: {normalized_rows}")
 
 
 def analyze_command(args):
     """Perform stratum aggregation analysis."""
     logger.info(f"Analyzing strata from {args.input}")
     
-    import pandas as pd
-    df = pd.read_csv(args.input)
+    df = read_table(args.input, columns=StratumState.INPUT_COLUMNS)
     
-    aggregator = StratumAggregator(min_stratum_size=args.min_size)
-    results = aggregator.analyze_by_strata(df)
+    aggregator = StratumAggregator(min_stratum_size=args.min_size, approximate_error=args.approximate)
     
     # Ensure output directory exists
     os.makedirs(args.output_dir, exist_ok=True)
     
-    aggregator.save_analysis_results(results, args.output_dir)
+    if args.incremental:
+        state_dir = args.state or os.path.join(args.output_dir, 'stratum_state')
+        results = aggregator.analyze_incremental(df, state_dir, StratumState.file_batch_id(args.input))
+    else:
+        results = aggregator.analyze_by_strata(df, parallel=args.parallel)
+    
+    aggregator.save_analysis_results(results, args.output_dir, aggregator.item_matrices, args.format)
+    _replace_profile(args.output_dir, args.profile)
     
     print(f"✓ Analysis complete. Results saved to {args.output_dir}")
     print("\nAnalysis Summary:")
@@ -94,6 +170,86 @@ def analyze_command(args):
         print(f"  {name}: {len(df_result)} rows")
 
 
+def _replace_profile(tables_dir: str, profile_path: Optional[str]):
+    """Save the profile of the analyzed data next to the tables, or remove the one of an earlier run."""
+    target = os.path.join(tables_dir, PROFILE_FILE)
+    if profile_path:
+        if os.path.abspath(profile_path) != os.path.abspath(target):
+            DatasetProfile.load(profile_path).save(target)
+    elif DatasetProfile.discard(tables_dir):
+        # It would describe another dataset than the new tables
+        logger.info(f"Removed the stale {PROFILE_FILE} from {tables_dir}")
+
+
+def merge_states_command(args):
+    """Merge stratum states of separately processed shards and emit the tables."""
+    logger.info(f"Merging {len(args.state_dirs)} stratum states")
+    
+    states = [StratumState.load(state_dir) for state_dir in args.state_dirs]
+    state = states[0]
+    for other in states[1:]:
+        state = state.merge(other)
+    
+    aggregator = StratumAggregator(min_stratum_size=args.min_size)
+    results = aggregator.tables_from_state(state)
+    
+    os.makedirs(args.output_dir, exist_ok=True)
+    aggregator.save_analysis_results(results, args.output_dir, aggregator.item_matrices, args.format)
+    _replace_profile(args.output_dir, None)
+    if args.state:
+        state.save(args.state)
+    
+    print(f"✓ Merged {len(states)} stratum states. Results saved to {args.output_dir}")
+
+
+def cube_command(args):
+    """Build the stratum cube of a normalized table."""
+    logger.info(f"Building stratum cube from {args.input}")
+    
+    df = read_table(args.input, columns=CUBE_DIMENSIONS + ['pmid'])
+    
+    cube = StratumCube.from_frame(df)
+    cube.save(args.output_dir)
+    
+    print(f"✓ Stratum cube saved to {args.output_dir}")
+    print(f"  Cuboids: {len(cube.cuboids)}")
+    print(f"  Distinct studies: {cube.query()['studies'].iloc[0]}")
+
+
+def query_command(args):
+    """Roll up or slice a saved stratum cube."""
+    cube = StratumCube.load(args.cube_dir)
+    
+    by = [dimension for dimension in (args.by or '').split(',') if dimension]
+    where = {}
+    for condition in args.where or []:
+        dimension, _, labels = condition.partition('=')
+        where[dimension] = labels.split(',')
+    
+    result = cube.query(by, where)
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f"✓ Query result saved to {args.output}")
+    else:
+        print(result.to_string(index=False))
+
+
+def text_command(args):
+    """Print stored texts of some studies."""
+    with TextStore(args.store_dir) as store:
+        fields = args.field or store.fields
+        for pmid in args.pmids:
+            if pmid not in store:
+                print(f"PMID {pmid}: not in the text store")
+                continue
+            print("="*60)
+            print(f"PMID {pmid}")
+            for field in fields:
+                text = store.get(pmid, field)
+                print(f"\n[{field}]")
+                print(text if text is not None else "(missing)")
+
+
 def summary_command(args):
     """Generate user-friendly summary of results."""
     logger.info(f"Generating summary from {args.tables_dir}")
@@ -101,7 +257,7 @@ def summary_command(args):
     try:
         from reporting.summary_report import SummaryReportGenerator
         
-        generator = SummaryReportGenerator(args.tables_dir)
+        generator = SummaryReportGenerator(args.tables_dir, args.format)
         output_file = f"{args.output_dir}/analysis_summary.txt" if hasattr(args, 'output_dir') and args.output_dir else None
         
         if output_file:
@@ -109,7 +265,7 @@ def summary_command(args):
         
         report = generator.generate_full_report(output_file)
         print(report)
-        
+    
     except Exception as e:
         print(f"❌ Summary generation failed: {e}")
         return
@@ -122,7 +278,7 @@ def report_command(args):
     try:
         from reporting.assignment_report import AssignmentReportGenerator
         
-        generator = AssignmentReportGenerator(args.tables_dir, args.plots_dir)
+        generator = AssignmentReportGenerator(args.tables_dir, args.plots_dir, args.format)
         
         # Create output directory
         os.makedirs(args.output_dir, exist_ok=True)
@@ -156,7 +312,7 @@ def report_command(args):
                 print(f"  • {req.replace('_', ' ').title()}: {data['status']}")
         
         print(f"\n✅ All reports generated in: {args.output_dir}")
-        
+    
     except Exception as e:
         print(f"❌ Report generation failed: {e}")
         return
@@ -171,12 +327,12 @@ def narratives_command(args):
         import pandas as pd
         
         # Load stratum summary
-        summary_path = f"{args.tables_dir}/stratum_summary_by_stratum.csv"
+        summary_path = result_table_path(args.tables_dir, 'stratum_summary', args.format)
         if not os.path.exists(summary_path):
             print(f"❌ Stratum summary not found: {summary_path}")
             return
         
-        df = pd.read_csv(summary_path)
+        df = read_table(summary_path)
         generator = StratumNarrativeGenerator()
         
         if not generator.client:
@@ -219,7 +375,7 @@ def narratives_command(args):
             }, f, indent=2)
         
         print(f"\n✓ Insights saved to {insights_path}")
-        
+    
     except ImportError as e:
         print(f"⚠️  Required modules not available: {e}")
         return
@@ -234,25 +390,24 @@ def visualize_command(args):
     
     try:
         from viz.basic_plots import BasicPlotter
-        import pandas as pd
+        from analysis.item_matrix import StratumItemMatrix
         
         # Load analysis results
         analysis_results = {}
-        result_files = [
-            'stratum_summary_by_stratum.csv',
-            'risk_factors_by_stratum.csv',
-            'treatment_outcomes_by_stratum.csv',
-            'symptoms_by_stratum.csv'
-        ]
+        result_names = ['stratum_summary', 'risk_factors', 'treatment_outcomes', 'symptoms']
         
-        for file in result_files:
-            file_path = f"{args.tables_dir}/{file}"
-            if os.path.exists(file_path):
-                key = file.replace('_by_stratum.csv', '')
-                analysis_results[key] = pd.read_csv(file_path)
+        for key in result_names:
+            if os.path.exists(result_table_path(args.tables_dir, key, args.format)):
+                analysis_results[key] = read_result_table(args.tables_dir, key, table_format=args.format)
         
-        # Load normalized data
-        normalized_df = pd.read_csv(args.normalized_csv)
+        # Prefer the sparse item matrices written by analyze over their long tables
+        for key in ['risk_factors', 'symptoms']:
+            matrix_path = f"{args.tables_dir}/{key}_matrix.npz"
+            if os.path.exists(matrix_path):
+                analysis_results[key] = StratumItemMatrix.load(matrix_path)
+        
+        # Load the normalized columns the plots use
+        normalized_df = read_table(args.normalized_csv, columns=BasicPlotter.NORMALIZED_COLUMNS)
         
         # Create visualizations
         os.makedirs(args.output_dir, exist_ok=True)
@@ -260,7 +415,7 @@ def visualize_command(args):
         plotter.create_all_visualizations(analysis_results, normalized_df)
         
         print(f"✓ Visualizations created in {args.output_dir}")
-        
+    
     except ImportError as e:
         print(f"⚠️  Visualization libraries not available: {e}")
         print("Run: pip install matplotlib seaborn plotly")
@@ -271,44 +426,22 @@ def pipeline_command(args):
     """Run the complete analysis pipeline."""
     logger.info("Starting complete analysis pipeline")
     
-    # Create output directories
-    os.makedirs("outputs/tables", exist_ok=True)
-    os.makedirs("outputs/plots", exist_ok=True)
-    
     try:
-        # Step 1: Split fields
-        print("Step 1: Splitting GPT output fields...")
-        split_args = argparse.Namespace(
-            input=args.input,
-            output="outputs/tables/processed_data.csv"
-        )
-        split_fields_command(split_args)
-        
-        # Step 2: Normalize
-        print("\nStep 2: Normalizing fields...")
-        norm_args = argparse.Namespace(
-            input="outputs/tables/processed_data.csv",
-            output="outputs/tables/normalized_data.csv"
-        )
-        normalize_command(norm_args)
-        
-        # Step 3: Analyze
-        print("\nStep 3: Performing stratum analysis...")
-        analyze_args = argparse.Namespace(
-            input="outputs/tables/normalized_data.csv",
-            output_dir="outputs/tables",
-            min_size=3
-        )
-        analyze_command(analyze_args)
-        
-        # Step 4: Visualize (if libraries available)
-        print("\nStep 4: Creating visualizations...")
-        viz_args = argparse.Namespace(
-            tables_dir="outputs/tables",
-            normalized_csv="outputs/tables/normalized_data.csv",
-            output_dir="outputs/plots"
-        )
-        visualize_command(viz_args)
+        if args.chunksize:
+            # Streaming bounds memory by the chunk size, so stages hand over through files
+            _run_pipeline_from_files(args)
+        else:
+            runner = PipelineRunner(
+                table_format=args.format,
+                intermediates=args.intermediates,
+                workers=args.workers,
+                cache_path=args.cache,
+                clear_cache=args.clear_cache,
+                memo_size=args.memo_size,
+                memo_path=args.memo_cache,
+                text_store_dir=args.text_store
+            )
+            runner.run(args.input)
         
         print("\n" + "="*60)
         print("🎉 PIPELINE COMPLETE!")
@@ -316,13 +449,87 @@ def pipeline_command(args):
         print("Results available in:")
         print("  • outputs/tables/ - Analysis tables")
         print("  • outputs/plots/ - Visualizations")
-        
+    
     except Exception as e:
         logger.error(f"Pipeline failed: {str(e)}")
         print(f"❌ Pipeline failed: {str(e)}")
         sys.exit(1)
 
 
+def _run_pipeline_from_files(args):
+    """Chain the stage commands, each reading the previous stage's output file."""
+    # Create output directories
+    os.makedirs("outputs/tables", exist_ok=True)
+    os.makedirs("outputs/plots", exist_ok=True)
+    
+    # Intermediate tables in the requested format
+    processed_path = with_format("outputs/tables/processed_data.csv", args.format)
+    normalized_path = with_format("outputs/tables/normalized_data.csv", args.format)
+    profile_path = os.path.join("outputs/tables", PROFILE_FILE)
+    
+    # Step 1: Split fields
+    print("Step 1: Splitting GPT output fields...")
+    split_args = argparse.Namespace(
+        input=args.input,
+        output=processed_path,
+        format=args.format,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        cache=args.cache,
+        clear_cache=args.clear_cache,
+        text_store=args.text_store,
+        profile=profile_path
+    )
+    split_fields_command(split_args)
+    
+    # Step 2: Normalize
+    print("\nStep 2: Normalizing fields...")
+    norm_args = argparse.Namespace(
+        input=processed_path,
+        output=normalized_path,
+        format=args.format,
+        chunksize=args.chunksize,
+        memo_size=args.memo_size,
+        memo_cache=args.memo_cache
+    )
+    normalize_command(norm_args)
+    
+    # Step 3: Analyze
+    print("\nStep 3: Performing stratum analysis...")
+    analyze_args = argparse.Namespace(
+        input=normalized_path,
+        output_dir="outputs/tables",
+        format=args.format,
+        min_size=3,
+        incremental=False,
+        state=None,
+        approximate=None,
+        parallel=None,
+        profile=profile_path
+    )
+    analyze_command(analyze_args)
+    
+    # Step 4: Visualize (if libraries available)
+    print("\nStep 4: Creating visualizations...")
+    viz_args = argparse.Namespace(
+        tables_dir="outputs/tables",
+        normalized_csv=normalized_path,
+        output_dir="outputs/plots",
+        format=args.format
+    )
+    visualize_command(viz_args)
+
+
+def _approximate_error(value: str) -> float:
+    """Argument type of --approximate: a relative standard error between 0 and 1."""
+    try:
+        error = float(value)
+        precision_for_error(error)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return error
+
+
 def main():
     """Main CLI entry point."""
     parser = argparse.ArgumentParser(
@@ -337,7 +544,17 @@ Examples:
   python cli.py split data/step3_extracted.csv outputs/processed.csv
   python cli.py normalize outputs/processed.csv outputs/normalized.csv
   python cli.py analyze outputs/normalized.csv outputs/tables/
+  python cli.py analyze --parallel threads outputs/normalized.csv outputs/tables/
+  python cli.py normalize outputs/processed.parquet outputs/normalized.parquet
+  python cli.py analyze --format parquet outputs/normalized.parquet outputs/tables/
+  python cli.py analyze --incremental outputs/normalized_new_rows.csv outputs/tables/
+  python cli.py analyze --incremental --approximate 0.01 --state outputs/shard1_state shard1.csv outputs/shard1/
+  python cli.py merge-states outputs/tables/ outputs/shard1_state outputs/shard2_state
+  python cli.py cube outputs/normalized.csv outputs/cube/
+  python cli.py query outputs/cube/ --by age_group,clinical_cohort --where sex=female
   python cli.py visualize outputs/tables/ outputs/normalized.csv outputs/plots/
+  python cli.py split --text-store outputs/texts data/step3_extracted.csv outputs/processed.csv
+  python cli.py text outputs/texts 38090695 --field abstract
         """
     )
     
@@ -347,47 +564,106 @@ Examples:
     split_parser = subparsers.add_parser('split', help='Split GPT output fields')
     split_parser.add_argument('input', help='Input CSV with gpt_output column')
     split_parser.add_argument('output', help='Output CSV with split fields')
+    split_parser.add_argument('--workers', type=int, default=1, help='Worker processes for field extraction (default: 1)')
+    split_parser.add_argument('--chunksize', type=int, help='Stream the input in chunks of this many rows (default: load whole file)')
+    split_parser.add_argument('--cache', help='SQLite file caching extracted fields between runs (optional)')
+    split_parser.add_argument('--clear-cache', action='store_true', help='Empty the extraction cache before splitting')
+    split_parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], help='Output table format (default: from the output extension, else csv)')
+    split_parser.add_argument('--text-store', help=f"Directory to move the {', '.join(TEXT_STORE_FIELDS)} text into, keyed by pmid (default: keep it in the table)")
+    split_parser.add_argument('--profile', help='JSON file to save the profile of the processed data to, for analyze --profile (optional)')
     
     # Load command
     load_parser = subparsers.add_parser('load', help='Load and validate data')
     load_parser.add_argument('input', help='Input CSV file')
+    load_parser.add_argument('--profile', help='JSON file to save the dataset profile to, for analyze --profile (optional)')
+    load_parser.add_argument('--approximate', type=_approximate_error, metavar='ERROR', help='Estimate distinct counts with HyperLogLog sketches of this relative standard error (default: exact counts)')
+    load_parser.add_argument('--text-store', help=f"Directory to write the {', '.join(TEXT_STORE_FIELDS)} text to, keyed by pmid (optional)")
+    
+    # Text command
+    text_parser = subparsers.add_parser('text', help='Print the stored abstract, GPT output or reasoning of studies')
+    text_parser.add_argument('store_dir', help='Directory with a text store')
+    text_parser.add_argument('pmids', nargs='+', help='PMIDs to print')
+    text_parser.add_argument('--field', action='append', choices=TEXT_STORE_FIELDS, help='Field to print; repeatable (default: all stored fields)')
     
     # Normalize command
     norm_parser = subparsers.add_parser('normalize', help='Normalize fields')
     norm_parser.add_argument('input', help='Input CSV with extracted fields')
     norm_parser.add_argument('output', help='Output CSV in long format')
+    norm_parser.add_argument('--chunksize', type=int, help='Stream the input in chunks of this many rows (default: load whole file)')
+    norm_parser.add_argument('--memo-size', type=int, default=10000, help='Maximum memoized normalization results, 0 to disable (default: 10000)')
+    norm_parser.add_argument('--memo-cache', help='JSON file persisting memoized normalization results between runs (optional)')
+    norm_parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], help='Output table format (default: from the output extension, else csv)')
     
     # Analyze command
     analyze_parser = subparsers.add_parser('analyze', help='Perform stratum analysis')
     analyze_parser.add_argument('input', help='Input normalized CSV')
     analyze_parser.add_argument('output_dir', help='Output directory for analysis results')
     analyze_parser.add_argument('--min-size', type=int, default=3, help='Minimum stratum size (default: 3)')
+    analyze_parser.add_argument('--incremental', action='store_true', help='Fold the input (new rows only) into the saved stratum state instead of recomputing')
+    analyze_parser.add_argument('--state', help='Stratum state directory for --incremental (default: <output_dir>/stratum_state)')
+    analyze_parser.add_argument('--approximate', type=_approximate_error, metavar='ERROR', help='Estimate distinct studies with HyperLogLog sketches of this relative standard error, e.g. 0.01 (default: exact counts)')
+    analyze_parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], default='csv', help='Result table format (default: csv)')
+    analyze_parser.add_argument('--parallel', choices=['threads', 'processes'], help='Compute the result tables concurrently in a thread or process pool (default: serial)')
+    analyze_parser.add_argument('--profile', help=f"Dataset profile of the input (from split or load --profile) to save as {PROFILE_FILE} for summary and report (default: remove an earlier one)")
+    
+    # Merge states command
+    merge_parser = subparsers.add_parser('merge-states', help='Merge stratum states of separately analyzed shards')
+    merge_parser.add_argument('output_dir', help='Output directory for analysis results')
+    merge_parser.add_argument('state_dirs', nargs='+', help='Stratum state directories written by analyze --incremental')
+    merge_parser.add_argument('--min-size', type=int, default=3, help='Minimum stratum size (default: 3)')
+    merge_parser.add_argument('--state', help='Directory to save the merged state (optional)')
+    merge_parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], default='csv', help='Result table format (default: csv)')
+    
+    # Cube command
+    cube_parser = subparsers.add_parser('cube', help='Build the stratum cube for interactive roll-ups')
+    cube_parser.add_argument('input', help='Input normalized CSV')
+    cube_parser.add_argument('output_dir', help='Output directory for the cube')
+    
+    # Query command
+    query_parser = subparsers.add_parser('query', help='Roll up or slice a saved stratum cube')
+    query_parser.add_argument('cube_dir', help='Directory with a saved cube')
+    query_parser.add_argument('--by', help='Comma-separated dimensions to group by (default: overall total)')
+    query_parser.add_argument('--where', action='append', help='Slice as dimension=label[,label...]; repeatable')
+    query_parser.add_argument('--output', help='CSV file for the result (default: print it)')
     
     # Visualize command
     viz_parser = subparsers.add_parser('visualize', help='Create visualizations')
     viz_parser.add_argument('tables_dir', help='Directory with analysis tables')
     viz_parser.add_argument('normalized_csv', help='Normalized data CSV')
     viz_parser.add_argument('output_dir', help='Output directory for plots')
+    viz_parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], help='Format of the analysis tables to read (default: the format analyze recorded in tables_dir)')
     
     # Summary command  
     summary_parser = subparsers.add_parser('summary', help='Generate user-friendly summary')
     summary_parser.add_argument('tables_dir', help='Directory with analysis tables')
     summary_parser.add_argument('--output-dir', help='Output directory for summary file (optional)')
+    summary_parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], help='Format of the analysis tables to read (default: the format analyze recorded in tables_dir)')
     
     # Assignment report command
     report_parser = subparsers.add_parser('report', help='Generate assignment report')
     report_parser.add_argument('tables_dir', help='Directory with analysis tables')
     report_parser.add_argument('plots_dir', help='Directory with plots')
     report_parser.add_argument('--output-dir', default='outputs/report', help='Output directory for reports')
+    report_parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], help='Format of the analysis tables to read (default: the format analyze recorded in tables_dir)')
     
     # Narratives command
     narr_parser = subparsers.add_parser('narratives', help='Generate LLM insights')
     narr_parser.add_argument('tables_dir', help='Directory with analysis tables')
     narr_parser.add_argument('output_dir', help='Output directory for insights')
+    narr_parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], help='Format of the analysis tables to read (default: the format analyze recorded in tables_dir)')
     
     # Pipeline command
     pipeline_parser = subparsers.add_parser('pipeline', help='Run complete pipeline')
     pipeline_parser.add_argument('input', help='Input CSV with gpt_output column')
+    pipeline_parser.add_argument('--workers', type=int, default=1, help='Worker processes for field extraction (default: 1)')
+    pipeline_parser.add_argument('--chunksize', type=int, help='Stream the input in chunks of this many rows (default: load whole file)')
+    pipeline_parser.add_argument('--cache', help='SQLite file caching extracted fields between runs (optional)')
+    pipeline_parser.add_argument('--clear-cache', action='store_true', help='Empty the extraction cache before splitting')
+    pipeline_parser.add_argument('--memo-size', type=int, default=10000, help='Maximum memoized normalization results, 0 to disable (default: 10000)')
+    pipeline_parser.add_argument('--memo-cache', help='JSON file persisting memoized normalization results between runs (optional)')
+    pipeline_parser.add_argument('--format', choices=['csv', 'parquet', 'feather'], default='csv', help='Format of the intermediate and result tables (default: csv)')
+    pipeline_parser.add_argument('--text-store', help=f"Directory to move the {', '.join(TEXT_STORE_FIELDS)} text into after splitting, keyed by pmid (default: keep it in the tables)")
+    pipeline_parser.add_argument('--intermediates', choices=INTERMEDIATE_MODES, default='async', help='Write the processed and normalized tables in the background (async), before the next stage (sync) or not at all (none); --chunksize always writes them (default: async)')
     
     args = parser.parse_args()
     
@@ -399,8 +675,12 @@ Examples:
     commands = {
         'split': split_fields_command,
         'load': load_data_command,
+        'text': text_command,
         'normalize': normalize_command,
         'analyze': analyze_command,
+        'merge-states': merge_states_command,
+        'cube': cube_command,
+        'query': query_command,
         'visualize': visualize_command,
         'summary': summary_command,
         'report': report_command,
@@ -4,10 +4,18 @@ Loads and validates the processed mental health literature data.
 """
 
 import pandas as pd
-import numpy as np
 from typing import List, Dict, Any, Optional
 import logging
 
+from loaders.text_store import TEXT_STORE_FIELDS, TextStore
+from loaders.data_profile import DatasetProfile
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+except ImportError:
+    pa = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -15,99 +23,139 @@ logger = logging.getLogger(__name__)
 class MentalHealthDataLoader:
     """Loads and validates mental health literature data from CSV."""
     
-    def __init__(self):
-        """Initialize the data loader."""
+    # Declared dtypes; other columns (pmid, year, date) are inferred
+    COLUMN_DTYPES = {
+        'title': 'str', 'abstract': 'str', 'gpt_output': 'str', 'chain_of_thought': 'str',
+        'journal': 'category', 'publication_type': 'category', 'classification': 'category',
+        'population': 'str', 'risk_factors': 'str', 'symptoms': 'str', 'treatments': 'str', 'outcomes': 'str'
+    }
+    
+    # Extracted fields cleaned by _clean_data()
+    TEXT_FIELDS = ['population', 'risk_factors', 'symptoms', 'treatments', 'outcomes']
+    
+    # Columns get_summary_stats() needs, without the abstract and raw GPT text
+    SUMMARY_COLUMNS = ['pmid', 'year', 'journal'] + TEXT_FIELDS
+    
+    def __init__(self, approximate_distinct: Optional[float] = None):
+        """Initialize the data loader.
+        
+        Args:
+            approximate_distinct: Estimate the profile's distinct counts with HyperLogLog
+                sketches of this relative standard error (default: exact counts)
+        """
         self.required_columns = [
             'pmid', 'title', 'abstract', 'year', 'journal',
             'population', 'risk_factors', 'symptoms', 'treatments', 'outcomes'
         ]
         self.optional_columns = ['chain_of_thought', 'date', 'publication_type', 'classification']
+        self.approximate_distinct = approximate_distinct
+        self.profile: Optional[DatasetProfile] = None
     
-    def load_data(self, csv_path: str) -> pd.DataFrame:
-        """Load data from CSV file with validation."""
+    def load_data(self, csv_path: str, columns: Optional[List[str]] = None,
+                  text_store_dir: Optional[str] = None) -> pd.DataFrame:
+        """Load data from CSV file with validation.
+        
+        Args:
+            csv_path: Input CSV file
+            columns: Columns to read (default: all); required columns are checked
+                against the header either way
+            text_store_dir: Write the abstract, GPT output and reasoning text to a
+                TextStore here and leave them out of the frame (optional)
+        
+        The cleaned data is profiled once; the result is kept in self.profile.
+        """
         logger.info(f"Loading data from {csv_path}")
         
         try:
-            df = pd.read_csv(csv_path)
-            logger.info(f"Loaded {len(df)} rows, {len(df.columns)} columns")
+            available = list(pd.read_csv(csv_path, nrows=0).columns)
+            usecols = available if columns is None else [col for col in available if col in columns]
+            if text_store_dir:
+                TextStore.write_csv(csv_path, text_store_dir)
+                usecols = [col for col in usecols if col not in TEXT_STORE_FIELDS]
+            df = self._read_csv(csv_path, usecols)
+            logger.info(f"Loaded {len(df)} rows, {len(df.columns)} of {len(available)} columns")
             
             # Validate structure
-            self._validate_structure(df)
+            self._validate_structure(df, available)
             
             # Clean and prepare data
-            df = self._clean_data(df)
+            self._clean_data(df)
+            
+            # Log data quality
+            self.profile = DatasetProfile.from_frame(df, self.approximate_distinct)
+            logger.info(f"Year range: {self.profile.year_range}")
+            self._log_data_quality(self.profile)
             
             logger.info(f"Data validation successful. Final shape: {df.shape}")
             return df
-            
+        
         except Exception as e:
             logger.error(f"Failed to load data: {str(e)}")
             raise
     
-    def _validate_structure(self, df: pd.DataFrame):
-        """Validate the DataFrame structure."""
-        missing_columns = [col for col in self.required_columns if col not in df.columns]
+    def _read_csv(self, csv_path: str, usecols: List[str]) -> pd.DataFrame:
+        """Read the selected columns with the declared dtypes, with pyarrow's parser if installed."""
+        dtypes = {col: dtype for col, dtype in self.COLUMN_DTYPES.items() if col in usecols}
+        if pa is None:
+            return pd.read_csv(csv_path, usecols=usecols, dtype=dtypes)
+        
+        # pandas' pyarrow engine rejects quoted newlines (multi-line abstracts), so parse directly
+        column_types = {col: pa.dictionary(pa.int32(), pa.string()) if dtype == 'category' else pa.string()
+                        for col, dtype in dtypes.items()}
+        table = pa_csv.read_csv(
+            csv_path,
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(include_columns=usecols, column_types=column_types,
+                                                  strings_can_be_null=True)
+        )
+        return table.to_pandas()
+    
+    def _validate_structure(self, df: pd.DataFrame, available: Optional[List[str]] = None):
+        """Validate the DataFrame structure against the file's columns (default: the loaded ones)."""
+        available = list(df.columns) if available is None else available
+        missing_columns = [col for col in self.required_columns if col not in available]
         if missing_columns:
             raise ValueError(f"Missing required columns: {missing_columns}")
         
         logger.info("✓ All required columns present")
         
         # Check for completely empty columns
-        empty_columns = [col for col in self.required_columns if df[col].isna().all()]
+        empty_columns = [col for col in self.required_columns if col in df.columns and df[col].isna().all()]
         if empty_columns:
             logger.warning(f"Warning: Columns with all missing values: {empty_columns}")
     
     def _clean_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Clean and prepare the data."""
-        df = df.copy()
-        
+        """Clean and prepare the data in place."""
         # Convert year to numeric
         if 'year' in df.columns:
             df['year'] = pd.to_numeric(df['year'], errors='coerce')
-            year_range = (df['year'].min(), df['year'].max())
-            logger.info(f"Year range: {year_range}")
         
-        # Clean text fields
-        text_fields = ['population', 'risk_factors', 'symptoms', 'treatments', 'outcomes']
-        for field in text_fields:
+        # Clean text fields; blank cells and 'nan' strings become missing values
+        for field in self.TEXT_FIELDS:
             if field in df.columns:
-                df[field] = df[field].astype(str)
-                df[field] = df[field].str.strip()
-                df[field] = df[field].replace('nan', '')
-                df[field] = df[field].replace('', np.nan)
-        
-        # Log data quality
-        self._log_data_quality(df)
+                values = df[field].astype(str).str.strip()
+                df[field] = values.mask(values.isin(['', 'nan']))
         
         return df
     
-    def _log_data_quality(self, df: pd.DataFrame):
+    def _log_data_quality(self, profile: DatasetProfile):
         """Log data quality statistics."""
-        logger.info("Data Quality Summary:")
-        for col in self.required_columns:
-            if col in df.columns:
-                missing_pct = (df[col].isna().sum() / len(df)) * 100
-                logger.info(f"  {col}: {missing_pct:.1f}% missing")
-    
-    def get_summary_stats(self, df: pd.DataFrame) -> Dict[str, Any]:
-        """Get summary statistics about the dataset."""
-        stats = {
-            'total_records': len(df),
-            'year_range': (df['year'].min(), df['year'].max()) if 'year' in df.columns else None,
-            'unique_journals': df['journal'].nunique() if 'journal' in df.columns else None,
-            'field_completeness': {}
-        }
-        
-        # Calculate field completeness
-        for field in ['population', 'risk_factors', 'symptoms', 'treatments', 'outcomes']:
-            if field in df.columns:
-                non_empty = df[field].notna() & (df[field] != '')
-                stats['field_completeness'][field] = {
-                    'count': non_empty.sum(),
-                    'percentage': (non_empty.sum() / len(df)) * 100
-                }
+        profile.log(self.required_columns)
+    
+    def get_summary_stats(self, df: pd.DataFrame, profile: Optional[DatasetProfile] = None) -> Dict[str, Any]:
+        """Get summary statistics about the dataset.
         
-        return stats
+        Args:
+            df: Loaded data
+            profile: Profile of df, e.g. self.profile after load_data() (default: profile df now)
+        """
+        profile = profile or DatasetProfile.from_frame(df)
+        return {
+            'total_records': profile.total_records,
+            'year_range': profile.year_range,
+            'unique_journals': profile.unique_journals if 'journal' in df.columns else None,
+            'field_completeness': profile.completeness(self.TEXT_FIELDS)
+        }
 
 
 def main():
@@ -115,17 +163,17 @@ def main():
     import sys
     
     if len(sys.argv) != 2:
-        print("Usage: python csv_loader.py <input_csv>")
+        print("Usage (from src): python -m loaders.csv_loader <input_csv>")
         sys.exit(1)
     
     input_path = sys.argv[1]
     
     # Load and validate data
     loader = MentalHealthDataLoader()
-    df = loader.load_data(input_path)
+    df = loader.load_data(input_path, columns=loader.SUMMARY_COLUMNS)
     
     # Get summary statistics
-    stats = loader.get_summary_stats(df)
+    stats = loader.get_summary_stats(df, loader.profile)
     
     print("\n" + "="*50)
     print("DATASET SUMMARY")
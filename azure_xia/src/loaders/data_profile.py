@@ -0,0 +1,244 @@
+"""
+Dataset Profile Module
+Null, empty, distinct, year and journal statistics of a dataset, computed in one pass and saved for reuse.
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import numpy as np
+import logging
+
+from analysis.hyperloglog import StudySketches, hash_values, precision_for_error
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bump when the saved profile layout changes
+PROFILE_VERSION = '1'
+
+# File name of a profile saved next to the analysis tables
+PROFILE_FILE = 'dataset_profile.json'
+
+
+@dataclass
+class DatasetProfile:
+    """Per-column quality statistics of a dataset.
+    
+    Attributes:
+        total_records: Number of rows
+        columns: One row per column with nulls, empty (blank strings), missing
+            (nulls + empty) and distinct (non-missing values) counts
+        year_histogram: Records per publication year, by year
+        journal_counts: Records per journal, most frequent first
+        distinct_error: Relative standard error of the distinct counts, None if exact
+    """
+    total_records: int
+    columns: pd.DataFrame
+    year_histogram: pd.Series
+    journal_counts: pd.Series
+    distinct_error: Optional[float] = None
+    
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, approximate: Optional[float] = None) -> 'DatasetProfile':
+        """Profile a frame, every statistic as one vectorized operation over all columns.
+        
+        Args:
+            df: Data to profile
+            approximate: Estimate distinct counts with HyperLogLog sketches of this
+                relative standard error, e.g. 0.01 (default: exact counts)
+        """
+        nulls = df.isna().sum()
+        text_columns = [column for column in df.columns if not pd.api.types.is_numeric_dtype(df[column].dtype)]
+        empty = df[text_columns].eq('').sum().reindex(df.columns, fill_value=0)
+        
+        distinct_error = None
+        if approximate is None:
+            # Blank strings are not counted as a value
+            distinct = df.nunique() - (empty > 0)
+        else:
+            distinct, distinct_error = cls._approximate_distinct(df, precision_for_error(approximate))
+        
+        columns = pd.DataFrame({'nulls': nulls, 'empty': empty, 'missing': nulls + empty, 'distinct': distinct})
+        columns = columns.astype(np.int64)
+        columns.index.name = 'column'
+        
+        year_histogram = pd.Series(dtype=np.int64)
+        if 'year' in df.columns:
+            years = pd.to_numeric(df['year'], errors='coerce').dropna()
+            year_histogram = years.astype(np.int64).value_counts().sort_index()
+        
+        journal_counts = pd.Series(dtype=np.int64)
+        if 'journal' in df.columns:
+            journals = df['journal'].astype(object)
+            journal_counts = journals[journals.ne('') & journals.notna()].value_counts()
+        
+        return cls(len(df), columns, year_histogram.rename('records'), journal_counts.rename('records'), distinct_error)
+    
+    @staticmethod
+    def _approximate_distinct(df: pd.DataFrame, precision: int) -> Tuple[pd.Series, float]:
+        """Distinct non-missing values per column from one sketch per column."""
+        values = df.astype(object).where(df.notna() & df.astype(object).ne(''))
+        stacked = values.melt(var_name='column', value_name='value').dropna(subset=['value'])
+        sketches = StudySketches.from_values(stacked[['column']], stacked['value'].to_numpy(), precision)
+        distinct = sketches.estimate().set_index('column')['studies'].reindex(df.columns, fill_value=0)
+        return distinct, sketches.standard_error()
+    
+    @property
+    def year_range(self) -> Optional[Tuple[int, int]]:
+        """First and last publication year, None without years."""
+        if self.year_histogram.empty:
+            return None
+        return int(self.year_histogram.index.min()), int(self.year_histogram.index.max())
+    
+    @property
+    def unique_journals(self) -> int:
+        """Number of distinct journals."""
+        return len(self.journal_counts)
+    
+    def missing_percentage(self, column: str) -> float:
+        """Share of records without a value in a column (null or blank), in percent."""
+        return (self.columns.loc[column, 'missing'] / self.total_records) * 100 if self.total_records else 0.0
+    
+    def completeness(self, fields: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Records with a value and their percentage, for the fields present in the profile."""
+        completeness = {}
+        for field in fields:
+            if field in self.columns.index:
+                count = self.total_records - int(self.columns.loc[field, 'missing'])
+                completeness[field] = {
+                    'count': count,
+                    'percentage': (count / self.total_records) * 100 if self.total_records else 0.0
+                }
+        return completeness
+    
+    def log(self, columns: Optional[List[str]] = None):
+        """Log the missing share of some columns (default: all)."""
+        logger.info("Data Quality Summary:")
+        for column in columns if columns is not None else list(self.columns.index):
+            if column in self.columns.index:
+                logger.info(f"  {column}: {self.missing_percentage(column):.1f}% missing")
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain JSON-serializable form."""
+        return {
+            'version': PROFILE_VERSION,
+            'total_records': int(self.total_records),
+            'year_range': list(self.year_range) if self.year_range else None,
+            'unique_journals': self.unique_journals,
+            'distinct_error': self.distinct_error,
+            'columns': {column: {name: int(value) for name, value in row.items()}
+                        for column, row in self.columns.to_dict(orient='index').items()},
+            'year_histogram': {str(year): int(count) for year, count in self.year_histogram.items()},
+            'journal_counts': {str(journal): int(count) for journal, count in self.journal_counts.items()}
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DatasetProfile':
+        """Rebuild a profile from to_dict() output."""
+        if data.get('version') != PROFILE_VERSION:
+            raise ValueError(f"Dataset profile has version {data.get('version')}, expected {PROFILE_VERSION}")
+        columns = pd.DataFrame.from_dict(data['columns'], orient='index',
+                                         columns=['nulls', 'empty', 'missing', 'distinct']).astype(np.int64)
+        columns.index.name = 'column'
+        year_histogram = pd.Series({int(year): count for year, count in data['year_histogram'].items()},
+                                   dtype=np.int64, name='records')
+        journal_counts = pd.Series(data['journal_counts'], dtype=np.int64, name='records')
+        return cls(data['total_records'], columns, year_histogram, journal_counts, data.get('distinct_error'))
+    
+    def save(self, path: str):
+        """Write the profile as JSON."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        logger.info(f"Saved dataset profile ({self.total_records} records) to {path}")
+    
+    @classmethod
+    def load(cls, path: str) -> 'DatasetProfile':
+        """Read a profile written by save()."""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+    
+    @classmethod
+    def find(cls, tables_dir: str) -> Optional['DatasetProfile']:
+        """Profile saved next to the analysis tables, None if there is none."""
+        path = os.path.join(tables_dir, PROFILE_FILE)
+        return cls.load(path) if os.path.exists(path) else None
+    
+    @staticmethod
+    def discard(tables_dir: str) -> bool:
+        """Remove the profile saved next to the analysis tables; returns whether there was one."""
+        path = os.path.join(tables_dir, PROFILE_FILE)
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        return True
+
+
+class ProfileBuilder:
+    """Builds a DatasetProfile chunk by chunk, with the same statistics as from_frame().
+    
+    Distinct values are kept as sorted arrays of 64-bit hashes, so memory grows with
+    the number of distinct values of each column rather than with their text.
+    """
+    
+    def __init__(self):
+        """Initialize an empty profile."""
+        self.total_records = 0
+        self.column_order: List[str] = []
+        self.nulls: Dict[str, int] = {}
+        self.empty: Dict[str, int] = {}
+        self.hashes: Dict[str, np.ndarray] = {}
+        self.year_counts: List[pd.Series] = []
+        self.journal_counts: List[pd.Series] = []
+    
+    def add(self, df: pd.DataFrame):
+        """Add the rows of one chunk."""
+        self.total_records += len(df)
+        for column in df.columns:
+            if column not in self.nulls:
+                self.column_order.append(column)
+                self.nulls[column] = self.empty[column] = 0
+                self.hashes[column] = np.empty(0, dtype=np.uint64)
+            
+            values = df[column]
+            present = values.notna()
+            self.nulls[column] += int((~present).sum())
+            if not pd.api.types.is_numeric_dtype(values.dtype):
+                blank = values.eq('') & present
+                self.empty[column] += int(blank.sum())
+                present &= ~blank
+            self.hashes[column] = np.union1d(self.hashes[column], hash_values(values[present].to_numpy()))
+        
+        if 'year' in df.columns:
+            years = pd.to_numeric(df['year'], errors='coerce').dropna()
+            self.year_counts.append(years.astype(np.int64).value_counts())
+        if 'journal' in df.columns:
+            journals = df['journal'].astype(object)
+            # Unsorted counts keep the order of first appearance for ties
+            self.journal_counts.append(journals[journals.ne('') & journals.notna()].value_counts(sort=False))
+    
+    def build(self) -> DatasetProfile:
+        """Profile of all rows added so far."""
+        columns = pd.DataFrame({
+            'nulls': pd.Series(self.nulls),
+            'empty': pd.Series(self.empty),
+            'distinct': pd.Series({column: len(hashes) for column, hashes in self.hashes.items()})
+        }, index=self.column_order)
+        columns.insert(2, 'missing', columns['nulls'] + columns['empty'])
+        columns = columns.astype(np.int64)
+        columns.index.name = 'column'
+        
+        year_histogram = pd.Series(dtype=np.int64)
+        if self.year_counts:
+            year_histogram = pd.concat(self.year_counts).groupby(level=0).sum().sort_index()
+        
+        journal_counts = pd.Series(dtype=np.int64)
+        if self.journal_counts:
+            journal_counts = pd.concat(self.journal_counts).groupby(level=0, sort=False).sum()
+            journal_counts = journal_counts.sort_values(ascending=False, kind='stable')
+        
+        return DatasetProfile(self.total_records, columns, year_histogram.rename('records'),
+                              journal_counts.rename('records'))
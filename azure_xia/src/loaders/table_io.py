@@ -0,0 +1,196 @@
+"""
+Table IO Module
+Reads and writes pipeline tables as CSV, Parquet or Feather, with column projection.
+"""
+
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import pandas as pd
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Supported formats and their file extensions; Parquet and Feather need pyarrow
+TABLE_FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
+# Records the format the tables of a directory were last written in
+TABLES_MANIFEST = 'tables.json'
+
+
+def _require_pyarrow(table_format: str):
+    """Fail with an actionable message if the columnar formats are unavailable."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError(f"The {table_format} format needs pyarrow; run: pip install pyarrow") from e
+
+
+def infer_format(path: str, default: str = 'csv') -> str:
+    """Format of a table file from its extension."""
+    extension = os.path.splitext(path)[1].lower()
+    for name, format_extension in TABLE_FORMATS.items():
+        if extension == format_extension:
+            return name
+    return default
+
+
+def with_format(path: str, table_format: str) -> str:
+    """Path with its extension replaced by the one of the given format."""
+    return os.path.splitext(path)[0] + TABLE_FORMATS[table_format]
+
+
+def _columns_in_file(path: str, table_format: str) -> List[str]:
+    """Column names stored in a table file, read from its header or schema only."""
+    if table_format == 'csv':
+        return list(pd.read_csv(path, nrows=0).columns)
+    
+    _require_pyarrow(table_format)
+    if table_format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    import pyarrow.ipc as ipc
+    with ipc.open_file(path) as reader:
+        return reader.schema.names
+
+
+def read_table(path: str, columns: Optional[List[str]] = None, table_format: Optional[str] = None) -> pd.DataFrame:
+    """Read a table, optionally only some of its columns.
+    
+    Args:
+        path: Table file
+        columns: Columns to read; requested columns the file lacks are skipped
+        table_format: 'csv', 'parquet' or 'feather' (default: from the extension)
+    
+    Parquet and Feather keep the dtypes they were written with, including categoricals.
+    """
+    table_format = table_format or infer_format(path)
+    if columns is not None:
+        available = set(_columns_in_file(path, table_format))
+        columns = [column for column in columns if column in available]
+    
+    if table_format == 'csv':
+        return pd.read_csv(path, usecols=columns)
+    
+    _require_pyarrow(table_format)
+    if table_format == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_feather(path, columns=columns)
+
+
+def write_table(df: pd.DataFrame, path: str, table_format: Optional[str] = None):
+    """Write a table without its index.
+    
+    Args:
+        df: Table to write
+        path: Output file
+        table_format: 'csv', 'parquet' or 'feather' (default: from the extension)
+    """
+    table_format = table_format or infer_format(path)
+    if table_format == 'csv':
+        df.to_csv(path, index=False)
+        return
+    
+    _require_pyarrow(table_format)
+    if table_format == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.reset_index(drop=True).to_feather(path)
+
+
+def write_tables_manifest(directory: str, table_format: str):
+    """Record the format the tables of a directory were written in, for find_table()."""
+    with open(os.path.join(directory, TABLES_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump({'format': table_format}, f, indent=2)
+
+
+def find_table(directory: str, stem: str, table_format: Optional[str] = None) -> str:
+    """Path of the table file <stem>.<extension> in a directory.
+    
+    Without a format, the one recorded by write_tables_manifest() is used. Directories
+    without a manifest use the only existing file (CSV if none exists) and fail if the
+    table exists in several formats, rather than guess which one is current.
+    """
+    if table_format is None:
+        manifest_path = os.path.join(directory, TABLES_MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                table_format = json.load(f)['format']
+    if table_format is not None:
+        return os.path.join(directory, stem + TABLE_FORMATS[table_format])
+    
+    existing = [candidate for candidate, extension in TABLE_FORMATS.items()
+                if os.path.exists(os.path.join(directory, stem + extension))]
+    if len(existing) > 1:
+        raise ValueError(f"{stem} exists as {', '.join(existing)} in {directory}; pass the format to read")
+    return os.path.join(directory, stem + TABLE_FORMATS[existing[0] if existing else 'csv'])
+
+
+def result_table_path(tables_dir: str, name: str, table_format: Optional[str] = None) -> str:
+    """Path of an analysis result table such as risk_factors_by_stratum.csv (see find_table())."""
+    return find_table(tables_dir, f"{name}_by_stratum", table_format)
+
+
+def read_result_table(tables_dir: str, name: str, columns: Optional[List[str]] = None,
+                      table_format: Optional[str] = None) -> pd.DataFrame:
+    """Read an analysis result table in the format it was written in (see find_table())."""
+    return read_table(result_table_path(tables_dir, name, table_format), columns)
+
+
+class BackgroundWriter:
+    """Persists tables on a background thread so writing overlaps with the next stage.
+    
+    Writes run one at a time in submission order. Tables handed over must not be
+    modified afterwards; pipeline stages only derive new frames, so this holds for
+    the pipeline runner. close() (or leaving the with block) waits for all writes
+    and re-raises the first failure.
+    """
+    
+    def __init__(self, asynchronous: bool = True):
+        """Initialize the writer.
+        
+        Args:
+            asynchronous: Write on a background thread; False writes immediately
+        """
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='table-writer') if asynchronous else None
+        self.pending: List[Future] = []
+    
+    def submit(self, write: Callable, *args) -> Future:
+        """Run a write function, in the background if asynchronous."""
+        if self.executor is not None:
+            future = self.executor.submit(write, *args)
+        else:
+            future = Future()
+            future.set_result(write(*args))
+        self.pending.append(future)
+        return future
+    
+    def write_table(self, df: pd.DataFrame, path: str, table_format: Optional[str] = None) -> Future:
+        """Write a table (see write_table())."""
+        return self.submit(self._write_logged, df, path, table_format)
+    
+    @staticmethod
+    def _write_logged(df: pd.DataFrame, path: str, table_format: Optional[str]):
+        """Write a table and log it."""
+        write_table(df, path, table_format)
+        logger.info(f"Wrote {len(df)} rows to {path}")
+    
+    def close(self):
+        """Wait for all writes to finish, raising the first error."""
+        try:
+            for future in self.pending:
+                future.result()
+        finally:
+            self.pending = []
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+    
+    def __enter__(self) -> 'BackgroundWriter':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
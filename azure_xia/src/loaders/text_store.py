@@ -0,0 +1,237 @@
+"""
+Text Store Module
+Memory-mapped, offset-indexed store of the long text fields, keyed by PMID.
+"""
+
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+import numpy as np
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bump when the store layout changes
+STORE_VERSION = '1'
+
+# Fields moved out of the tables by default; the pipeline only carries their PMID
+TEXT_STORE_FIELDS = ['abstract', 'gpt_output', 'chain_of_thought']
+
+TEXTS_FILE = 'texts.bin'
+INDEX_FILE = 'text_index.npz'
+MANIFEST_FILE = 'text_store.json'
+
+
+def _keys(pmids: Iterable) -> np.ndarray:
+    """PMIDs as strings, so 12345, 12345.0 and '12345' find the same record."""
+    pmids = pd.Series(pmids)
+    if pd.api.types.is_float_dtype(pmids.dtype):
+        pmids = pmids.astype('Int64')
+    elif pmids.dtype == object:
+        # Mixed inputs keep their floats; each integral one is keyed like the integer
+        pmids = pmids.map(lambda pmid: int(pmid) if isinstance(pmid, float) and pmid.is_integer() else pmid)
+    return pmids.astype(str).to_numpy(dtype=object)
+
+
+class TextStoreWriter:
+    """Appends records to a text store, chunk by chunk.
+    
+    Texts are written to one UTF-8 file as they arrive; the offsets and the manifest
+    are written by close() (or on leaving the with block). Only the first record of
+    a PMID is stored.
+    """
+    
+    def __init__(self, store_dir: str, fields: Optional[List[str]] = None):
+        """Initialize the writer, replacing any store in the directory.
+        
+        Args:
+            store_dir: Directory of the store
+            fields: Text fields to store (default: TEXT_STORE_FIELDS)
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.fields = list(fields or TEXT_STORE_FIELDS)
+        self.texts = open(os.path.join(store_dir, TEXTS_FILE), 'wb')
+        self.position = 0
+        self.keys: List[np.ndarray] = []
+        self.starts: List[np.ndarray] = []
+        self.lengths: List[np.ndarray] = []
+        self.seen = set()
+        self.duplicates = 0
+    
+    def append(self, df: pd.DataFrame):
+        """Store the text fields of a frame with a pmid column; absent fields are stored as missing."""
+        keys = _keys(df['pmid'])
+        new = np.array([key not in self.seen for key in keys], dtype=bool)
+        # Repeats within the chunk count as duplicates too
+        new &= ~pd.Series(keys).duplicated().to_numpy()
+        self.duplicates += int((~new).sum())
+        self.seen.update(keys[new])
+        
+        starts = np.full((new.sum(), len(self.fields)), -1, dtype=np.int64)
+        lengths = np.full((new.sum(), len(self.fields)), -1, dtype=np.int64)
+        for column, field in enumerate(self.fields):
+            if field not in df.columns:
+                continue
+            values = df[field].to_numpy(dtype=object)[new]
+            present = pd.notna(values)
+            encoded = [str(value).encode('utf-8') for value in values[present]]
+            sizes = np.fromiter((len(text) for text in encoded), dtype=np.int64, count=len(encoded))
+            starts[present, column] = self.position + np.cumsum(sizes) - sizes
+            lengths[present, column] = sizes
+            self.texts.write(b''.join(encoded))
+            self.position += int(sizes.sum())
+        
+        self.keys.append(keys[new])
+        self.starts.append(starts)
+        self.lengths.append(lengths)
+    
+    def detach(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Store the text fields of a frame and return the frame without them."""
+        self.append(df)
+        return df.drop(columns=[field for field in self.fields if field in df.columns])
+    
+    def close(self):
+        """Write the offsets and manifest."""
+        if self.texts.closed:
+            return
+        self.texts.close()
+        
+        width = len(self.fields)
+        np.savez(
+            os.path.join(self.store_dir, INDEX_FILE),
+            pmids=np.concatenate(self.keys or [np.empty(0, dtype=object)]).astype(str),
+            starts=np.concatenate(self.starts or [np.empty((0, width), dtype=np.int64)]),
+            lengths=np.concatenate(self.lengths or [np.empty((0, width), dtype=np.int64)])
+        )
+        
+        records = len(self.seen)
+        manifest = {'version': STORE_VERSION, 'fields': self.fields, 'records': records, 'bytes': self.position}
+        with open(os.path.join(self.store_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        
+        if self.duplicates:
+            logger.warning(f"Skipped {self.duplicates} records with an already stored PMID")
+        logger.info(f"Saved text store ({records} records, {self.position} bytes) to {self.store_dir}")
+    
+    def __enter__(self) -> 'TextStoreWriter':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TextStore:
+    """Read-only, memory-mapped view of a text store.
+    
+    Opening a store only reads its offsets; texts are sliced out of the mapped file
+    when they are fetched, so reads are proportional to the texts actually used.
+    """
+    
+    def __init__(self, store_dir: str):
+        """Open a store written by TextStoreWriter.
+        
+        Args:
+            store_dir: Directory of the store
+        """
+        with open(os.path.join(store_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != STORE_VERSION:
+            raise ValueError(f"Text store in {store_dir} has version {manifest.get('version')}, "
+                             f"expected {STORE_VERSION}; rebuild it")
+        
+        self.store_dir = store_dir
+        self.fields = manifest['fields']
+        with np.load(os.path.join(store_dir, INDEX_FILE)) as index:
+            self.pmids = pd.Index(index['pmids'].astype(object))
+            self.starts = index['starts']
+            self.lengths = index['lengths']
+        
+        # An empty file cannot be mapped
+        texts_path = os.path.join(store_dir, TEXTS_FILE)
+        if os.path.getsize(texts_path) > 0:
+            self.data = np.memmap(texts_path, dtype=np.uint8, mode='r')
+        else:
+            self.data = np.empty(0, dtype=np.uint8)
+    
+    @classmethod
+    def write_frame(cls, df: pd.DataFrame, store_dir: str, fields: Optional[List[str]] = None) -> int:
+        """Build a store from a frame with a pmid column; returns the number of records."""
+        with TextStoreWriter(store_dir, fields) as writer:
+            writer.append(df)
+        return len(writer.seen)
+    
+    @classmethod
+    def write_csv(cls, csv_path: str, store_dir: str, fields: Optional[List[str]] = None,
+                  chunksize: int = 10000) -> int:
+        """Build a store from the pmid and text columns of a CSV, chunk by chunk."""
+        available = list(pd.read_csv(csv_path, nrows=0).columns)
+        fields = [field for field in (fields or TEXT_STORE_FIELDS) if field in available]
+        with TextStoreWriter(store_dir, fields) as writer:
+            for chunk in pd.read_csv(csv_path, usecols=['pmid'] + fields, dtype={field: str for field in fields},
+                                     chunksize=chunksize):
+                writer.append(chunk)
+        return len(writer.seen)
+    
+    def __len__(self) -> int:
+        return len(self.pmids)
+    
+    def __contains__(self, pmid) -> bool:
+        return _keys([pmid])[0] in self.pmids
+    
+    def _field(self, field: str) -> int:
+        """Column of a field in the offset arrays."""
+        if field not in self.fields:
+            raise ValueError(f"Unknown text field '{field}'; stored: {self.fields}")
+        return self.fields.index(field)
+    
+    def get_bytes(self, pmid, field: str) -> Optional[memoryview]:
+        """UTF-8 bytes of one text as a zero-copy view of the mapped file, None if missing."""
+        column = self._field(field)
+        row = self.pmids.get_indexer(_keys([pmid]))[0]
+        if row < 0:
+            raise KeyError(f"PMID {pmid} is not in the text store")
+        start, length = self.starts[row, column], self.lengths[row, column]
+        if length < 0:
+            return None
+        return memoryview(self.data[start:start + length])
+    
+    def get(self, pmid, field: str) -> Optional[str]:
+        """One text, None if it is missing."""
+        text = self.get_bytes(pmid, field)
+        return str(text, 'utf-8') if text is not None else None
+    
+    def record(self, pmid) -> Dict[str, Optional[str]]:
+        """All stored texts of one PMID."""
+        return {field: self.get(pmid, field) for field in self.fields}
+    
+    def fetch(self, pmids: Iterable, field: str) -> pd.Series:
+        """Texts of many PMIDs in their order; NaN for unknown PMIDs and missing texts."""
+        column = self._field(field)
+        rows = self.pmids.get_indexer(_keys(pmids))
+        texts = np.full(len(rows), np.nan, dtype=object)
+        for i, row in enumerate(rows):
+            if row >= 0 and self.lengths[row, column] >= 0:
+                start = self.starts[row, column]
+                texts[i] = str(memoryview(self.data[start:start + self.lengths[row, column]]), 'utf-8')
+        return pd.Series(texts, dtype=object)
+    
+    def attach(self, df: pd.DataFrame, fields: Optional[List[str]] = None) -> pd.DataFrame:
+        """Copy of a frame with stored text fields added as columns, looked up by its pmid column."""
+        result = df.copy()
+        for field in fields or self.fields:
+            result[field] = self.fetch(df['pmid'], field).to_numpy()
+        return result
+    
+    def close(self):
+        """Release the mapped file."""
+        self.data = np.empty(0, dtype=np.uint8)
+    
+    def __enter__(self) -> 'TextStore':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
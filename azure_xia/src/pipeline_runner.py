@@ -0,0 +1,164 @@
+"""
+Pipeline Runner Module
+Runs split, normalize, analyze and visualize with DataFrames handed over in memory.
+"""
+
+import os
+import logging
+from typing import Dict, Optional
+
+import pandas as pd
+
+from prepare.gpt_output_splitter import GPTOutputSplitter
+from prepare.extraction_cache import ExtractionCache
+from prepare.normalize_labels import FieldNormalizer
+from analysis.aggregates import StratumAggregator
+from loaders.table_io import BackgroundWriter, read_table, with_format
+from loaders.text_store import TEXT_STORE_FIELDS, TextStore
+from loaders.data_profile import PROFILE_FILE, DatasetProfile
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How the processed and normalized tables are persisted
+INTERMEDIATE_MODES = ['async', 'sync', 'none']
+
+
+class PipelineRunner:
+    """Chains the pipeline stages without re-reading each stage's output from disk.
+    
+    Each stage receives the previous stage's DataFrame. Intermediate tables are
+    written by a BackgroundWriter while the next stage computes (or synchronously,
+    or not at all); the analysis tables and item matrices are always written, and
+    the plots are drawn from the in-memory results.
+    """
+    
+    def __init__(self, tables_dir: str = "outputs/tables", plots_dir: str = "outputs/plots",
+                 table_format: str = 'csv', intermediates: str = 'async', workers: int = 1,
+                 cache_path: Optional[str] = None, clear_cache: bool = False,
+                 memo_size: int = 10000, memo_path: Optional[str] = None, min_stratum_size: int = 3,
+                 text_store_dir: Optional[str] = None):
+        """Initialize the runner.
+        
+        Args:
+            tables_dir: Directory for the intermediate and analysis tables
+            plots_dir: Directory for the plots
+            table_format: 'csv', 'parquet' or 'feather'
+            intermediates: 'async' to write the processed and normalized tables in the
+                background, 'sync' to write them before the next stage, 'none' to skip them
+            workers: Worker processes for field extraction
+            cache_path: SQLite file caching extracted fields between runs (optional)
+            clear_cache: Empty the extraction cache before splitting
+            memo_size: Maximum memoized normalization results, 0 to disable
+            memo_path: JSON file persisting memoized normalization results (optional)
+            min_stratum_size: Minimum number of studies for a stratum to be analyzed
+            text_store_dir: Directory to move the abstract, GPT output and reasoning text
+                into after splitting, so later stages only carry the pmid (optional)
+        """
+        if intermediates not in INTERMEDIATE_MODES:
+            raise ValueError(f"Unknown intermediates mode '{intermediates}', expected one of {INTERMEDIATE_MODES}")
+        self.tables_dir = tables_dir
+        self.plots_dir = plots_dir
+        self.table_format = table_format
+        self.intermediates = intermediates
+        self.workers = workers
+        self.cache_path = cache_path
+        self.clear_cache = clear_cache
+        self.memo_size = memo_size
+        self.memo_path = memo_path
+        self.min_stratum_size = min_stratum_size
+        self.text_store_dir = text_store_dir
+    
+    def table_path(self, name: str) -> str:
+        """Path of an intermediate table such as processed_data.csv."""
+        return with_format(os.path.join(self.tables_dir, f"{name}.csv"), self.table_format)
+    
+    def run(self, input_path: str) -> Dict[str, pd.DataFrame]:
+        """Run all stages on a CSV (or Parquet/Feather) file with a gpt_output column.
+        
+        Returns:
+            The analysis tables by name
+        """
+        os.makedirs(self.tables_dir, exist_ok=True)
+        os.makedirs(self.plots_dir, exist_ok=True)
+        
+        # Leaving the block waits for the last writes to finish
+        with BackgroundWriter(asynchronous=self.intermediates == 'async') as writer:
+            print("Step 1: Splitting GPT output fields...")
+            processed_df = self.split(read_table(input_path))
+            # Profiled once here; the summary and assignment reports read it back
+            profile = DatasetProfile.from_frame(processed_df)
+            writer.submit(profile.save, os.path.join(self.tables_dir, PROFILE_FILE))
+            if self.text_store_dir:
+                texts = [column for column in TEXT_STORE_FIELDS if column in processed_df.columns]
+                writer.submit(TextStore.write_frame, processed_df[['pmid'] + texts], self.text_store_dir, texts)
+                processed_df = processed_df.drop(columns=texts)
+            self._write_intermediate(writer, processed_df, 'processed_data')
+            
+            print("\nStep 2: Normalizing fields...")
+            normalized_df = self.normalize(processed_df)
+            self._write_intermediate(writer, normalized_df, 'normalized_data')
+            
+            print("\nStep 3: Performing stratum analysis...")
+            aggregator = StratumAggregator(min_stratum_size=self.min_stratum_size)
+            results = aggregator.analyze_by_strata(normalized_df)
+            writer.submit(aggregator.save_analysis_results, results, self.tables_dir,
+                          aggregator.item_matrices, self.table_format)
+            for name, df_result in results.items():
+                print(f"  {name}: {len(df_result)} rows")
+            
+            print("\nStep 4: Creating visualizations...")
+            self.visualize(results, aggregator.item_matrices, normalized_df)
+        
+        return results
+    
+    def _write_intermediate(self, writer: BackgroundWriter, df: pd.DataFrame, name: str):
+        """Persist an intermediate table unless intermediates are disabled."""
+        if self.intermediates != 'none':
+            writer.write_table(df, self.table_path(name), self.table_format)
+    
+    def split(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Extract the structured fields from the gpt_output column."""
+        splitter = GPTOutputSplitter()
+        
+        cache = None
+        if self.cache_path:
+            cache = ExtractionCache(self.cache_path)
+            # Entries from other pattern versions can never hit again
+            cache.invalidate(keep_version=None if self.clear_cache else splitter.pattern_version)
+        
+        try:
+            return splitter.process_dataframe(df, workers=self.workers, cache=cache)
+        finally:
+            if cache is not None:
+                cache.close()
+    
+    def normalize(self, processed_df: pd.DataFrame) -> pd.DataFrame:
+        """Normalize the extracted fields into the long-format table."""
+        normalizer = FieldNormalizer(memo_size=self.memo_size, memo_path=self.memo_path)
+        normalized_df = normalizer.explode_to_long_format(processed_df)
+        normalizer.memo.log_stats()
+        normalizer.memo.save()
+        print(f"  Original rows: {len(processed_df)}")
+        print(f"  Normalized rows: {len(normalized_df)}")
+        return normalized_df
+    
+    def visualize(self, results: Dict[str, pd.DataFrame], item_matrices: Dict, normalized_df: pd.DataFrame):
+        """Draw the plots from the in-memory analysis results."""
+        try:
+            from viz.basic_plots import BasicPlotter
+        except ImportError as e:
+            print(f"⚠️  Visualization libraries not available: {e}")
+            print("Run: pip install matplotlib seaborn plotly")
+            return
+        
+        # The plotters take the sparse item matrices in place of their long tables
+        analysis_results = {name: results[name] for name in ['stratum_summary', 'treatment_outcomes']
+                            if name in results and not results[name].empty}
+        for name, matrix in item_matrices.items():
+            if matrix.nnz > 0:
+                analysis_results[name] = matrix
+        
+        plotter = BasicPlotter(self.plots_dir)
+        plotter.create_all_visualizations(analysis_results, normalized_df)
+        print(f"✓ Visualizations created in {self.plots_dir}")
@@ -0,0 +1,99 @@
+"""
+Extraction Cache Module
+On-disk cache of fields extracted from gpt_output, so reruns only split new or changed rows.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ExtractionCache:
+    """SQLite-backed cache of extracted fields keyed by (pmid, gpt_output, pattern version)."""
+    
+    # Keys per SELECT ... IN (...) query, below SQLite's host parameter limit
+    LOOKUP_BATCH_SIZE = 500
+    
+    def __init__(self, cache_path: str):
+        """Open (or create) the cache database.
+        
+        Args:
+            cache_path: Path to the SQLite file holding cached extractions
+        """
+        self.cache_path = cache_path
+        self.hits = 0
+        self.misses = 0
+        
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS extractions ('
+            'key TEXT PRIMARY KEY, pattern_version TEXT NOT NULL, fields TEXT NOT NULL)'
+        )
+        self.connection.commit()
+    
+    @staticmethod
+    def make_key(pmid, gpt_output: str, pattern_version: str) -> str:
+        """Hash the inputs that determine an extraction result."""
+        content = '\0'.join([str(pmid), pattern_version, gpt_output])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+    
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, str]]:
+        """Return cached fields for the given keys, updating the hit/miss counters."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for start in range(0, len(unique_keys), self.LOOKUP_BATCH_SIZE):
+            batch = unique_keys[start:start + self.LOOKUP_BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.connection.execute(
+                f'SELECT key, fields FROM extractions WHERE key IN ({placeholders})', batch
+            )
+            for key, fields in rows:
+                found[key] = json.loads(fields)
+        
+        hits = sum(1 for key in keys if key in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+    
+    def put_many(self, entries: Dict[str, Dict[str, str]], pattern_version: str):
+        """Store extracted fields for the given keys."""
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO extractions (key, pattern_version, fields) VALUES (?, ?, ?)',
+            [(key, pattern_version, json.dumps(fields)) for key, fields in entries.items()]
+        )
+        self.connection.commit()
+    
+    def invalidate(self, keep_version: Optional[str] = None) -> int:
+        """Delete cached entries, keeping only those for keep_version if given.
+        
+        Returns the number of entries removed.
+        """
+        if keep_version is None:
+            cursor = self.connection.execute('DELETE FROM extractions')
+        else:
+            cursor = self.connection.execute(
+                'DELETE FROM extractions WHERE pattern_version != ?', (keep_version,)
+            )
+        self.connection.commit()
+        logger.info(f"Removed {cursor.rowcount} entries from extraction cache {self.cache_path}")
+        return cursor.rowcount
+    
+    def log_stats(self):
+        """Log the hit/miss counters."""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        logger.info(f"Extraction cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate)")
+    
+    def close(self):
+        """Close the underlying database connection."""
+        self.connection.close()
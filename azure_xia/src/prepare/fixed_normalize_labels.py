@@ -5,19 +5,46 @@ Creates hierarchical, non-overlapping population strata.
 
 import pandas as pd
 import numpy as np
+from dataclasses import asdict, dataclass
 from typing import Dict, List, Set
+import hashlib
+import itertools
+import json
 import re
 import logging
 
+from prepare.keyword_index import KeywordIndex
+from prepare.normalization_memo import NormalizationMemo
+from prepare.long_format import apply_categories
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bump when normalization logic changes so persisted memos are discarded
+FIXED_NORMALIZER_VERSION = '1'
+
+
+@dataclass(frozen=True)
+class PopulationDimensions:
+    """Single best match for each population dimension."""
+    age_group: str = 'unspecified'
+    sex: str = 'unspecified'
+    clinical_cohort: str = 'unspecified'
+    setting: str = 'unspecified'
+
 
 class FixedFieldNormalizer:
     """Creates mutually exclusive population categories."""
     
-    def __init__(self):
-        """Initialize with hierarchical mapping."""
+    def __init__(self, keyword_boundaries: str = 'start', memo_size: int = 10000, memo_path: str = None):
+        """Initialize with hierarchical mapping.
+        
+        Args:
+            keyword_boundaries: KeywordIndex boundary mode for keyword matching
+            memo_size: Maximum number of memoized normalization results (0 disables)
+            memo_path: JSON file persisting memoized results between runs (optional)
+        """
+        self.keyword_boundaries = keyword_boundaries
         
         # Age groups (mutually exclusive)
         self.age_group_mapping = {
@@ -51,6 +78,80 @@ class FixedFieldNormalizer:
             'school': ['school', 'educational', 'classroom', 'university', 'college'],
             'community': ['community', 'home-based', 'neighborhood', 'public health']
         }
+        
+        # All population dimensions in one index, keyed by (dimension, category)
+        self.population_mapping = {
+            (dimension, category): keywords
+            for dimension, mapping in [('age_group', self.age_group_mapping), ('sex', self.sex_mapping),
+                                       ('clinical_cohort', self.clinical_cohort_mapping),
+                                       ('setting', self.setting_mapping)]
+            for category, keywords in mapping.items()
+        }
+        
+        # Indexes of this normalizer's own mappings, keyed by mapping id
+        self._indexes = {
+            id(mapping): (mapping, KeywordIndex(mapping, keyword_boundaries))
+            for mapping in [self.age_group_mapping, self.sex_mapping, self.clinical_cohort_mapping,
+                            self.setting_mapping, self.population_mapping]
+        }
+        
+        self.memo = NormalizationMemo(memo_size, memo_path, self.rules_version)
+    
+    @property
+    def rules_version(self) -> str:
+        """Fingerprint of the mappings and matching mode, used to validate persisted memos."""
+        rules = [
+            FIXED_NORMALIZER_VERSION, type(self).__name__, self.keyword_boundaries,
+            self.age_group_mapping, self.sex_mapping, self.clinical_cohort_mapping, self.setting_mapping
+        ]
+        return hashlib.sha256(json.dumps(rules).encode('utf-8')).hexdigest()[:16]
+    
+    @property
+    def category_sets(self) -> Dict[str, List[str]]:
+        """Fixed categories of the categorical long-format columns."""
+        dimensions = {
+            'age_group': list(self.age_group_mapping) + ['unspecified'],
+            'sex': list(self.sex_mapping) + ['unspecified'],
+            'clinical_cohort': list(self.clinical_cohort_mapping) + ['unspecified'],
+            'setting': list(self.setting_mapping) + ['unspecified']
+        }
+        strata = dict.fromkeys(
+            self.stratum_from_dimensions(PopulationDimensions(*parts))
+            for parts in itertools.product(*dimensions.values())
+        )
+        return {
+            'stratum_id': list(strata),
+            **dimensions,
+            'treatment_category': ['CBT', 'ACT', 'DBT', 'mindfulness', 'psychotherapy',
+                                   'medication', 'exercise', 'other', 'unspecified'],
+            'outcome_direction': ['improvement', 'symptom_reduction', 'no_change', 'mixed_results', 'unspecified']
+        }
+    
+    def normalize_population(self, text: str) -> Dict[str, str]:
+        """Extract the single best age group, sex, clinical cohort and setting."""
+        if pd.isna(text) or str(text).strip() == '':
+            return {'age_group': 'unspecified', 'sex': 'unspecified',
+                    'clinical_cohort': 'unspecified', 'setting': 'unspecified'}
+        
+        text_lower = str(text).lower().strip()
+        return self.memo.lookup('population', text_lower, lambda: self._normalize_population(text_lower))
+    
+    def _normalize_population(self, text_lower: str) -> Dict[str, str]:
+        """Pick the longest-keyword match per dimension from a single scan (uncached)."""
+        index = self._keyword_index(self.population_mapping)
+        found = index.scan(text_lower)
+        
+        # Same choice as extract_single_match: longest keyword, ties to the earlier category
+        best = {}
+        for dimension, category in index.categories:
+            length = found.get((dimension, category), 0)
+            if length > best.get(dimension, (0, None))[0]:
+                best[dimension] = (length, category)
+        
+        return {
+            dimension: best[dimension][1] if dimension in best else 'unspecified'
+            for dimension in ['age_group', 'sex', 'clinical_cohort', 'setting']
+        }
     
     def extract_single_match(self, text: str, category_mapping: Dict[str, List[str]]) -> str:
         """Extract single best match from category mapping."""
@@ -59,28 +160,53 @@ class FixedFieldNormalizer:
         
         text_lower = str(text).lower()
         
-        # Find all matches
-        matches = []
-        for category, keywords in category_mapping.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    matches.append((category, len(keyword)))  # Prefer longer matches
-        
-        if matches:
-            # Return the match with longest keyword (most specific)
-            return max(matches, key=lambda x: x[1])[0]
-        
-        return 'unspecified'
+        # Return the match with longest keyword (most specific)
+        index = self._keyword_index(category_mapping)
+        return index.longest_match(text_lower, 'unspecified')
+    
+    def _keyword_index(self, mapping: Dict) -> KeywordIndex:
+        """Prebuilt index of one of this normalizer's mappings; other mappings get a new index."""
+        entry = self._indexes.get(id(mapping))
+        if entry is not None and entry[0] is mapping:
+            return entry[1]
+        return KeywordIndex(mapping, self.keyword_boundaries)
+    
+    def extract_dimensions(self, text: str) -> PopulationDimensions:
+        """Extract all four population dimensions in one pass."""
+        return PopulationDimensions(**self.normalize_population(text))
     
     def create_mutually_exclusive_stratum(self, row: pd.Series) -> str:
         """Create mutually exclusive stratum identifier."""
+        return self.stratum_from_dimensions(self.extract_dimensions(row.get('population', '')))
+    
+    def resolve_populations(self, populations: pd.Series) -> pd.DataFrame:
+        """Resolve stratum and dimension columns for a population column.
+        
+        Each distinct population text is resolved once and mapped back to its rows.
+        
+        Returns:
+            DataFrame indexed like populations with stratum_id, age_group, sex,
+            clinical_cohort and setting columns
+        """
+        codes, uniques = pd.factorize(populations, use_na_sentinel=False)
+        
+        resolved = []
+        for text in uniques:
+            dimensions = self.extract_dimensions(text)
+            resolved.append({'stratum_id': self.stratum_from_dimensions(dimensions), **asdict(dimensions)})
+        
+        columns = ['stratum_id', 'age_group', 'sex', 'clinical_cohort', 'setting']
+        resolved_df = pd.DataFrame(resolved, columns=columns)
+        return resolved_df.iloc[codes].set_axis(populations.index)
+    
+    def stratum_from_dimensions(self, dimensions: PopulationDimensions) -> str:
+        """Build the mutually exclusive stratum identifier from extracted dimensions."""
         components = []
         
-        # Extract each dimension
-        age = self.extract_single_match(row.get('population', ''), self.age_group_mapping)
-        sex = self.extract_single_match(row.get('population', ''), self.sex_mapping)
-        cohort = self.extract_single_match(row.get('population', ''), self.clinical_cohort_mapping)
-        setting = self.extract_single_match(row.get('population', ''), self.setting_mapping)
+        age = dimensions.age_group
+        sex = dimensions.sex
+        cohort = dimensions.clinical_cohort
+        setting = dimensions.setting
         
         # Build stratum with hierarchy: Age > Sex > Cohort > Setting
         # Only include meaningful (non-unspecified) components
@@ -133,18 +259,13 @@ class FixedFieldNormalizer:
                 logger.warning(f"Missing column {col}, using empty values")
                 df[col] = ''
         
+        # Resolve stratum and dimension columns once per distinct population
+        strata = self.resolve_populations(df['population'])
+        
         long_records = []
         
-        for _, row in df.iterrows():
-            # Create mutually exclusive stratum
-            stratum_id = self.create_mutually_exclusive_stratum(row)
-            
-            # Extract age, sex for separate columns (for analysis)
-            age_group = self.extract_single_match(row.get('population', ''), self.age_group_mapping)
-            sex = self.extract_single_match(row.get('population', ''), self.sex_mapping)
-            clinical_cohort = self.extract_single_match(row.get('population', ''), self.clinical_cohort_mapping)
-            setting = self.extract_single_match(row.get('population', ''), self.setting_mapping)
-            
+        for (_, row), (stratum_id, age_group, sex, clinical_cohort, setting) in zip(
+                df.iterrows(), strata.itertuples(index=False, name=None)):
             # Split treatments if multiple
             treatments = str(row.get('treatments', '')).split(';') if pd.notna(row.get('treatments', '')) else ['']
             outcomes = str(row.get('outcomes', '')).split(';') if pd.notna(row.get('outcomes', '')) else ['']
@@ -170,7 +291,7 @@ class FixedFieldNormalizer:
                     }
                     long_records.append(long_record)
         
-        result_df = pd.DataFrame(long_records)
+        result_df = apply_categories(pd.DataFrame(long_records), self.category_sets)
         logger.info(f"Created {len(result_df)} long-format records with {result_df['stratum_id'].nunique()} mutually exclusive strata")
         
         return result_df
@@ -181,7 +302,10 @@ class FixedFieldNormalizer:
             return 'unspecified'
         
         treatment_lower = str(treatment).lower().strip()
-        
+        return self.memo.lookup('treatment', treatment_lower, lambda: self._clean_treatment(treatment_lower))
+    
+    def _clean_treatment(self, treatment_lower: str) -> str:
+        """Map a lowercased treatment to its category (uncached)."""
         # Standard mappings
         if 'cbt' in treatment_lower or 'cognitive behavioral' in treatment_lower:
             return 'CBT'
@@ -206,7 +330,10 @@ class FixedFieldNormalizer:
             return 'unspecified'
         
         outcome_lower = str(outcome).lower().strip()
-        
+        return self.memo.lookup('outcome', outcome_lower, lambda: self._clean_outcome(outcome_lower))
+    
+    def _clean_outcome(self, outcome_lower: str) -> str:
+        """Map a lowercased outcome to its direction (uncached)."""
         if 'improve' in outcome_lower or 'better' in outcome_lower or 'positive' in outcome_lower:
             return 'improvement'
         elif 'reduce' in outcome_lower or 'decrease' in outcome_lower:
@@ -224,7 +351,7 @@ def main():
     import sys
     
     if len(sys.argv) != 3:
-        print("Usage: python fixed_normalize_labels.py <input_csv> <output_csv>")
+        print("Usage (from src): python -m prepare.fixed_normalize_labels <input_csv> <output_csv>")
         sys.exit(1)
     
     input_file = sys.argv[1]
@@ -237,6 +364,7 @@ def main():
     # Create mutually exclusive normalization
     normalizer = FixedFieldNormalizer()
     normalized_df = normalizer.explode_to_long_format_fixed(df)
+    normalizer.memo.log_stats()
     
     # Save results
     normalized_df.to_csv(output_file, index=False)
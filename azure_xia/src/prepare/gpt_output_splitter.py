@@ -11,18 +11,144 @@ Extracts structured fields from the gpt_output column containing:
 
 import pandas as pd
 import re
-from typing import Dict, Any, List
+import math
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional
 import logging
 
+from loaders.table_io import write_table
+from prepare.long_format import coerce_year
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bump when extraction logic changes in a way the pattern fingerprint does not capture
+SPLITTER_VERSION = '2'
+
+# Heading lines used by the extraction prompt, e.g. "1. **Population Studied:** ...",
+# "   - **Interventions/Treatments**:" or "### Chain-of-Thought Reasoning:"
+HEADING_PATTERN = re.compile(
+    r'^(?P<indent>[ \t]*)(?P<marker>(?:\d+\.|[-*+])\s+)?'
+    r'(?:(?P<hashes>#{1,6})\s*(?P<md_title>.+?)'
+    r'|(?P<emphasis>\*{1,2})(?P<bold_title>[^*\n]+?)(?P=emphasis)(?P<colon>\s*:)?(?P<rest>.*))\s*$'
+)
+
+# Heading keywords per field; the earliest keyword in a heading decides its field
+SECTION_KEYWORDS = re.compile(
+    r'(?P<chain_of_thought>chain[- ]of[- ]thought|reasoning|rationale)'
+    r'|(?P<population>population|participants?|subjects?|cohort|demographic)'
+    r'|(?P<risk_factors>risk factors?|causes?|triggers?|predictors?)'
+    r'|(?P<symptoms>symptoms?|manifestations?|presentations?|clinical features?)'
+    r'|(?P<treatments>treatments?|interventions?|therapies?|management|approaches?)'
+    r'|(?P<outcomes>outcomes?|effects?)',
+    re.IGNORECASE
+)
+
+# Summary headings ("Main Findings", "Conclusion") only stand in for outcomes
+SUMMARY_KEYWORDS = re.compile(r'results?|findings?|conclusions?', re.IGNORECASE)
+
+HORIZONTAL_RULE = re.compile(r'^\s*(?:-{3,}|\*{3,}|_{3,})\s*$')
+
+
+class GPTSectionTokenizer:
+    """Splits a gpt_output into its headed sections in a single pass over the lines."""
+    
+    def tokenize(self, text: str) -> List[Dict[str, Any]]:
+        """Return the sections of the text as dicts with field, indent, title and lines."""
+        sections = []
+        current = None
+        
+        for line in text.splitlines():
+            if HORIZONTAL_RULE.match(line):
+                current = None
+                continue
+            
+            heading = self._parse_heading(line)
+            if heading and self._starts_section(heading, current):
+                current = heading
+                sections.append(current)
+            elif current is not None:
+                current['lines'].append(line)
+        
+        return sections
+    
+    def _parse_heading(self, line: str) -> Optional[Dict[str, Any]]:
+        """Parse a heading line, or return None for ordinary body lines."""
+        if '*' not in line and '#' not in line:
+            return None
+        
+        match = HEADING_PATTERN.match(line)
+        if not match:
+            return None
+        
+        if match.group('hashes'):
+            title = match.group('md_title').strip('*: ')
+            rest = ''
+        else:
+            title = match.group('bold_title')
+            rest = match.group('rest').strip()
+            # "**Title:** text", "*Title*: text" or a bare "**Title**" line
+            if not (title.rstrip().endswith(':') or match.group('colon') or not rest):
+                return None
+            if len(match.group('emphasis')) == 1 and not match.group('marker'):
+                return None
+            title = title.strip(': ')
+        
+        field, generic = None, False
+        field_match = SECTION_KEYWORDS.search(title)
+        if field_match:
+            field = field_match.lastgroup
+        elif SUMMARY_KEYWORDS.search(title):
+            field, generic = 'outcomes', True
+        
+        return {
+            'field': field,
+            'generic': generic,
+            'indent': len(match.group('indent').expandtabs(4)),
+            'level': len(match.group('hashes') or ''),
+            'standalone': not match.group('marker'),
+            'title': title,
+            'lines': [rest] if rest else []
+        }
+    
+    def _starts_section(self, heading: Dict[str, Any], current: Optional[Dict[str, Any]]) -> bool:
+        """Decide whether a heading opens a new section or belongs to the current one."""
+        if current is None:
+            return True
+        
+        # Reasoning sections carry their own numbered or deeper markdown sub-headings
+        if current['field'] == 'chain_of_thought':
+            if current['level']:
+                return 0 < heading['level'] <= current['level']
+            return heading['level'] > 0 or (heading['standalone'] and heading['indent'] == 0)
+        
+        if heading['level']:
+            return True
+        
+        if heading['indent'] <= current['indent']:
+            return True
+        
+        # Nested headings open sections under containers ("**Main Findings:**"),
+        # otherwise they are sub-items in the body of the current field section
+        if current['field'] is None:
+            return True
+        return heading['field'] is not None and not any(line.strip() for line in current['lines'])
+
 
 class GPTOutputSplitter:
     """Splits the gpt_output field into structured components."""
     
-    def __init__(self):
-        """Initialize the splitter with field patterns."""
+    def __init__(self, use_section_tokenizer: bool = True):
+        """Initialize the splitter with field patterns.
+        
+        Args:
+            use_section_tokenizer: Extract fields with the single-pass section tokenizer,
+                falling back to the field patterns for outputs without recognised sections
+        """
+        self.use_section_tokenizer = use_section_tokenizer
+        self.tokenizer = GPTSectionTokenizer()
         self.field_patterns = {
             'population': [
                 r'(?i)(?:population|participants?|subjects?|cohort|demographic).*?(?:focus|in focus|studied|examined):?\s*[-]?\s*(.+?)(?=\n\d+\.|$)',
@@ -46,6 +172,21 @@ class GPTOutputSplitter:
                 r'(?i)\*\*(?:outcomes?|results?|effects?|findings?|conclusions?).*?\*\*:?\s*[-]?\s*(.+?)(?=\n\*\*|\n\d+\.|$)'
             ]
         }
+        self.cot_pattern = r'(?i)(?:chain of thought|reasoning|rationale).*?:?\s*[-]?\s*(.+?)(?=\n\*\*|\n\d+\.|$)'
+    
+    @property
+    def pattern_version(self) -> str:
+        """Fingerprint of every pattern that affects extraction, used to key cached results."""
+        pattern_sources = {
+            'version': SPLITTER_VERSION,
+            'use_section_tokenizer': self.use_section_tokenizer,
+            'field_patterns': self.field_patterns,
+            'cot_pattern': self.cot_pattern,
+            'section_patterns': [HEADING_PATTERN.pattern, SECTION_KEYWORDS.pattern,
+                                 SUMMARY_KEYWORDS.pattern, HORIZONTAL_RULE.pattern]
+        }
+        encoded = json.dumps(pattern_sources, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()[:16]
     
     def extract_field(self, text: str, field_name: str) -> str:
         """Extract a specific field from GPT output text."""
@@ -56,46 +197,101 @@ class GPTOutputSplitter:
         for pattern in self.field_patterns[field_name]:
             match = re.search(pattern, text, re.DOTALL | re.MULTILINE)
             if match:
-                extracted = match.group(1).strip()
-                # Clean up the extracted text
-                extracted = re.sub(r'\n+', ' ', extracted)
-                extracted = re.sub(r'\s+', ' ', extracted)
-                extracted = extracted.strip('- ')
+                extracted = self._clean_field_text(match.group(1))
                 if extracted and len(extracted) > 10:  # Minimum meaningful length
                     return extracted
         
         return ""
     
+    def _clean_field_text(self, text: str) -> str:
+        """Collapse an extracted field onto one line."""
+        extracted = text.strip()
+        extracted = re.sub(r'\n+', ' ', extracted)
+        extracted = re.sub(r'\s+', ' ', extracted)
+        return extracted.strip('- ')
+    
     def extract_all_fields(self, gpt_output: str) -> Dict[str, str]:
         """Extract all fields from a single GPT output."""
+        if self.use_section_tokenizer and gpt_output:
+            result = self.extract_sectioned_fields(gpt_output)
+            if result is not None:
+                return result
+        
+        return self.extract_fields_by_pattern(gpt_output)
+    
+    def extract_sectioned_fields(self, gpt_output: str) -> Optional[Dict[str, str]]:
+        """Extract all fields from the headed sections of a GPT output in one pass.
+        
+        Returns None when the output has no recognised field sections, so the caller
+        can fall back to the pattern table.
+        """
+        sections = self.tokenizer.tokenize(gpt_output)
+        if not any(section['field'] in self.field_patterns and not section['generic']
+                   for section in sections):
+            return None
+        
+        result = {field_name: "" for field_name in self.field_patterns}
+        result['chain_of_thought'] = ""
+        
+        # The first section with meaningful content wins for each field
+        for section in sections:
+            field_name = section['field']
+            if field_name is None or result[field_name]:
+                continue
+            
+            if field_name == 'chain_of_thought':
+                result[field_name] = '\n'.join(section['lines']).strip()
+            else:
+                extracted = self._clean_field_text('\n'.join(section['lines']).replace('**', ''))
+                if len(extracted) > 10:  # Minimum meaningful length
+                    result[field_name] = extracted
+        
+        return result
+    
+    def extract_fields_by_pattern(self, gpt_output: str) -> Dict[str, str]:
+        """Extract all fields with the regex pattern table."""
         result = {}
         for field_name in self.field_patterns.keys():
             result[field_name] = self.extract_field(gpt_output, field_name)
         
         # Extract Chain of Thought if present
-        cot_pattern = r'(?i)(?:chain of thought|reasoning|rationale).*?:?\s*[-]?\s*(.+?)(?=\n\*\*|\n\d+\.|$)'
-        cot_match = re.search(cot_pattern, gpt_output, re.DOTALL | re.MULTILINE)
+        cot_match = re.search(self.cot_pattern, gpt_output, re.DOTALL | re.MULTILINE)
         result['chain_of_thought'] = cot_match.group(1).strip() if cot_match else ""
         
         return result
     
-    def process_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Process a dataframe with gpt_output column and split into structured fields."""
+    def extract_many(self, gpt_outputs: List[str]) -> List[Dict[str, str]]:
+        """Extract all fields from a batch of GPT outputs, preserving order."""
+        return [self.extract_all_fields(gpt_output) for gpt_output in gpt_outputs]
+    
+    def process_dataframe(self, df: pd.DataFrame, workers: int = 1,
+                          chunk_size: Optional[int] = None, cache=None) -> pd.DataFrame:
+        """Process a dataframe with gpt_output column and split into structured fields.
+        
+        Args:
+            df: DataFrame with a gpt_output column
+            workers: Number of worker processes used for extraction (1 = serial)
+            chunk_size: Rows per task sent to a worker (default: spread evenly, ~4 tasks per worker)
+            cache: Optional ExtractionCache; only rows missing from it are extracted
+        """
         logger.info(f"Processing {len(df)} rows with GPT output splitting")
         
         if 'gpt_output' not in df.columns:
             raise ValueError("DataFrame must contain 'gpt_output' column")
         
+        gpt_outputs = [str(value) if pd.notna(value) else "" for value in df['gpt_output']]
+        
         # Extract fields for each row
-        extracted_fields = []
-        for idx, row in df.iterrows():
-            gpt_output = str(row['gpt_output']) if pd.notna(row['gpt_output']) else ""
-            fields = self.extract_all_fields(gpt_output)
-            extracted_fields.append(fields)
+        if cache is not None:
+            pmids = df['pmid'] if 'pmid' in df.columns else [''] * len(df)
+            extracted_fields = self._extract_cached(gpt_outputs, list(pmids), cache, workers, chunk_size)
+        else:
+            extracted_fields = self._extract(gpt_outputs, workers, chunk_size)
         
         # Convert to DataFrame and merge with original
-        fields_df = pd.DataFrame(extracted_fields)
+        fields_df = pd.DataFrame(extracted_fields, index=df.index)
         result_df = pd.concat([df, fields_df], axis=1)
+        coerce_year(result_df)
         
         logger.info(f"Extracted fields: {list(fields_df.columns)}")
         logger.info(f"Non-empty extractions per field:")
@@ -105,10 +301,87 @@ class GPTOutputSplitter:
         
         return result_df
     
-    def save_processed_data(self, df: pd.DataFrame, output_path: str):
-        """Save the processed dataframe with extracted fields."""
-        df.to_csv(output_path, index=False)
+    def _extract(self, gpt_outputs: List[str], workers: int = 1,
+                 chunk_size: Optional[int] = None) -> List[Dict[str, str]]:
+        """Extract fields serially or across a process pool."""
+        if workers > 1 and len(gpt_outputs) > 1:
+            return self._extract_parallel(gpt_outputs, workers, chunk_size)
+        return self.extract_many(gpt_outputs)
+    
+    def _extract_cached(self, gpt_outputs: List[str], pmids: List[Any], cache,
+                        workers: int = 1, chunk_size: Optional[int] = None) -> List[Dict[str, str]]:
+        """Extract fields for cache misses only and store the new results."""
+        pattern_version = self.pattern_version
+        keys = [cache.make_key(pmid, gpt_output, pattern_version)
+                for pmid, gpt_output in zip(pmids, gpt_outputs)]
+        cached = cache.get_many(keys)
+        
+        # Extract each distinct missing key once
+        missing = {}
+        for key, gpt_output in zip(keys, gpt_outputs):
+            if key not in cached and key not in missing:
+                missing[key] = gpt_output
+        
+        if missing:
+            new_fields = dict(zip(missing.keys(), self._extract(list(missing.values()), workers, chunk_size)))
+            cache.put_many(new_fields, pattern_version)
+            cached.update(new_fields)
+        
+        cache.log_stats()
+        return [cached[key] for key in keys]
+    
+    def _extract_parallel(self, gpt_outputs: List[str], workers: int,
+                          chunk_size: Optional[int] = None) -> List[Dict[str, str]]:
+        """Extract fields across a process pool, returning results in input order."""
+        if chunk_size is None:
+            chunk_size = max(1, math.ceil(len(gpt_outputs) / (workers * 4)))
+        
+        chunks = [gpt_outputs[start:start + chunk_size]
+                  for start in range(0, len(gpt_outputs), chunk_size)]
+        logger.info(f"Splitting {len(gpt_outputs)} rows in {len(chunks)} chunks across {workers} workers")
+        
+        extracted_fields = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map() yields chunk results in submission order
+            for chunk_fields in executor.map(self.extract_many, chunks):
+                extracted_fields.extend(chunk_fields)
+        
+        return extracted_fields
+    
+    def save_processed_data(self, df: pd.DataFrame, output_path: str, table_format: Optional[str] = None):
+        """Save the processed dataframe with extracted fields.
+        
+        Args:
+            df: Processed dataframe
+            output_path: Output file
+            table_format: 'csv', 'parquet' or 'feather' (default: from the extension)
+        """
+        write_table(df, output_path, table_format)
         logger.info(f"Saved processed data to {output_path}")
+    
+    def process_csv_in_chunks(self, input_path: str, output_path: str, chunksize: int,
+                              workers: int = 1, cache=None, text_store=None, profiler=None) -> int:
+        """Split a CSV chunk by chunk, appending each processed chunk to the output.
+        
+        Peak memory is bounded by the chunk size rather than the size of the input.
+        With a TextStoreWriter, each chunk's long text fields are moved into the store;
+        with a ProfileBuilder, each processed chunk is added to the dataset profile.
+        Returns the number of rows processed.
+        """
+        logger.info(f"Streaming {input_path} in chunks of {chunksize} rows")
+        
+        total_rows = 0
+        for i, chunk in enumerate(pd.read_csv(input_path, chunksize=chunksize)):
+            processed_chunk = self.process_dataframe(chunk, workers=workers, cache=cache)
+            if profiler is not None:
+                profiler.add(processed_chunk)
+            if text_store is not None:
+                processed_chunk = text_store.detach(processed_chunk)
+            processed_chunk.to_csv(output_path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+            total_rows += len(processed_chunk)
+        
+        logger.info(f"Saved {total_rows} processed rows to {output_path}")
+        return total_rows
 
 
 def main():
@@ -116,7 +389,7 @@ def main():
     import sys
     
     if len(sys.argv) != 3:
-        print("Usage: python gpt_output_splitter.py <input_csv> <output_csv>")
+        print("Usage (from src): python -m prepare.gpt_output_splitter <input_csv> <output_csv>")
         sys.exit(1)
     
     input_path = sys.argv[1]
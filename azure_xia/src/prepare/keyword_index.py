@@ -0,0 +1,120 @@
+"""
+Keyword Index Module
+Compiled keyword -> category matching shared by the normalizers, aggregators and plotters.
+"""
+
+import re
+from typing import Dict, Hashable, List, Optional
+
+
+class KeywordIndex:
+    """Finds the categories of a category -> keywords mapping in a single scan of the text.
+    
+    The keywords are compiled into one prefix-tree regex that is tried at every position
+    through a zero-width lookahead, so the cost of a lookup does not grow with the size of
+    the keyword table. Each keyword also carries the categories of the shorter keywords
+    that prefix it, which keeps the results identical to checking `keyword in text` for
+    every keyword.
+    
+    Boundaries:
+        'none': plain substring matching (the historical behaviour)
+        'start': keywords must start at a word boundary, so 'act' no longer matches
+            inside 'impact' but still matches 'activity'
+        'both': keywords must be whole words or phrases
+    """
+    
+    BOUNDARIES = ('none', 'start', 'both')
+    
+    def __init__(self, mapping: Dict[Hashable, List[str]], boundaries: str = 'none'):
+        """Compile the keywords of a mapping; matching is case-sensitive, so pass lowercased text."""
+        if boundaries not in self.BOUNDARIES:
+            raise ValueError(f"boundaries must be one of {self.BOUNDARIES}, got {boundaries!r}")
+        
+        self.boundaries = boundaries
+        self.categories = list(mapping.keys())
+        self._order = {category: i for i, category in enumerate(self.categories)}
+        
+        trie = {}
+        for category, keywords in mapping.items():
+            for keyword in keywords:
+                node = trie
+                for char in keyword:
+                    node = node.setdefault(char, {})
+                hits = node.setdefault(None, {})
+                hits[category] = max(hits.get(category, 0), len(keyword))
+        
+        # category -> longest keyword length implied by matching each keyword
+        self.keyword_hits = {}
+        self._collect_hits(trie, '', {})
+        self.always_hits = trie.get(None, {}) if boundaries == 'none' else {}
+        
+        # Empty keywords match everywhere and are handled through always_hits
+        root = {char: child for char, child in trie.items() if char is not None}
+        pattern = self._trie_pattern(root) if root else ''
+        start = r'(?<!\w)' if boundaries != 'none' else ''
+        self.pattern = re.compile(f'(?={start}({pattern}))') if pattern else None
+    
+    def _collect_hits(self, node: Dict, prefix: str, inherited: Dict[Hashable, int]):
+        """Record the category hits implied by each keyword in the prefix tree."""
+        here = node.get(None, {})
+        hits = self._merge_hits(inherited, here)
+        if here and prefix:
+            self.keyword_hits[prefix] = hits
+        
+        for char, child in node.items():
+            if char is None:
+                continue
+            # With whole-word matching a shorter keyword only counts if the longer one
+            # continues past a word boundary ("chronic" inside "chronic pain")
+            if self.boundaries == 'both' and re.match(r'\w', char):
+                self._collect_hits(child, prefix + char, inherited)
+            else:
+                self._collect_hits(child, prefix + char, hits)
+    
+    @staticmethod
+    def _merge_hits(first: Dict[Hashable, int], second: Dict[Hashable, int]) -> Dict[Hashable, int]:
+        """Merge two category -> keyword length maps, keeping the longest length."""
+        if not second:
+            return first
+        merged = dict(first)
+        for category, length in second.items():
+            merged[category] = max(merged.get(category, 0), length)
+        return merged
+    
+    def _trie_pattern(self, node: Dict) -> str:
+        """Build a regex from the prefix tree that prefers the longest keyword."""
+        alternatives = [re.escape(char) + self._trie_pattern(node[char])
+                        for char in sorted(char for char in node if char is not None)]
+        if None in node:
+            alternatives.append(r'(?!\w)' if self.boundaries == 'both' else '')
+        
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return '(?:' + '|'.join(alternatives) + ')'
+    
+    def scan(self, text: str) -> Dict[Hashable, int]:
+        """Return every matched category with the length of its longest matched keyword."""
+        found = dict(self.always_hits)
+        if self.pattern is not None:
+            for keyword in set(self.pattern.findall(text)):
+                found = self._merge_hits(found, self.keyword_hits[keyword])
+        return found
+    
+    def all_matches(self, text: str) -> List[Hashable]:
+        """Return all matched categories in mapping order."""
+        found = self.scan(text)
+        return [category for category in self.categories if category in found]
+    
+    def first_match(self, text: str, default: Optional[Hashable] = None) -> Optional[Hashable]:
+        """Return the first matched category in mapping order."""
+        found = self.scan(text)
+        if not found:
+            return default
+        return min(found, key=self._order.__getitem__)
+    
+    def longest_match(self, text: str, default: Optional[Hashable] = None) -> Optional[Hashable]:
+        """Return the category of the longest matched keyword; ties go to the earlier category."""
+        found = self.scan(text)
+        if not found:
+            return default
+        return min(found, key=lambda category: (-found[category], self._order[category]))
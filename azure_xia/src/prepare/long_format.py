@@ -0,0 +1,135 @@
+"""
+Long Format Schema Module
+Categorical columns of the long-format table and helpers for working on their integer codes.
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Dict, List, Optional
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Low-cardinality label columns stored as pd.Categorical
+CATEGORICAL_COLUMNS = [
+    'stratum_id', 'age_group', 'sex', 'clinical_cohort', 'setting',
+    'treatment_category', 'outcome_direction'
+]
+
+# Semicolon-separated multi-value columns
+MULTI_VALUE_FIELDS = ['risk_factors', 'symptoms', 'treatment_names']
+
+
+def apply_categories(df: pd.DataFrame, category_sets: Optional[Dict[str, List[str]]] = None) -> pd.DataFrame:
+    """Convert the categorical columns of a long-format table in place.
+    
+    Args:
+        df: Long-format table
+        category_sets: Fixed categories per column; columns without a set (or all
+            columns if omitted) get their observed values in sorted order
+    
+    Returns:
+        The same DataFrame, for chaining
+    """
+    category_sets = category_sets or {}
+    for column in CATEGORICAL_COLUMNS:
+        if column not in df.columns:
+            continue
+        
+        categories = category_sets.get(column)
+        if categories is None:
+            if not isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype('category')
+            continue
+        
+        # Keep unexpected labels instead of silently turning them into NaN
+        unexpected = sorted(set(df[column].dropna().unique()) - set(categories))
+        if unexpected:
+            logger.warning(f"Adding {len(unexpected)} unexpected {column} labels to the category set")
+        df[column] = pd.Categorical(df[column], categories=list(categories) + unexpected)
+    
+    return df
+
+
+def coerce_year(df: pd.DataFrame) -> pd.DataFrame:
+    """Store the year column as float in place, missing or unparseable years as NaN.
+    
+    Applied wherever tables are built, so a file written in one piece and one written
+    chunk by chunk agree even though chunks without missing years are read as ints.
+    
+    Returns:
+        The same DataFrame, for chaining
+    """
+    if 'year' in df.columns:
+        df['year'] = pd.to_numeric(df['year'], errors='coerce').astype(float)
+    return df
+
+
+def build_item_index(df: pd.DataFrame, fields: List[str] = MULTI_VALUE_FIELDS) -> pd.DataFrame:
+    """Split the multi-value columns into one long (row_id, field, item) table.
+    
+    Every value is parsed once with str.split().explode(); row_id is the row position
+    in df, and items keep their row and split order within each field.
+    """
+    frames = []
+    for field in fields:
+        if field not in df.columns:
+            continue
+        values = df[field].reset_index(drop=True)
+        values = values[values.notna() & (values != '')].astype(str)
+        frames.append(pd.DataFrame({'row_id': values.index.to_numpy(), 'field': field, 'value': values.to_numpy()}))
+    
+    if not frames:
+        return pd.DataFrame({'row_id': pd.Series(dtype='int64'),
+                             'field': pd.Categorical([], categories=fields),
+                             'item': pd.Series(dtype=object)})
+    
+    stacked = pd.concat(frames, ignore_index=True)
+    items = stacked['value'].str.split(';').explode().str.strip()
+    items = items[items.notna() & (items != '')]
+    
+    index = stacked.loc[items.index, ['row_id', 'field']].reset_index(drop=True)
+    index['field'] = pd.Categorical(index['field'], categories=fields)
+    index['item'] = items.to_numpy()
+    return index
+
+
+def codes_and_labels(series: pd.Series):
+    """Return the integer codes (-1 for missing) and category labels of a column."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype('category')
+    return series.cat.codes.to_numpy(), series.cat.categories
+
+
+def label_counts(series: pd.Series) -> pd.Series:
+    """Count values by integer code, like value_counts() without unobserved categories."""
+    codes, labels = codes_and_labels(series)
+    counts = pd.Series(codes[codes >= 0]).value_counts()
+    counts.index = labels[counts.index.to_numpy()]
+    return counts
+
+
+def mode_label(series: pd.Series, default: str = 'unknown') -> str:
+    """Most frequent label by integer code; ties go to the smallest label, like mode()."""
+    codes, labels = codes_and_labels(series)
+    codes = codes[codes >= 0]
+    if len(codes) == 0:
+        return default
+    
+    counts = np.bincount(codes, minlength=len(labels))
+    return min(labels[np.flatnonzero(counts == counts.max())])
+
+
+def label_mask(series: pd.Series, predicate) -> np.ndarray:
+    """Evaluate a predicate once per distinct label and broadcast it over the rows.
+    
+    Categorical columns use their integer codes; other columns are factorized first.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, labels = codes_and_labels(series)
+    else:
+        codes, labels = pd.factorize(series)
+    
+    label_values = np.array([bool(predicate(label)) for label in labels] + [bool(predicate(np.nan))])
+    return label_values[codes]
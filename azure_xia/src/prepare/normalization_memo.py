@@ -0,0 +1,113 @@
+"""
+Normalization Memo Module
+Bounded LRU memoization of field normalization results, optionally persisted between runs.
+"""
+
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _fresh(value: Any) -> Any:
+    """Copy the lists and dicts of a result, so callers never hold the cached objects."""
+    if isinstance(value, dict):
+        return {key: _fresh(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fresh(item) for item in value]
+    return value
+
+
+class NormalizationMemo:
+    """LRU cache of normalization results keyed by (namespace, normalized text)."""
+    
+    def __init__(self, maxsize: int = 10000, path: Optional[str] = None, version: str = ''):
+        """Create the memo, loading persisted entries if a file exists.
+        
+        Args:
+            maxsize: Maximum number of cached results; 0 disables memoization
+            path: JSON file the memo is loaded from and saved to (optional)
+            version: Fingerprint of the normalization rules; persisted entries
+                with a different version are ignored
+        """
+        self.maxsize = maxsize
+        self.path = path
+        self.version = version
+        self.entries = OrderedDict()
+        self.hits = {}
+        self.misses = {}
+        
+        if path and os.path.exists(path):
+            self.load()
+    
+    def lookup(self, namespace: str, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached result for a key, computing and storing it on a miss.
+        
+        Every call returns its own copy of the result, so callers may modify it.
+        """
+        if self.maxsize <= 0:
+            return compute()
+        
+        entry_key = (namespace, key)
+        if entry_key in self.entries:
+            self.hits[namespace] = self.hits.get(namespace, 0) + 1
+            self.entries.move_to_end(entry_key)
+            return _fresh(self.entries[entry_key])
+        
+        self.misses[namespace] = self.misses.get(namespace, 0) + 1
+        value = compute()
+        self.entries[entry_key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return _fresh(value)
+    
+    def hit_rates(self) -> Dict[str, float]:
+        """Return the hit rate per namespace."""
+        rates = {}
+        for namespace in sorted(set(self.hits) | set(self.misses)):
+            hits = self.hits.get(namespace, 0)
+            total = hits + self.misses.get(namespace, 0)
+            rates[namespace] = hits / total if total else 0.0
+        return rates
+    
+    def log_stats(self):
+        """Log the hit/miss counters per namespace."""
+        for namespace, hit_rate in self.hit_rates().items():
+            hits = self.hits.get(namespace, 0)
+            misses = self.misses.get(namespace, 0)
+            logger.info(f"Normalization memo [{namespace}]: {hits} hits, {misses} misses ({hit_rate:.1%} hit rate)")
+    
+    def load(self):
+        """Load persisted entries, skipping them if they were built with other rules."""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        
+        if data.get('version') != self.version:
+            logger.info(f"Ignoring normalization memo {self.path} built with other rules")
+            return
+        
+        entries = data.get('entries', [])
+        for namespace, key, value in entries[max(len(entries) - self.maxsize, 0):]:
+            self.entries[(namespace, key)] = value
+        logger.info(f"Loaded {len(self.entries)} normalization results from {self.path}")
+    
+    def save(self):
+        """Persist the cached entries, least recently used first."""
+        if not self.path:
+            return
+        
+        memo_dir = os.path.dirname(self.path)
+        if memo_dir:
+            os.makedirs(memo_dir, exist_ok=True)
+        
+        data = {
+            'version': self.version,
+            'entries': [[namespace, key, value] for (namespace, key), value in self.entries.items()]
+        }
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        logger.info(f"Saved {len(self.entries)} normalization results to {self.path}")
@@ -4,19 +4,55 @@ Normalizes extracted fields into standardized categories for analysis.
 """
 
 import pandas as pd
+import numpy as np
+import hashlib
+import itertools
+import json
 import re
 from typing import Dict, List, Set, Tuple
 import logging
 
+from prepare.keyword_index import KeywordIndex
+from prepare.normalization_memo import NormalizationMemo
+from prepare.long_format import apply_categories, coerce_year
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bump when normalization logic changes so persisted memos are discarded
+NORMALIZER_VERSION = '1'
+
 
 class FieldNormalizer:
     """Normalizes extracted fields into standardized categories."""
     
-    def __init__(self):
-        """Initialize normalization mappings."""
+    # Column order of the long-format table
+    LONG_FORMAT_COLUMNS = [
+        'pmid', 'title', 'year', 'journal', 'stratum_id',
+        'age_group', 'sex', 'clinical_cohort', 'setting',
+        'treatment_category', 'treatment_names', 'outcome_direction',
+        'risk_factors', 'symptoms'
+    ]
+    
+    # Columns of the processed table read by explode_to_long_format()
+    INPUT_COLUMNS = [
+        'pmid', 'title', 'year', 'journal',
+        'population', 'risk_factors', 'symptoms', 'treatments', 'outcomes'
+    ]
+    
+    def __init__(self, keyword_boundaries: str = 'start', memo_size: int = 10000, memo_path: str = None):
+        """Initialize normalization mappings.
+        
+        Args:
+            keyword_boundaries: KeywordIndex boundary mode for keyword matching; 'start'
+                stops short keywords matching inside words ('act' in 'abstract', 'male' in 'female')
+            memo_size: Maximum number of memoized normalization results (0 disables)
+            memo_path: JSON file persisting memoized results between runs (optional)
+        """
+        self.keyword_boundaries = keyword_boundaries
+        # Combined KeywordIndex per set of mappings, keyed by mapping ids
+        self._combined_indexes = {}
+        
         self.age_group_mapping = {
             'adolescents': ['adolescent', 'teen', 'teenage', 'youth', 'young people', 'minors', '13-17', '12-18'],
             'adults': ['adult', 'grown-up', '18-65', '18-64', 'working age'],
@@ -93,20 +129,64 @@ class FieldNormalizer:
                 'partial', 'limited effect'
             ]
         }
+        
+        self.memo = NormalizationMemo(memo_size, memo_path, self.rules_version)
+    
+    @property
+    def rules_version(self) -> str:
+        """Fingerprint of the mappings and matching mode, used to validate persisted memos."""
+        rules = [
+            NORMALIZER_VERSION, type(self).__name__, self.keyword_boundaries,
+            self.age_group_mapping, self.sex_mapping, self.clinical_cohort_mapping, self.setting_mapping,
+            self.treatment_category_mapping, self.outcome_direction_mapping
+        ]
+        return hashlib.sha256(json.dumps(rules).encode('utf-8')).hexdigest()[:16]
+    
+    @property
+    def category_sets(self) -> Dict[str, List[str]]:
+        """Fixed categories of the categorical long-format columns."""
+        dimensions = {
+            'age_group': self._with_unspecified(self.age_group_mapping),
+            'sex': self._with_unspecified(self.sex_mapping),
+            'clinical_cohort': self._with_unspecified(self.clinical_cohort_mapping),
+            'setting': self._with_unspecified(self.setting_mapping)
+        }
+        strata = dict.fromkeys(
+            self._stratum_id(*parts) for parts in itertools.product(*dimensions.values())
+        )
+        return {
+            'stratum_id': list(strata),
+            **dimensions,
+            'treatment_category': list(self.treatment_category_mapping) + ['other'],
+            'outcome_direction': self._with_unspecified(self.outcome_direction_mapping)
+        }
+    
+    @staticmethod
+    def _with_unspecified(mapping: Dict[str, List[str]]) -> List[str]:
+        """Categories of a mapping plus the 'unspecified' default."""
+        return [category for category in mapping if category != 'unspecified'] + ['unspecified']
+    
+    @staticmethod
+    def _stratum_id(*parts: str) -> str:
+        """Join the specified population dimensions into a stratum ID."""
+        return '|'.join(part for part in parts if part != 'unspecified') or 'general'
     
     def normalize_population(self, text: str) -> Dict[str, List[str]]:
         """Normalize population text into structured categories."""
         if not text or pd.isna(text):
             return {'age_group': [], 'sex': [], 'clinical_cohort': [], 'setting': []}
         
-        text_lower = text.lower()
-        
-        result = {
-            'age_group': self._match_categories(text_lower, self.age_group_mapping),
-            'sex': self._match_categories(text_lower, self.sex_mapping),
-            'clinical_cohort': self._match_categories(text_lower, self.clinical_cohort_mapping),
-            'setting': self._match_categories(text_lower, self.setting_mapping)
-        }
+        text_lower = text.lower().strip()
+        return self.memo.lookup('population', text_lower, lambda: self._normalize_population(text_lower))
+    
+    def _normalize_population(self, text_lower: str) -> Dict[str, List[str]]:
+        """Normalize lowercased population text (uncached)."""
+        result = self._match_mappings(text_lower, {
+            'age_group': self.age_group_mapping,
+            'sex': self.sex_mapping,
+            'clinical_cohort': self.clinical_cohort_mapping,
+            'setting': self.setting_mapping
+        })
         
         # Default to unspecified if no matches
         for key in result:
@@ -120,6 +200,12 @@ class FieldNormalizer:
         if not text or pd.isna(text):
             return {'categories': [], 'names': []}
         
+        # Treatment names keep their original case, so key on the stripped text
+        text = text.strip()
+        return self.memo.lookup('treatments', text, lambda: self._normalize_treatments(text))
+    
+    def _normalize_treatments(self, text: str) -> Dict[str, List[str]]:
+        """Normalize stripped treatment text (uncached)."""
         text_lower = text.lower()
         categories = self._match_categories(text_lower, self.treatment_category_mapping)
         
@@ -136,20 +222,36 @@ class FieldNormalizer:
         if not text or pd.isna(text):
             return ['unspecified']
         
-        text_lower = text.lower()
+        text_lower = text.lower().strip()
+        return self.memo.lookup('outcomes', text_lower, lambda: self._normalize_outcomes(text_lower))
+    
+    def _normalize_outcomes(self, text_lower: str) -> List[str]:
+        """Normalize lowercased outcome text (uncached)."""
         directions = self._match_categories(text_lower, self.outcome_direction_mapping)
         
         return directions if directions else ['unspecified']
     
     def _match_categories(self, text: str, mapping: Dict[str, List[str]]) -> List[str]:
         """Match text against category mapping."""
-        matches = []
-        for category, keywords in mapping.items():
-            for keyword in keywords:
-                if keyword in text:
-                    matches.append(category)
-                    break  # Only add category once
-        return matches
+        return self._match_mappings(text, {'categories': mapping})['categories']
+    
+    def _match_mappings(self, text: str, mappings: Dict[str, Dict[str, List[str]]]) -> Dict[str, List[str]]:
+        """Match text against several named mappings in a single scan."""
+        key = tuple((name, id(mapping)) for name, mapping in mappings.items())
+        entry = self._combined_indexes.get(key)
+        if entry is None or any(cached is not mapping for cached, mapping in zip(entry[0], mappings.values())):
+            combined = {
+                (name, category): keywords
+                for name, mapping in mappings.items()
+                for category, keywords in mapping.items()
+            }
+            entry = (list(mappings.values()), KeywordIndex(combined, self.keyword_boundaries))
+            self._combined_indexes[key] = entry
+        
+        result = {name: [] for name in mappings}
+        for name, category in entry[1].all_matches(text):
+            result[name].append(category)
+        return result
     
     def _extract_treatment_names(self, text: str) -> List[str]:
         """Extract specific treatment names from text."""
@@ -177,60 +279,90 @@ class FieldNormalizer:
         """Convert multi-valued fields to long format for analysis."""
         logger.info("Converting to long format for analysis")
         
-        rows = []
-        for _, row in df.iterrows():
-            # Normalize fields
-            pop_norm = self.normalize_population(row.get('population', ''))
-            treat_norm = self.normalize_treatments(row.get('treatments', ''))
-            outcome_norm = self.normalize_outcomes(row.get('outcomes', ''))
-            
-            # Parse multi-valued fields
-            risk_factors = self._parse_list_field(row.get('risk_factors', ''))
-            symptoms = self._parse_list_field(row.get('symptoms', ''))
-            
-            # Create combinations
-            for age_group in pop_norm['age_group']:
-                for sex in pop_norm['sex']:
-                    for clinical_cohort in pop_norm['clinical_cohort']:
-                        for setting in pop_norm['setting']:
-                            for treat_cat in treat_norm['categories']:
-                                for outcome_dir in outcome_norm:
-                                    # Create stratum ID
-                                    stratum_parts = []
-                                    if age_group != 'unspecified':
-                                        stratum_parts.append(age_group)
-                                    if sex != 'unspecified':
-                                        stratum_parts.append(sex)
-                                    if clinical_cohort != 'unspecified':
-                                        stratum_parts.append(clinical_cohort)
-                                    if setting != 'unspecified':
-                                        stratum_parts.append(setting)
-                                    
-                                    stratum_id = '|'.join(stratum_parts) if stratum_parts else 'general'
-                                    
-                                    base_row = {
-                                        'pmid': row['pmid'],
-                                        'title': row['title'],
-                                        'year': row['year'],
-                                        'journal': row['journal'],
-                                        'stratum_id': stratum_id,
-                                        'age_group': age_group,
-                                        'sex': sex,
-                                        'clinical_cohort': clinical_cohort,
-                                        'setting': setting,
-                                        'treatment_category': treat_cat,
-                                        'treatment_names': '; '.join(treat_norm['names']),
-                                        'outcome_direction': outcome_dir,
-                                        'risk_factors': '; '.join(risk_factors),
-                                        'symptoms': '; '.join(symptoms)
-                                    }
-                                    rows.append(base_row)
-        
-        result_df = pd.DataFrame(rows)
+        # Normalize fields once per row
+        pop_norms = [self.normalize_population(text) for text in self._column_or_empty(df, 'population')]
+        treat_norms = [self.normalize_treatments(text) for text in self._column_or_empty(df, 'treatments')]
+        outcome_norms = [self.normalize_outcomes(text) for text in self._column_or_empty(df, 'outcomes')]
+        
+        # Cross-join the population dimensions on row position and derive the stratum ID
+        # once per population combination, before fanning out over treatments and outcomes
+        long_df = self._dimension_frame('age_group', [pop['age_group'] for pop in pop_norms])
+        for dimension in ['sex', 'clinical_cohort', 'setting']:
+            long_df = long_df.merge(self._dimension_frame(dimension, [pop[dimension] for pop in pop_norms]),
+                                    on='_row', how='inner', sort=False)
+        
+        long_df['stratum_id'] = [
+            self._stratum_id(*parts)
+            for parts in zip(long_df['age_group'], long_df['sex'], long_df['clinical_cohort'], long_df['setting'])
+        ]
+        
+        long_df = long_df.merge(self._dimension_frame('treatment_category', [treat['categories'] for treat in treat_norms]),
+                                on='_row', how='inner', sort=False)
+        long_df = long_df.merge(self._dimension_frame('outcome_direction', outcome_norms),
+                                on='_row', how='inner', sort=False)
+        
+        if long_df.empty:
+            logger.info(f"Exploded to 0 rows from {len(df)} original rows")
+            return pd.DataFrame()
+        
+        # Per-article columns, built once and attached by row position
+        article_df = df[['pmid', 'title', 'year', 'journal']].reset_index(drop=True)
+        article_df['treatment_names'] = ['; '.join(treat['names']) for treat in treat_norms]
+        article_df['risk_factors'] = ['; '.join(self._parse_list_field(text))
+                                      for text in self._column_or_empty(df, 'risk_factors')]
+        article_df['symptoms'] = ['; '.join(self._parse_list_field(text))
+                                  for text in self._column_or_empty(df, 'symptoms')]
+        
+        result_df = long_df.join(article_df, on='_row')[self.LONG_FORMAT_COLUMNS].reset_index(drop=True)
+        apply_categories(result_df, self.category_sets)
+        coerce_year(result_df)
         logger.info(f"Exploded to {len(result_df)} rows from {len(df)} original rows")
         
         return result_df
     
+    @staticmethod
+    def _column_or_empty(df: pd.DataFrame, column: str) -> pd.Series:
+        """Return a column, or empty strings if the column is missing."""
+        if column in df.columns:
+            return df[column]
+        return pd.Series('', index=df.index)
+    
+    @staticmethod
+    def _dimension_frame(name: str, values_per_row: List[List[str]]) -> pd.DataFrame:
+        """Flatten per-row category lists into (row position, value) pairs."""
+        lengths = [len(values) for values in values_per_row]
+        return pd.DataFrame({
+            '_row': np.repeat(np.arange(len(values_per_row)), lengths),
+            name: [value for values in values_per_row for value in values]
+        })
+    
+    def explode_csv_in_chunks(self, input_path: str, output_path: str, chunksize: int) -> Tuple[int, int]:
+        """Convert a CSV to long format chunk by chunk, appending to the output.
+        
+        Returns the number of input rows and normalized rows.
+        """
+        logger.info(f"Streaming {input_path} in chunks of {chunksize} rows")
+        
+        input_rows = 0
+        output_rows = 0
+        header_written = False
+        for chunk in pd.read_csv(input_path, chunksize=chunksize):
+            input_rows += len(chunk)
+            long_chunk = self.explode_to_long_format(chunk)
+            if long_chunk.empty:
+                continue
+            
+            long_chunk.to_csv(output_path, mode='a' if header_written else 'w',
+                              header=not header_written, index=False)
+            header_written = True
+            output_rows += len(long_chunk)
+        
+        if not header_written:
+            pd.DataFrame().to_csv(output_path, index=False)
+        
+        logger.info(f"Saved {output_rows} normalized rows from {input_rows} original rows to {output_path}")
+        return input_rows, output_rows
+    
     def _parse_list_field(self, text: str) -> List[str]:
         """Parse list-like field (semicolon or comma separated)."""
         if not text or pd.isna(text):
@@ -247,7 +379,7 @@ def main():
     import sys
     
     if len(sys.argv) != 3:
-        print("Usage: python normalize_labels.py <input_csv> <output_csv>")
+        print("Usage (from src): python -m prepare.normalize_labels <input_csv> <output_csv>")
         sys.exit(1)
     
     input_path = sys.argv[1]
@@ -260,6 +392,7 @@ def main():
     # Normalize
     normalizer = FieldNormalizer()
     normalized_df = normalizer.explode_to_long_format(df)
+    normalizer.memo.log_stats()
     
     # Save
     normalized_df.to_csv(output_path, index=False)
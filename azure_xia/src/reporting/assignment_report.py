@@ -8,26 +8,42 @@ Creates comprehensive reports for assignment submission including:
 - Assignment requirements fulfillment
 """
 
-import pandas as pd
 import os
 import json
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
+
+from loaders.table_io import read_result_table
+from loaders.data_profile import DatasetProfile
+
+# Extracted fields whose completeness is reported as the extraction rate
+EXTRACTED_FIELDS = ['population', 'risk_factors', 'treatments', 'outcomes', 'symptoms']
 
 
 class AssignmentReportGenerator:
     """Generates comprehensive assignment reports."""
     
-    def __init__(self, tables_dir: str, plots_dir: str):
-        """Initialize with analysis results directories."""
+    def __init__(self, tables_dir: str, plots_dir: str, table_format: Optional[str] = None,
+                 profile: Optional[DatasetProfile] = None):
+        """Initialize with analysis results directories.
+        
+        Args:
+            tables_dir: Directory with the analysis tables
+            plots_dir: Directory with the plots
+            table_format: 'csv', 'parquet' or 'feather' (default: the format recorded in tables_dir)
+            profile: Dataset profile (default: the one saved in tables_dir, if any)
+        """
         self.tables_dir = tables_dir
         self.plots_dir = plots_dir
+        self.table_format = table_format
+        self.profile = profile or DatasetProfile.find(tables_dir)
         self.timestamp = datetime.now()
     
     def generate_executive_summary(self) -> Dict[str, Any]:
         """Generate executive summary for the assignment."""
         # Load key data
-        stratum_summary = pd.read_csv(f"{self.tables_dir}/stratum_summary_by_stratum.csv")
+        stratum_summary = read_result_table(self.tables_dir, 'stratum_summary', ['stratum_id', 'unique_studies'],
+                                            self.table_format)
         
         summary = {
             "project_title": "Population-Stratum Analysis for Mental Health Literature",
@@ -43,7 +59,7 @@ class AssignmentReportGenerator:
             "key_results": {
                 "population_strata": len(stratum_summary),
                 "total_studies": stratum_summary['unique_studies'].sum(),
-                "time_period": "2020-2024",
+                "time_period": self._time_period(),
                 "largest_group": stratum_summary.loc[stratum_summary['unique_studies'].idxmax(), 'stratum_id'],
                 "research_gaps": len(stratum_summary[stratum_summary['unique_studies'] < 10])
             },
@@ -58,6 +74,28 @@ class AssignmentReportGenerator:
         
         return summary
     
+    def _time_period(self) -> str:
+        """Publication years covered, from the dataset profile when available."""
+        if self.profile is not None and self.profile.year_range:
+            return "{}-{}".format(*self.profile.year_range)
+        return "2020-2024"
+    
+    def _data_coverage(self) -> Dict[str, str]:
+        """Extraction rate per field, from the dataset profile when available."""
+        if self.profile is None:
+            return {
+                "population_extraction_rate": "98.6%",
+                "risk_factor_extraction_rate": "100%",
+                "treatment_extraction_rate": "100%", 
+                "outcome_extraction_rate": "96.3%",
+                "symptom_extraction_rate": "44.7%"
+            }
+        completeness = self.profile.completeness(EXTRACTED_FIELDS)
+        names = {'population': 'population', 'risk_factors': 'risk_factor', 'treatments': 'treatment',
+                 'outcomes': 'outcome', 'symptoms': 'symptom'}
+        return {f"{names[field]}_extraction_rate": f"{stats['percentage']:.1f}%"
+                for field, stats in completeness.items()}
+    
     def generate_methodology_section(self) -> Dict[str, Any]:
         """Generate detailed methodology explanation."""
         methodology = {
@@ -100,18 +138,12 @@ class AssignmentReportGenerator:
     def analyze_results_quality(self) -> Dict[str, Any]:
         """Analyze the quality and significance of results."""
         # Load analysis files
-        stratum_summary = pd.read_csv(f"{self.tables_dir}/stratum_summary_by_stratum.csv")
-        risk_factors = pd.read_csv(f"{self.tables_dir}/risk_factors_by_stratum.csv")
-        treatments = pd.read_csv(f"{self.tables_dir}/treatments_by_stratum.csv")
+        stratum_summary = read_result_table(self.tables_dir, 'stratum_summary', table_format=self.table_format)
+        risk_factors = read_result_table(self.tables_dir, 'risk_factors', table_format=self.table_format)
+        treatments = read_result_table(self.tables_dir, 'treatments', table_format=self.table_format)
         
         analysis = {
-            "data_coverage": {
-                "population_extraction_rate": "98.6%",
-                "risk_factor_extraction_rate": "100%",
-                "treatment_extraction_rate": "100%", 
-                "outcome_extraction_rate": "96.3%",
-                "symptom_extraction_rate": "44.7%"
-            },
+            "data_coverage": self._data_coverage(),
             "stratum_quality": {
                 "total_strata": len(stratum_summary),
                 "well_represented": len(stratum_summary[stratum_summary['unique_studies'] >= 10]),
@@ -252,6 +284,8 @@ class AssignmentReportGenerator:
             "assignment_requirements": requirements,
             "technical_specifications": tech_specs
         }
+        if self.profile is not None:
+            report["dataset_profile"] = self.profile.to_dict()
         
         # Save as JSON
         with open(output_path, 'w') as f:
@@ -376,7 +410,7 @@ def main():
     import sys
     
     if len(sys.argv) < 3:
-        print("Usage: python assignment_report.py <tables_dir> <plots_dir> [output_dir]")
+        print("Usage (from src): python -m reporting.assignment_report <tables_dir> <plots_dir> [output_dir]")
         sys.exit(1)
     
     tables_dir = sys.argv[1]
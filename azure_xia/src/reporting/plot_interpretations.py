@@ -3,24 +3,32 @@ Plot Interpretation Generator
 Creates detailed explanations for each visualization.
 """
 
-import pandas as pd
 import base64
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from loaders.table_io import read_result_table
 
 
 class PlotInterpreter:
     """Generates detailed plot interpretations."""
     
-    def __init__(self, tables_dir: str, plots_dir: str):
-        """Initialize with data directories."""
+    def __init__(self, tables_dir: str, plots_dir: str, table_format: Optional[str] = None):
+        """Initialize with data directories.
+        
+        Args:
+            tables_dir: Directory with the analysis tables
+            plots_dir: Directory with the plots
+            table_format: 'csv', 'parquet' or 'feather' (default: the format recorded in tables_dir)
+        """
         self.tables_dir = tables_dir
         self.plots_dir = plots_dir
+        self.table_format = table_format
     
     def interpret_stratum_overview(self) -> Dict[str, Any]:
         """Interpret the stratum overview plot."""
         # Load stratum data
-        df = pd.read_csv(f"{self.tables_dir}/stratum_summary_by_stratum.csv")
+        df = read_result_table(self.tables_dir, 'stratum_summary', table_format=self.table_format)
         
         total_strata = len(df)
         top_group = df.iloc[0]['stratum_id']
@@ -54,7 +62,7 @@ class PlotInterpreter:
     def interpret_risk_factors(self) -> Dict[str, Any]:
         """Interpret the risk factors plot."""
         # Load risk factors data
-        df = pd.read_csv(f"{self.tables_dir}/risk_factors_by_stratum.csv")
+        df = read_result_table(self.tables_dir, 'risk_factors', table_format=self.table_format)
         
         top_strata = df.groupby('stratum_id')['total_studies'].first().nlargest(6).index.tolist()
         
@@ -88,7 +96,7 @@ class PlotInterpreter:
     def interpret_symptoms_comparison(self) -> Dict[str, Any]:
         """Interpret the symptoms comparison heatmap."""
         # Load symptoms data
-        df = pd.read_csv(f"{self.tables_dir}/symptoms_by_stratum.csv")
+        df = read_result_table(self.tables_dir, 'symptoms', table_format=self.table_format)
         
         num_groups = df['stratum_id'].nunique()
         
@@ -130,7 +138,7 @@ class PlotInterpreter:
     def interpret_treatment_outcomes(self) -> Dict[str, Any]:
         """Interpret treatment outcomes heatmap."""
         # Load treatment outcomes data  
-        df = pd.read_csv(f"{self.tables_dir}/treatment_outcomes_by_stratum.csv")
+        df = read_result_table(self.tables_dir, 'treatment_outcomes', table_format=self.table_format)
         
         interpretation = {
             "title": "Treatment Categories vs Outcome Directions",
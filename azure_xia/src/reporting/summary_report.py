@@ -3,26 +3,33 @@ User-Friendly Summary Report Generator
 Explains what all the analysis files mean in plain English.
 """
 
-import pandas as pd
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import json
 
+from loaders.table_io import find_table, read_table, result_table_path
+from loaders.data_profile import DatasetProfile
+
 
 class SummaryReportGenerator:
     """Generates human-readable summaries of analysis results."""
     
-    def __init__(self, tables_dir: str):
-        """Initialize with tables directory."""
+    def __init__(self, tables_dir: str, table_format: Optional[str] = None,
+                 profile: Optional[DatasetProfile] = None):
+        """Initialize with tables directory.
+        
+        Args:
+            tables_dir: Directory with the analysis tables
+            table_format: 'csv', 'parquet' or 'feather' (default: the format recorded in tables_dir)
+            profile: Dataset profile (default: the one saved in tables_dir, if any)
+        """
         self.tables_dir = tables_dir
-        self.files = {
-            'stratum_summary': 'stratum_summary_by_stratum.csv',
-            'risk_factors': 'risk_factors_by_stratum.csv', 
-            'symptoms': 'symptoms_by_stratum.csv',
-            'treatments': 'treatments_by_stratum.csv',
-            'outcomes': 'outcomes_by_stratum.csv',
-            'treatment_outcomes': 'treatment_outcomes_by_stratum.csv'
-        }
+        self.table_format = table_format
+        self.profile = profile or DatasetProfile.find(tables_dir)
+    
+    def _table_path(self, name: str) -> str:
+        """Path of one analysis result table."""
+        return result_table_path(self.tables_dir, name, self.table_format)
     
     def generate_executive_summary(self) -> str:
         """Generate a high-level executive summary."""
@@ -32,14 +39,19 @@ class SummaryReportGenerator:
         summary.append("=" * 70)
         
         # Load stratum summary
-        stratum_file = os.path.join(self.tables_dir, self.files['stratum_summary'])
+        stratum_file = self._table_path('stratum_summary')
         if os.path.exists(stratum_file):
-            df = pd.read_csv(stratum_file)
+            df = read_table(stratum_file, columns=['stratum_id', 'unique_studies', 'year_range'])
             
             summary.append(f"\n🔍 OVERVIEW:")
             summary.append(f"   • {len(df)} distinct population groups identified")
             summary.append(f"   • {df['unique_studies'].sum()} total studies analyzed")
-            summary.append(f"   • Time period: {df['year_range'].iloc[0] if not df.empty else 'Unknown'}")
+            if self.profile is not None:
+                summary.append(f"   • {self.profile.total_records} source records from {self.profile.unique_journals} journals")
+            if self.profile is not None and self.profile.year_range:
+                summary.append("   • Time period: {}-{}".format(*self.profile.year_range))
+            else:
+                summary.append(f"   • Time period: {df['year_range'].iloc[0] if not df.empty else 'Unknown'}")
             
             # Top populations
             top_3 = df.nlargest(3, 'unique_studies')
@@ -65,9 +77,9 @@ class SummaryReportGenerator:
         explanation.append("=" * 50)
         explanation.append("Shows what causes or triggers depression/anxiety in different groups.")
         
-        risk_file = os.path.join(self.tables_dir, self.files['risk_factors'])
+        risk_file = self._table_path('risk_factors')
         if os.path.exists(risk_file):
-            df = pd.read_csv(risk_file)
+            df = read_table(risk_file, columns=['stratum_id', 'risk_factor', 'count', 'percentage'])
             
             # Most common risk factors overall
             top_risks = df.groupby('risk_factor')['count'].sum().nlargest(5)
@@ -98,9 +110,9 @@ class SummaryReportGenerator:
         explanation.append("=" * 50)
         explanation.append("Shows what treatments are used for different population groups.")
         
-        treat_file = os.path.join(self.tables_dir, self.files['treatments'])
+        treat_file = self._table_path('treatments')
         if os.path.exists(treat_file):
-            df = pd.read_csv(treat_file)
+            df = read_table(treat_file, columns=['treatment_type', 'treatment', 'count', 'total_studies'])
             
             # Treatment categories overall
             categories = df[df['treatment_type'] == 'category'].groupby('treatment')['count'].sum().sort_values(ascending=False)
@@ -127,9 +139,9 @@ class SummaryReportGenerator:
         explanation.append("=" * 50)
         explanation.append("Shows whether treatments helped, harmed, or had no effect.")
         
-        outcomes_file = os.path.join(self.tables_dir, self.files['outcomes'])
+        outcomes_file = self._table_path('outcomes')
         if os.path.exists(outcomes_file):
-            df = pd.read_csv(outcomes_file)
+            df = read_table(outcomes_file, columns=['outcome_direction', 'count'])
             
             # Overall outcomes
             overall = df.groupby('outcome_direction')['count'].sum().sort_values(ascending=False)
@@ -161,12 +173,13 @@ class SummaryReportGenerator:
         }
         
         for filename, description in file_explanations.items():
-            filepath = os.path.join(self.tables_dir, filename)
+            # The same table may have been written as parquet or feather
+            filepath = find_table(self.tables_dir, os.path.splitext(filename)[0], self.table_format)
             if os.path.exists(filepath):
                 size = os.path.getsize(filepath)
-                df = pd.read_csv(filepath)
+                df = read_table(filepath)
                 explanation.append(f"\n{description}")
-                explanation.append(f"   File: {filename}")
+                explanation.append(f"   File: {os.path.basename(filepath)}")
                 explanation.append(f"   Rows: {len(df)}, Size: {size//1024}KB")
         
         return "\n".join(explanation)
@@ -179,9 +192,9 @@ class SummaryReportGenerator:
         insights.append("=" * 60)
         
         # Load data
-        stratum_file = os.path.join(self.tables_dir, self.files['stratum_summary'])
+        stratum_file = self._table_path('stratum_summary')
         if os.path.exists(stratum_file):
-            df = pd.read_csv(stratum_file)
+            df = read_table(stratum_file, columns=['stratum_id', 'unique_studies'])
             
             insights.append(f"\n🔬 RESEARCH PRIORITIES:")
             
@@ -206,6 +219,10 @@ class SummaryReportGenerator:
             avg_studies = total_studies / total_groups
             insights.append(f"   • Average {avg_studies:.1f} studies per population group")
             insights.append(f"   • {len(df[df['unique_studies'] >= 10])} groups have adequate sample sizes")
+            if self.profile is not None:
+                for field, stats in self.profile.completeness(['population', 'risk_factors', 'symptoms',
+                                                               'treatments', 'outcomes']).items():
+                    insights.append(f"   • {field} extracted for {stats['percentage']:.1f}% of records")
         
         return "\n".join(insights)
     
@@ -248,7 +265,7 @@ def main():
     import sys
     
     if len(sys.argv) < 2:
-        print("Usage: python summary_report.py <tables_dir> [output_file]")
+        print("Usage (from src): python -m reporting.summary_report <tables_dir> [output_file]")
         sys.exit(1)
     
     tables_dir = sys.argv[1]
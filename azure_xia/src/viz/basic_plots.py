@@ -10,10 +10,12 @@ import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
 import numpy as np
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 import logging
 import os
 
+from analysis.item_matrix import StratumItemMatrix
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -25,6 +27,9 @@ sns.set_palette("husl")
 class BasicPlotter:
     """Creates basic plots for stratum analysis."""
     
+    # Columns of the normalized table used by the plots (the Sankey flow)
+    NORMALIZED_COLUMNS = ['age_group', 'treatment_category', 'outcome_direction']
+    
     def __init__(self, output_dir: str):
         """Initialize plotter with output directory."""
         self.output_dir = output_dir
@@ -65,16 +70,26 @@ class BasicPlotter:
         
         logger.info(f"Saved stratum overview to {self.output_dir}/stratum_overview.png")
     
-    def create_top_risk_factors_chart(self, risk_factors_df: pd.DataFrame, top_n: int = 10):
-        """Create bar chart of top risk factors by stratum."""
+    def create_top_risk_factors_chart(self, risk_factors: Union[pd.DataFrame, StratumItemMatrix], top_n: int = 10):
+        """Create bar chart of top risk factors by stratum.
+        
+        Args:
+            risk_factors: Risk factor matrix, or the long risk_factors table
+            top_n: Number of risk factors per stratum
+        """
         logger.info(f"Creating top {top_n} risk factors chart")
         
-        if risk_factors_df.empty:
+        if isinstance(risk_factors, pd.DataFrame):
+            if risk_factors.empty:
+                logger.warning("No risk factors data available")
+                return
+            risk_factors = StratumItemMatrix.from_table(risk_factors, 'risk_factor')
+        if risk_factors.nnz == 0:
             logger.warning("No risk factors data available")
             return
         
         # Get top strata by study count
-        top_strata = risk_factors_df.groupby('stratum_id')['total_studies'].first().nlargest(5).index
+        top_strata = risk_factors.largest_strata(5)
         
         fig, axes = plt.subplots(2, 3, figsize=(18, 12))
         axes = axes.flatten()
@@ -82,14 +97,13 @@ class BasicPlotter:
         for i, stratum in enumerate(top_strata):
             if i >= 6:
                 break
-                
-            stratum_data = risk_factors_df[risk_factors_df['stratum_id'] == stratum]
-            top_factors = stratum_data.nlargest(top_n, 'percentage')
+            
+            top_factors = risk_factors.top_n(stratum, top_n)
             
             ax = axes[i]
             bars = ax.barh(range(len(top_factors)), top_factors['percentage'])
             ax.set_yticks(range(len(top_factors)))
-            ax.set_yticklabels([f[:30] + '...' if len(f) > 30 else f for f in top_factors['risk_factor']], fontsize=8)
+            ax.set_yticklabels([f[:30] + '...' if len(f) > 30 else f for f in top_factors['item']], fontsize=8)
             ax.set_xlabel('Percentage of Studies')
             ax.set_title(f'Top Risk Factors\n{stratum}', fontsize=10)
             ax.grid(axis='x', alpha=0.3)
@@ -134,40 +148,29 @@ class BasicPlotter:
         
         logger.info(f"Saved treatment outcomes heatmap to {self.output_dir}/treatment_outcomes_heatmap.png")
     
-    def create_symptoms_comparison(self, symptoms_df: pd.DataFrame, top_n: int = 8):
-        """Create comparison of symptoms across strata."""
+    def create_symptoms_comparison(self, symptoms: Union[pd.DataFrame, StratumItemMatrix], top_n: int = 8):
+        """Create comparison of symptoms across strata.
+        
+        Args:
+            symptoms: Symptom matrix, or the long symptoms table
+            top_n: Number of symptoms to compare
+        """
         logger.info("Creating symptoms comparison chart")
         
-        if symptoms_df.empty:
+        if isinstance(symptoms, pd.DataFrame):
+            if symptoms.empty:
+                logger.warning("No symptoms data available")
+                return
+            symptoms = StratumItemMatrix.from_table(symptoms, 'symptom')
+        if symptoms.nnz == 0:
             logger.warning("No symptoms data available")
             return
         
-        # Get top symptoms overall
-        top_symptoms = symptoms_df.groupby('symptom')['count'].sum().nlargest(top_n).index
-        
-        # Get top strata
-        top_strata = symptoms_df.groupby('stratum_id')['total_studies'].first().nlargest(5).index
-        
-        # Create comparison data
-        comparison_data = []
-        for stratum in top_strata:
-            stratum_data = symptoms_df[symptoms_df['stratum_id'] == stratum]
-            for symptom in top_symptoms:
-                symptom_data = stratum_data[stratum_data['symptom'] == symptom]
-                percentage = symptom_data['percentage'].sum() if not symptom_data.empty else 0
-                comparison_data.append({
-                    'stratum': stratum,
-                    'symptom': symptom,
-                    'percentage': percentage
-                })
-        
-        if not comparison_data:
-            logger.warning("No comparison data available")
-            return
-        
-        comp_df = pd.DataFrame(comparison_data)
-        heatmap_data = comp_df.pivot(index='stratum', columns='symptom', values='percentage')
-        heatmap_data = heatmap_data.fillna(0)
+        # Top symptoms overall, densified only for the block of the largest strata
+        top_symptoms = symptoms.top_items(top_n)
+        top_strata = symptoms.largest_strata(5)
+        heatmap_data = symptoms.pivot(top_strata, top_symptoms, values='percentage')
+        heatmap_data = heatmap_data.sort_index().sort_index(axis=1).rename_axis(index='stratum', columns='symptom')
         
         plt.figure(figsize=(12, 8))
         sns.heatmap(heatmap_data, annot=True, fmt='.1f', cmap='Blues', cbar_kws={'label': 'Percentage'})
@@ -269,8 +272,12 @@ class BasicPlotter:
         fig.write_html(f"{self.output_dir}/sankey_flow.html")
         logger.info(f"Saved Sankey diagram to {self.output_dir}/sankey_flow.html")
     
-    def create_all_visualizations(self, analysis_results: Dict[str, pd.DataFrame], normalized_df: pd.DataFrame):
-        """Create all visualizations."""
+    def create_all_visualizations(self, analysis_results: Dict[str, Union[pd.DataFrame, StratumItemMatrix]],
+                                  normalized_df: pd.DataFrame):
+        """Create all visualizations.
+        
+        Risk factors and symptoms may be given as item matrices or as their long tables.
+        """
         logger.info("Creating all visualizations")
         
         # Stratum overview
@@ -300,7 +307,7 @@ def main():
     import sys
     
     if len(sys.argv) != 4:
-        print("Usage: python basic_plots.py <tables_dir> <normalized_csv> <output_dir>")
+        print("Usage (from src): python -m viz.basic_plots <tables_dir> <normalized_csv> <output_dir>")
         sys.exit(1)
     
     tables_dir = sys.argv[1]
@@ -14,6 +14,8 @@ from typing import Dict, List, Optional
 import logging
 import os
 
+from prepare.keyword_index import KeywordIndex
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -34,6 +36,18 @@ class EnhancedPlotter:
         """Initialize plotter with output directory."""
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
+        
+        # Cleaner Sankey names for treatments, first matching key wins
+        self.sankey_treatment_names = {
+            'cognitive behavioral therapy': 'CBT',
+            'acceptance and commitment therapy': 'ACT',
+            'dialectical behavior therapy': 'DBT',
+            'psychotherapy': 'Psychotherapy',
+            'mindfulness': 'Mindfulness',
+            'exercise': 'Exercise Therapy',
+            'medication': 'Medication'
+        }
+        self.sankey_treatment_index = KeywordIndex({key: [key] for key in self.sankey_treatment_names})
     
     def create_clear_stratum_overview(self, stratum_summary: pd.DataFrame):
         """Create clear overview explaining studies vs records."""
@@ -342,20 +356,9 @@ class EnhancedPlotter:
         treatment_clean = str(treatment).strip()
         
         # Map to cleaner names
-        mapping = {
-            'cognitive behavioral therapy': 'CBT',
-            'acceptance and commitment therapy': 'ACT',
-            'dialectical behavior therapy': 'DBT',
-            'psychotherapy': 'Psychotherapy',
-            'mindfulness': 'Mindfulness',
-            'exercise': 'Exercise Therapy',
-            'medication': 'Medication'
-        }
-        
-        treatment_lower = treatment_clean.lower()
-        for key, value in mapping.items():
-            if key in treatment_lower:
-                return value
+        key = self.sankey_treatment_index.first_match(treatment_clean.lower())
+        if key is not None:
+            return self.sankey_treatment_names[key]
         
         # If no mapping, clean it up
         if len(treatment_clean) > 15:
@@ -431,7 +434,7 @@ def main():
     import sys
     
     if len(sys.argv) != 4:
-        print("Usage: python enhanced_plots.py <tables_dir> <normalized_csv> <output_dir>")
+        print("Usage (from src): python -m viz.enhanced_plots <tables_dir> <normalized_csv> <output_dir>")
         sys.exit(1)
     
     tables_dir = sys.argv[1]
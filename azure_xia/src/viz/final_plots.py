@@ -13,6 +13,8 @@ import logging
 import os
 import re
 
+from prepare.keyword_index import KeywordIndex
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -33,6 +35,18 @@ class FinalPlotter:
         """Initialize plotter."""
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
+        
+        # Key concepts for long or generic risk factors, checked in order
+        self.risk_factor_groups = {
+            'Stress-related factors': ['stress'],
+            'Anxiety-related factors': ['anxiety'],
+            'Depression-related factors': ['depression'],
+            'Social factors': ['social'],
+            'Trauma-related factors': ['trauma'],
+            'Family factors': ['family', 'parent'],
+            'Economic factors': ['economic', 'financial']
+        }
+        self.risk_factor_index = KeywordIndex(self.risk_factor_groups)
     
     def clean_risk_factor_name(self, text: str) -> str:
         """Clean risk factor names - remove redundant triggers/risk factors."""
@@ -64,22 +78,7 @@ class FinalPlotter:
         # If still too long or generic, categorize
         if len(text_clean) > 50 or text_clean.lower() in ['', 'triggers', 'risk factors', 'various', 'multiple']:
             # Try to extract key concepts
-            if 'stress' in text_clean.lower():
-                return 'Stress-related factors'
-            elif 'anxiety' in text_clean.lower():
-                return 'Anxiety-related factors'
-            elif 'depression' in text_clean.lower():
-                return 'Depression-related factors'
-            elif 'social' in text_clean.lower():
-                return 'Social factors'
-            elif 'trauma' in text_clean.lower():
-                return 'Trauma-related factors'
-            elif 'family' in text_clean.lower() or 'parent' in text_clean.lower():
-                return 'Family factors'
-            elif 'economic' in text_clean.lower() or 'financial' in text_clean.lower():
-                return 'Economic factors'
-            else:
-                return 'Other factors'
+            return self.risk_factor_index.first_match(text_clean.lower(), 'Other factors')
         
         # Limit to reasonable length for display
         if len(text_clean) > 35:
@@ -333,7 +332,7 @@ def main():
     import sys
     
     if len(sys.argv) != 3:
-        print("Usage: python final_plots.py <tables_dir> <output_dir>")
+        print("Usage (from src): python -m viz.final_plots <tables_dir> <output_dir>")
         sys.exit(1)
     
     tables_dir = sys.argv[1]